@@ -0,0 +1,102 @@
+"""
+Benchmarks for core geometry and metric hot paths
+
+Usage:
+    python -m benchmarks.core --sizes 10 100 1000 --output core.json
+    python -m benchmarks.core --compare core.json  # exit code 1 on regressions
+"""
+import argparse
+import functools
+import inspect
+import logging
+import sys
+
+from locintel.core.datamodel.geo import Geometry
+from locintel.routes.metrics.geometry import GeometryComparator
+
+from .fixtures import GEOMETRY_SOURCES
+from .harness import Case, add_arguments, report, run_cases
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+# largest sizes that complete in reasonable time (recursive, quadratic or per-point utm conversion algorithms)
+COMPARATOR_MAX_SIZES = {
+    "frechet": 200,  # recursion depth ~ len(geo1) + len(geo2)
+    "dtw": 200,
+    "levenshtein": 1000,
+    "hausdorff": 10000,
+    "bocs": 10000,
+    "pmr": 10000,
+}
+
+
+def get_cases(source="synthetic"):
+    make_geometry = functools.lru_cache(maxsize=None)(GEOMETRY_SOURCES[source])
+
+    def geometry(size):
+        return (make_geometry(size),)
+
+    def geometry_pair(size):
+        geo = make_geometry(size)
+        return geo, geo.shift(5, 5)
+
+    cases = [
+        Case(
+            "geometry_construction",
+            lambda size: (make_geometry(size).to_lat_lng_tuples(),),
+            Geometry.from_lat_lng_tuples,
+        ),
+        Case(
+            "to_linestring_utm",
+            geometry,
+            lambda geo: geo.to_linestring(convert_to_utm=True),
+        ),
+        Case("add_noise", geometry, lambda geo: geo.add_noise(seed=1)),
+        Case("subsample", geometry, lambda geo: geo.subsample(period=5)),
+        Case("polyline_encode", geometry, lambda geo: geo.to_polyline()),
+        Case(
+            "polyline_decode",
+            lambda size: (make_geometry(size).to_polyline(),),
+            Geometry.from_polyline,
+        ),
+    ]
+
+    for name, method in inspect.getmembers(GeometryComparator, inspect.isfunction):
+        if name.startswith("compare_"):
+            method_name = name[len("compare_") :]
+            cases.append(
+                Case(
+                    name,
+                    geometry_pair,
+                    method,
+                    max_size=COMPARATOR_MAX_SIZES.get(method_name),
+                )
+            )
+
+    return cases
+
+
+def main(argv=None):
+    parser = add_arguments(
+        argparse.ArgumentParser(description=__doc__.splitlines()[1]), DEFAULT_SIZES
+    )
+    parser.add_argument(
+        "--source", choices=sorted(GEOMETRY_SOURCES), default="synthetic"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    results = run_cases(
+        get_cases(args.source),
+        args.sizes,
+        repeat=args.repeat,
+        min_time=args.min_time,
+        select=args.select,
+    )
+    for result in results:
+        result["source"] = args.source
+    return report(args, results, suite="core")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
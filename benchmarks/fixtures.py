@@ -0,0 +1,46 @@
+"""
+Reference inputs for benchmarks, generated deterministically
+"""
+import os
+
+import numpy as np
+
+from locintel.core.datamodel.geo import Geometry
+
+DEMOS_DATA = os.path.join(os.path.dirname(__file__), "..", "demos", "data")
+
+
+def synthetic_geometry(size, seed=1, step=10, start=(52.507485, 13.329857)):
+    """
+    Random walk geometry with size points, starting at Geometry.dummy() start point
+
+    :param size: number of points
+    :param seed: random seed
+    :param step: distance between consecutive points, in meters
+    :param start: (lat, lng) of first point
+    """
+    generator = np.random.RandomState(seed)
+    headings = np.cumsum(generator.normal(0, 0.3, size - 1))
+    lat_steps = step * np.cos(headings) / 111320
+    lng_steps = step * np.sin(headings) / (111320 * np.cos(np.radians(start[0])))
+    lats = np.concatenate([[start[0]], start[0] + np.cumsum(lat_steps)])
+    lngs = np.concatenate([[start[1]], start[1] + np.cumsum(lng_steps)])
+    return Geometry.from_lat_lng_tuples(zip(lats.tolist(), lngs.tolist()))
+
+
+def demo_geometry(size, name="test_noisy_gps_very_long_1"):
+    """
+    Geometry from demos/data GeoJSON, linearly resampled to size points
+    """
+    coords = np.array(
+        Geometry.from_geojson(
+            os.path.join(DEMOS_DATA, f"{name}.json")
+        ).to_lat_lng_tuples()
+    )
+    positions = np.linspace(0, len(coords) - 1, size)
+    lats = np.interp(positions, np.arange(len(coords)), coords[:, 0])
+    lngs = np.interp(positions, np.arange(len(coords)), coords[:, 1])
+    return Geometry.from_lat_lng_tuples(zip(lats.tolist(), lngs.tolist()))
+
+
+GEOMETRY_SOURCES = {"synthetic": synthetic_geometry, "demos": demo_geometry}
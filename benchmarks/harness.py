@@ -0,0 +1,155 @@
+"""
+Minimal benchmarking harness: timed cases over parameterised sizes, with machine-readable (JSON) results
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import time
+from typing import Callable
+
+
+@dataclass
+class Case:
+    """
+    Benchmark case
+
+    :param name: case name, unique within a suite
+    :param setup: callable receiving size and returning tuple of arguments for func (not timed)
+    :param func: callable to time
+    :param max_size: largest size for which case runs (e.g. for quadratic algorithms), None for no limit
+    """
+
+    name: str
+    setup: Callable
+    func: Callable
+    max_size: int = None
+    tags: dict = field(default_factory=dict)
+
+
+def run_cases(cases, sizes, repeat=5, min_time=0.0, select=None):
+    """
+    Runs benchmark cases for all sizes, returning one result dict per (case, size)
+
+    :param cases: sequence of Case objects
+    :param sizes: sequence of input sizes
+    :param repeat: number of timed runs per (case, size)
+    :param min_time: keep repeating until total timed duration exceeds this value, in seconds
+    :param select: optional sequence of case names to run
+    """
+    results = list()
+    for case in cases:
+        if select and case.name not in select:
+            continue
+
+        for size in sizes:
+            result = {"name": case.name, "size": size, **case.tags}
+            if case.max_size is not None and size > case.max_size:
+                result["skipped"] = f"size above max_size ({case.max_size})"
+                results.append(result)
+                continue
+
+            args = case.setup(size)
+            timings = list()
+            while len(timings) < repeat or sum(timings) < min_time:
+                start = time.perf_counter()
+                case.func(*args)
+                timings.append(time.perf_counter() - start)
+
+            result.update(
+                repeat=len(timings),
+                min=min(timings),
+                median=statistics.median(timings),
+                mean=statistics.mean(timings),
+                stdev=statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            )
+            logging.info(f"{case.name} (n={size}): {result['median']:.6f}s")
+            results.append(result)
+
+    return results
+
+
+def environment():
+    try:
+        commit = (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "date": datetime.now().isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def write_results(results, filename, suite):
+    with open(filename, "w") as f:
+        json.dump(
+            {"suite": suite, "environment": environment(), "results": results},
+            f,
+            indent=2,
+        )
+
+
+def compare_results(baseline_filename, results, threshold=1.2):
+    """
+    Compares results against a previous results file, by median time
+
+    :return: list of (name, size, ratio) for cases slower than threshold x baseline
+    """
+    with open(baseline_filename) as f:
+        baseline = {
+            (r["name"], r["size"]): r for r in json.load(f)["results"] if "median" in r
+        }
+
+    regressions = list()
+    for result in results:
+        previous = baseline.get((result["name"], result["size"]))
+        if previous and "median" in result and previous["median"] > 0:
+            ratio = result["median"] / previous["median"]
+            if ratio > threshold:
+                regressions.append((result["name"], result["size"], ratio))
+    return regressions
+
+
+def add_arguments(parser, default_sizes):
+    parser.add_argument("--sizes", type=int, nargs="+", default=default_sizes)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.0)
+    parser.add_argument("--select", nargs="+", help="only run cases with these names")
+    parser.add_argument("--output", help="JSON file to write results to")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2, help="slowdown ratio to report"
+    )
+    return parser
+
+
+def report(args, results, suite):
+    for result in results:
+        if "median" in result:
+            print(f"{result['name']:<30} n={result['size']:<8} {result['median']:.6f}s")
+        else:
+            print(f"{result['name']:<30} n={result['size']:<8} {result['skipped']}")
+
+    if args.output:
+        write_results(results, args.output, suite)
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        for name, size, ratio in regressions:
+            print(f"REGRESSION {name} (n={size}): {ratio:.2f}x slower")
+        return 1 if regressions else 0
+
+    return 0
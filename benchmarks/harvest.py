@@ -0,0 +1,281 @@
+"""
+Load benchmarks for harvesting: routers, matchers and experiments against a local provider stand-in (or any server
+implementing its endpoints), reporting throughput and tail latency per concurrency level
+
+Usage:
+    python -m benchmarks.harvest --sizes 1 8 64 --requests 500 --latency lognormal:0.05:0.5 --output harvest.json
+    python -m benchmarks.harvest --compare harvest.json  # exit code 1 on throughput regressions
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
+import logging
+import sys
+import time
+
+import numpy as np
+
+from locintel.core.datamodel.matching import MatchPlan, MatchWaypoint
+from locintel.core.datamodel.routing import RoutePlan, Waypoint
+from locintel.harvest import routes
+from locintel.harvest.aio import AsyncMapboxRouter
+from locintel.harvest.matches import MapboxMatcher
+from locintel.harvest.routes import GoogleRouter, MapboxRouter, run_experiment
+from locintel.harvest.sessions import HarvestSession
+
+from .fixtures import synthetic_geometry
+from .harness import add_arguments, compare_results, write_results
+from .standin import (
+    StandInProcess,
+    add_arguments as add_standin_arguments,
+    fetch_stats,
+    reset_stats,
+    server_arguments,
+)
+
+DEFAULT_CONCURRENCY = [1, 8, 32]
+
+
+def route_plans(n, seed=1):
+    generator = np.random.RandomState(seed)
+    coords = generator.uniform((52.4, 13.2), (52.6, 13.5), (n, 2, 2))
+    return [
+        RoutePlan(Waypoint(*start), Waypoint(*end), metadata={"name": i})
+        for i, (start, end) in enumerate(coords.tolist())
+    ]
+
+
+def match_plans(n, points=50):
+    return [
+        MatchPlan(
+            [
+                MatchWaypoint(lat, lng, time=1600000000 + j)
+                for j, (lat, lng) in enumerate(
+                    synthetic_geometry(points, seed=i).to_lat_lng_tuples()
+                )
+            ]
+        )
+        for i in range(n)
+    ]
+
+
+def endpoints(url):
+    return {
+        "mapbox": f"{url}/{{vehicle_type}}/v1/route",
+        "google": f"{url}/maps/api/directions/json?",
+        "matching": f"{url}/car/v1/match",
+    }
+
+
+@contextlib.contextmanager
+def stand_in_routers(url):
+    """
+    Points ROUTERS registry (used by run_experiment) to the stand-in, for this process and processes forked from it
+    """
+    previous = dict(routes.ROUTERS)
+    routes.ROUTERS.update(
+        {
+            "mapbox": functools.partial(
+                MapboxRouter, endpoint=endpoints(url)["mapbox"]
+            ),
+            "google": functools.partial(
+                GoogleRouter, endpoint=endpoints(url)["google"], key="benchmark"
+            ),
+        }
+    )
+    try:
+        yield
+    finally:
+        routes.ROUTERS.clear()
+        routes.ROUTERS.update(previous)
+
+
+def _threaded(make_calculate, plans):
+    """
+    Case calculating plans with a thread pool of size concurrency, timing each call
+
+    :param make_calculate: function (url, concurrency) -> function calculating a plan
+    """
+
+    def run(url, concurrency):
+        calculate = make_calculate(url, concurrency)
+
+        def timed(plan):
+            start = time.perf_counter()
+            try:
+                calculate(plan)
+                return time.perf_counter() - start, None
+            except Exception as e:
+                return time.perf_counter() - start, e
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(timed, plans))
+
+    return run
+
+
+def _async_mapbox_router(plans):
+    def run(url, concurrency):
+        router = AsyncMapboxRouter(endpoint=endpoints(url)["mapbox"])
+        results = asyncio.run(
+            router.calculate_many(plans, concurrency, return_exceptions=True)
+        )
+        return [
+            (None, result)
+            if isinstance(result, Exception)
+            else (result.metadata["timing"]["total"], None)
+            for result in results
+        ]
+
+    return run
+
+
+def _experiment(plans, adaptive=False):
+    """
+    run_experiment over mapbox and google (one request per provider and plan), latencies from route telemetry
+    """
+
+    def run(url, concurrency):
+        with stand_in_routers(url):
+            try:
+                result = run_experiment(
+                    ["mapbox", "google"], plans, jobs=concurrency, adaptive=adaptive
+                )
+            except Exception as e:
+                return [(None, e)]
+        return [
+            (route.metadata["timing"]["total"], None)
+            for test in result
+            for route in test.routes.values()
+        ]
+
+    return run
+
+
+def get_cases(requests):
+    plans = route_plans(requests)
+    return {
+        "mapbox_router": _threaded(
+            lambda url, concurrency: MapboxRouter(
+                endpoint=endpoints(url)["mapbox"],
+                session=HarvestSession(pool_maxsize=concurrency),
+            ).calculate,
+            plans,
+        ),
+        "google_router": _threaded(
+            lambda url, concurrency: GoogleRouter(
+                endpoint=endpoints(url)["google"],
+                key="benchmark",
+                session=HarvestSession(pool_maxsize=concurrency),
+            ).calculate,
+            plans,
+        ),
+        "mapbox_matcher": _threaded(
+            lambda url, concurrency: MapboxMatcher(
+                endpoint=endpoints(url)["matching"],
+                session=HarvestSession(pool_maxsize=concurrency),
+            ).calculate,
+            match_plans(requests),
+        ),
+        "async_mapbox_router": _async_mapbox_router(plans),
+        "run_experiment": _experiment(plans[: max(requests // 2, 1)]),
+        "run_experiment_adaptive": _experiment(
+            plans[: max(requests // 2, 1)], adaptive=True
+        ),
+    }
+
+
+def run_load(cases, url, concurrencies, select=None):
+    """
+    Runs every case at every concurrency level, returning one result dict per (case, concurrency)
+
+    Results hold throughput (successful requests per second), latency percentiles of successful requests and number
+    of errors, and median (seconds per successful request, the inverse of throughput, so that results can be
+    compared with benchmarks.harness.compare_results).
+    """
+    results = list()
+    for name, case in cases.items():
+        if select and name not in select:
+            continue
+        for concurrency in concurrencies:
+            stand_in = fetch_stats(url) is not None
+            if stand_in:
+                reset_stats(url)
+            start = time.perf_counter()
+            outcomes = case(url, concurrency)
+            elapsed = time.perf_counter() - start
+
+            latencies = [latency for latency, error in outcomes if error is None]
+            errors = [error for _, error in outcomes if error is not None]
+            result = {
+                "name": name,
+                "size": concurrency,
+                "requests": len(outcomes),
+                "errors": len(errors),
+                "elapsed": elapsed,
+                "throughput": len(latencies) / elapsed,
+            }
+            if latencies:
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+                result.update(
+                    p50=p50, p95=p95, p99=p99, median=elapsed / len(latencies)
+                )
+            if errors:
+                result["first_error"] = repr(errors[0])
+            if stand_in:
+                result["server"] = fetch_stats(url)
+            logging.info(
+                f"{name} (concurrency={concurrency}): {result['throughput']:.1f} req/s"
+            )
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = add_standin_arguments(
+        add_arguments(
+            argparse.ArgumentParser(description=__doc__.splitlines()[1]),
+            DEFAULT_CONCURRENCY,
+        )
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="plans per case and concurrency"
+    )
+    parser.add_argument(
+        "--url", help="use running stand-in (or compatible) server instead of one"
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    with contextlib.ExitStack() as stack:
+        url = args.url
+        if url is None:
+            url = stack.enter_context(StandInProcess(**server_arguments(args))).url
+        results = run_load(get_cases(args.requests), url, args.sizes, args.select)
+
+    for result in results:
+        tails = (
+            f"p50={result['p50']:.4f}s p95={result['p95']:.4f}s p99={result['p99']:.4f}s"
+            if "p50" in result
+            else ""
+        )
+        print(
+            f"{result['name']:<25} c={result['size']:<5} {result['throughput']:>9.1f} req/s "
+            f"{tails} errors={result['errors']}"
+        )
+
+    if args.output:
+        write_results(results, args.output, suite="harvest")
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.threshold)
+        for name, size, ratio in regressions:
+            print(f"REGRESSION {name} (c={size}): {1 / ratio:.2f}x throughput")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+"""
+Local stand-in for Mapbox routing/matching and Google Directions endpoints, with configurable latency, errors and
+throttling, to load-test harvesting without network access
+
+Usage:
+    python -m benchmarks.standin --port 8000 --latency lognormal:0.05:0.5 --error-rate 0.01 --max-concurrency 50
+
+Endpoints (responses follow the shape of tests/harvest fixtures, with geometries along the requested waypoints):
+    POST /<vehicle_type>/v1/route       Mapbox routing (MapboxRouter endpoint "<url>/{vehicle_type}/v1/route")
+    POST /<vehicle_type>/v1/match       Mapbox matching (MapboxMatcher endpoint "<url>/car/v1/match")
+    GET  /maps/api/directions/json      Google Directions (GoogleRouter endpoint "<url>/maps/api/directions/json?")
+"""
+import argparse
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import multiprocessing
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import requests
+
+from locintel.core.algorithms.geo import haversine_distances
+from locintel.core.datamodel.geo import Geometry
+
+SPEED = 13.9  # m/s, for route durations
+
+
+class Latency(object):
+    def __init__(self, distribution="constant", *params):
+        """
+        Response latency distribution, in seconds
+
+        :param distribution: "constant" (value), "uniform" (low, high) or "lognormal" (median, sigma)
+        :param params: distribution parameters
+        """
+        if distribution not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {distribution}")
+        self.distribution = distribution
+        self.params = [float(param) for param in params] or [0.0]
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Parses "distribution:param[:param]" specification, e.g. "lognormal:0.05:0.5", or a constant "0.05"
+        """
+        parts = str(spec).split(":")
+        if len(parts) == 1:
+            return cls("constant", parts[0])
+        return cls(parts[0], *parts[1:])
+
+    def sample(self, generator=random):
+        if self.distribution == "uniform":
+            return generator.uniform(*self.params)
+        if self.distribution == "lognormal":
+            median, sigma = self.params
+            return median * generator.lognormvariate(0, sigma)
+        return self.params[0]
+
+    def __repr__(self):
+        return f"Latency({self.distribution}:{':'.join(map(str, self.params))})"
+
+
+def _interpolate(lats, lngs, points):
+    """
+    points (lat, lng) per leg, linearly interpolated between consecutive waypoints
+    """
+    legs = list()
+    for i in range(len(lats) - 1):
+        fractions = np.linspace(0, 1, points)
+        legs.append(
+            list(
+                zip(
+                    (lats[i] + fractions * (lats[i + 1] - lats[i])).tolist(),
+                    (lngs[i] + fractions * (lngs[i + 1] - lngs[i])).tolist(),
+                )
+            )
+        )
+    return legs
+
+
+def _leg_distances(lats, lngs):
+    return haversine_distances(lats[:-1], lngs[:-1], lats[1:], lngs[1:]).tolist()
+
+
+def mapbox_route_response(locations, points=50):
+    lats = np.array([location["lat"] for location in locations], dtype=float)
+    lngs = np.array([location["lon"] for location in locations], dtype=float)
+    distance = sum(_leg_distances(lats, lngs))
+    return {
+        "routes": [
+            {
+                "legs": [
+                    {"geometry": [{"lat": lat, "lon": lng} for lat, lng in leg]}
+                    for leg in _interpolate(lats, lngs, points)
+                ],
+                "totalDistance": distance,
+                "totalDuration": distance / SPEED,
+            }
+        ]
+    }
+
+
+def google_directions_response(origin, destination, points=50):
+    lats, lngs = (np.array(coords, dtype=float) for coords in zip(origin, destination))
+    (leg,) = _interpolate(lats, lngs, points)
+    (distance,) = _leg_distances(lats, lngs)
+    return {
+        "routes": [
+            {
+                "legs": [
+                    {
+                        "distance": {"value": distance},
+                        "duration": {"value": distance / SPEED},
+                    }
+                ],
+                "overview_polyline": {
+                    "points": Geometry.from_lat_lng_tuples(leg).to_polyline()
+                },
+            }
+        ],
+        "status": "OK",
+    }
+
+
+def mapbox_match_response(locations):
+    lats = np.array([location["lat"] for location in locations], dtype=float)
+    lngs = np.array([location["lng"] for location in locations], dtype=float)
+    distances = _leg_distances(lats, lngs)
+    points = list(zip(lats.tolist(), lngs.tolist()))
+    return {
+        "code": "Ok",
+        "matchNumber": 1,
+        "matchings": [
+            {
+                "confidence": 0.9,
+                "legs": [
+                    {
+                        "traceFromIndex": i,
+                        "traceToIndex": i + 1,
+                        "duration": distance / SPEED,
+                        "distance": distance,
+                        "geometry": [
+                            {"lat": points[i][0], "lon": points[i][1]},
+                            {"lat": points[i + 1][0], "lon": points[i + 1][1]},
+                        ],
+                    }
+                    for i, distance in enumerate(distances)
+                ],
+            }
+        ],
+        "tracepoints": [
+            {"snapDistance": 0, "location": {"lon": lng, "lat": lat}}
+            for lat, lng in points
+        ],
+    }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = (
+        1024  # listen backlog, for benchmarks opening hundreds of connections at once
+    )
+
+
+class StandInServer(object):
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=None,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        max_concurrency=None,
+        retry_after=None,
+        points=50,
+        seed=None,
+    ):
+        """
+        Threaded HTTP/1.1 (keep-alive) server standing in for routing and matching providers
+
+        Every request waits for a latency sample, then fails with 429 (with probability throttle_rate, or when more
+        than max_concurrency requests are in flight) or 500 (with probability error_rate), or answers a provider
+        response built from the requested waypoints.
+
+        :param host: interface to listen on
+        :param port: port to listen on (0 for any free port)
+        :param latency: Latency object, or specification string (see Latency.parse)
+        :param error_rate: probability of 500 responses
+        :param throttle_rate: probability of 429 responses
+        :param max_concurrency: number of requests in flight above which requests are throttled (None for no limit)
+        :param retry_after: Retry-After header of 429 responses, in whole seconds (None for no header)
+        :param points: number of geometry points per route leg
+        :param seed: random seed for latencies and failures
+        """
+        self.latency = (
+            latency if isinstance(latency, Latency) else Latency.parse(latency or 0)
+        )
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.points = points
+        self.random = random.Random(seed)
+        self.counts = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"Stand-in provider server listening on {self.url}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def stats(self):
+        """
+        :return: dict with number of requests per response status, and maximum number of requests in flight
+        """
+        with self._lock:
+            return {"max_in_flight": self.max_in_flight, **self.counts}
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.max_in_flight = 0
+
+    def respond(self, method, path, query, body):
+        """
+        :return: (status, response dict or None)
+        """
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            overloaded = (
+                self.max_concurrency is not None
+                and self.in_flight > self.max_concurrency
+            )
+            latency = self.latency.sample(self.random)
+            draw = self.random.random()
+        try:
+            time.sleep(max(latency, 0))
+            if overloaded or draw < self.throttle_rate:
+                return 429, None
+            if draw < self.throttle_rate + self.error_rate:
+                return 500, None
+            return self._route(method, path, query, body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _route(self, method, path, query, body):
+        try:
+            if method == "POST" and path.endswith("/v1/route"):
+                return 200, mapbox_route_response(body["locations"], self.points)
+            if method == "POST" and path.endswith("/v1/match"):
+                return 200, mapbox_match_response(body["locations"])
+            if method == "GET" and path.endswith("/directions/json"):
+                origin, destination = (
+                    [float(value) for value in query[key][0].split(",")]
+                    for key in ("origin", "destination")
+                )
+                return (
+                    200,
+                    google_directions_response(origin, destination, self.points),
+                )
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"message": repr(e)}
+        return 404, {"message": f"Unknown endpoint {method} {path}"}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body are written separately
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    body = None
+                url = urlparse(self.path)
+                if url.path == "/_stats":
+                    status, response = 200, server.stats()
+                elif url.path == "/_reset":
+                    server.reset()
+                    status, response = 200, {}
+                else:
+                    status, response = server.respond(
+                        self.command, url.path, parse_qs(url.query), body
+                    )
+                    with server._lock:
+                        server.counts[status] += 1
+
+                data = json.dumps(response).encode() if response is not None else b""
+                self.send_response(status)
+                if status == 429 and server.retry_after is not None:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--latency",
+        default="0",
+        help='latency distribution, e.g. "0.05", "uniform:0.01:0.1" or "lognormal:0.05:0.5" (seconds)',
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int)
+    parser.add_argument("--retry-after", type=int)
+    parser.add_argument("--points", type=int, default=50)
+    parser.add_argument("--seed", type=int)
+    return parser
+
+
+def server_arguments(args):
+    """
+    :return: StandInServer keyword arguments from parsed command line arguments
+    """
+    return {
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "max_concurrency": args.max_concurrency,
+        "retry_after": args.retry_after,
+        "points": args.points,
+        "seed": args.seed,
+    }
+
+
+class StandInProcess(object):
+    def __init__(self, **kwargs):
+        """
+        Context manager running a StandInServer in a child process, so that it does not compete with the benchmarked
+        client for the GIL
+
+        :param kwargs: StandInServer keyword arguments
+        """
+        self.kwargs = kwargs
+        self.url = None
+        self._process = None
+
+    def __enter__(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.kwargs, sender), daemon=True
+        )
+        self._process.start()
+        self.url = receiver.recv()
+        return self
+
+    def __exit__(self, *args):
+        self._process.terminate()
+        self._process.join()
+        self._process = None
+
+
+def _serve(kwargs, connection):
+    server = StandInServer(**kwargs)
+    connection.send(server.url)
+    server.start()._thread.join()
+
+
+def fetch_stats(url):
+    """
+    :return: StandInServer.stats of stand-in server at url, None if url is not a stand-in server
+    """
+    response = requests.get(f"{url}/_stats")
+    return response.json() if response.ok else None
+
+
+def reset_stats(url):
+    requests.post(f"{url}/_reset")
+
+
+def main(argv=None):
+    parser = add_arguments(argparse.ArgumentParser(description=__doc__.splitlines()[1]))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    server = StandInServer(args.host, args.port, **server_arguments(args))
+    server.start()
+    try:
+        while True:
+            time.sleep(60)
+            logging.info(f"Stand-in provider stats: {server.stats()}")
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@ import numpy as np
 
 earth_radius = 6373
 
+# length of a degree of latitude (and of longitude at the equator), in meters
+METERS_PER_DEGREE = 111320
+
 
 def dot_product(v1, v2):
     return sum((a * b) for a, b in zip(v1, v2))
@@ -85,6 +88,74 @@ def measure_distance(coordinates1, coordinates2):
     return radians_to_distance(2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
 
 
+def haversine_distances(lats1, lngs1, lats2, lngs2):
+    """
+    Vectorized great circle distance between arrays of coordinates, in meters
+
+    All parameters are array-likes of degrees, broadcastable against each other
+    """
+    lats1, lngs1, lats2, lngs2 = map(np.radians, (lats1, lngs1, lats2, lngs2))
+    a = (
+        np.sin((lats2 - lats1) / 2) ** 2
+        + np.cos(lats1) * np.cos(lats2) * np.sin((lngs2 - lngs1) / 2) ** 2
+    )
+    return 2 * earth_radius * 1000 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def densify(points, spacing, lengths=None):
+    """
+    Interpolates evenly spaced points along each segment of a line, at most spacing apart
+
+    :param points: (n, 2) array of coordinates
+    :param spacing: maximum distance between consecutive points
+    :param lengths: segment lengths, in spacing units (defaults to euclidean lengths of segments)
+    :return: (dense points, measures) tuple, measures being distances of dense points from start of line
+    """
+    deltas = np.diff(points, axis=0)
+    if lengths is None:
+        lengths = np.linalg.norm(deltas, axis=1)
+    samples = np.maximum(np.ceil(lengths / spacing), 1).astype(int)
+
+    segment_index = np.repeat(np.arange(len(deltas)), samples)
+    offsets = np.arange(samples.sum()) - np.repeat(
+        np.cumsum(samples) - samples, samples
+    )
+    fractions = offsets / np.repeat(samples, samples)
+
+    dense = np.vstack(
+        [
+            points[segment_index] + deltas[segment_index] * fractions[:, None],
+            points[-1:],
+        ]
+    )
+    measures = np.concatenate(
+        [
+            np.cumsum(lengths)[segment_index]
+            - lengths[segment_index] * (1 - fractions),
+            [lengths.sum()],
+        ]
+    )
+    return dense, measures
+
+
+def decode_polyline(polyline_str, precision=5):
+    """
+    Vectorized decoding of an encoded polyline (Google polyline algorithm format), into an (n, 2) array of (lat, lng)
+
+    Every character holds 5 bits of a value (least significant chunk first) and a continuation bit, values are
+    zigzag-encoded deltas from previous point, alternating lat and lng.
+    """
+    chunks = np.frombuffer(polyline_str.encode(), dtype=np.uint8).astype(np.int64) - 63
+    if not len(chunks):
+        return np.empty((0, 2))
+    ends = np.flatnonzero(chunks < 0x20)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = 5 * (np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((chunks & 0x1F) << shifts, starts)
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(values.reshape(-1, 2), axis=0) / 10 ** precision
+
+
 def calculate_angle(a, b, c):
     """
     Returns angle (a-b-c), in degrees
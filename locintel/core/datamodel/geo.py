@@ -2,6 +2,7 @@ from dataclasses import dataclass
 import geojson
 from numbers import Number
 import numpy as np
+import operator
 import polyline
 import shapely.geometry as sg
 from typing import Sequence
@@ -316,3 +317,104 @@ class Geometry(object):
 
     def to_lng_lat_tuples(self):
         return tuple([(p.lng, p.lat) for p in self.coords])
+
+
+class LazyGeometry(Geometry):
+    def __init__(self, decoder, *args):
+        """
+        Geometry kept in its raw (service response) form until first access, then decoded into an (n, 2) array of
+        (lat, lng), from which GeoCoordinate objects are only built if coords are accessed
+
+        Decoder and arguments are pickled instead of the decoded geometry, as long as it was not accessed.
+
+        :param decoder: picklable callable (e.g. module-level function) returning (lat, lng) array-like
+        :param args: decoder arguments (e.g. raw coordinates, encoded polyline)
+        """
+        # Geometry.__init__ is not called, as validating coords would decode them: the array is validated on decoding
+        self._decoder = decoder
+        self._args = args
+        self._array = None
+        self._coords = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._coords is not None:
+            state["_array"] = self.array
+        state["_coords"] = None
+        return state
+
+    @property
+    def is_decoded(self):
+        return self._decoder is None
+
+    @property
+    def array(self):
+        """
+        (n, 2) float array of (lat, lng), built from coords once they were accessed (so that it follows in-place
+        changes of coords, e.g. appends)
+        """
+        if self._coords is not None:
+            return np.array(
+                [(coord.lat, coord.lng) for coord in self._coords], dtype=float
+            ).reshape(-1, 2)
+        if self._array is None:
+            array = np.asarray(self._decoder(*self._args), dtype=float)
+            if len(array) < 2:
+                raise ValueError(
+                    f"{array.tolist()} has less than two GeoCoordinate elements"
+                )
+            self._array = array.reshape(-1, 2)
+            self._decoder = self._args = None
+        return self._array
+
+    @property
+    def coords(self):
+        if self._coords is None:
+            self._coords = [GeoCoordinate(lat, lng) for lat, lng in self.array.tolist()]
+            self._array = None
+        return self._coords
+
+    @coords.setter
+    def coords(self, coordinates):
+        Geometry.coords.fset(self, coordinates)
+        self._decoder = self._args = self._array = None
+
+    def __len__(self):
+        return len(self.array) if self._coords is None else len(self._coords)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyGeometry) and self._coords is other._coords is None:
+            return np.array_equal(self.array, other.array)
+        return super().__eq__(other)
+
+    def __repr__(self):
+        if not self.is_decoded:
+            return "LazyGeometry(not decoded)"
+        return f"LazyGeometry(points={len(self)})"
+
+    def to_lat_lng_tuples(self):
+        if self._coords is not None:
+            return super().to_lat_lng_tuples()
+        return tuple(map(tuple, self.array.tolist()))
+
+    def to_lng_lat_tuples(self):
+        if self._coords is not None:
+            return super().to_lng_lat_tuples()
+        return tuple(map(tuple, self.array[:, ::-1].tolist()))
+
+    def to_linestring(self, convert_to_utm=False):
+        if convert_to_utm or self._coords is not None:
+            return super().to_linestring(convert_to_utm)
+        return sg.LineString(self.array[:, ::-1])
+
+
+def lat_lng_array(point_lists, lat="lat", lng="lon"):
+    """
+    LazyGeometry decoder of lists of coordinate dicts (e.g. route legs), concatenated
+
+    :param point_lists: sequence of sequences of dicts with lat and lng keys (numbers or numeric strings)
+    """
+    getter = operator.itemgetter(lat, lng)
+    return np.array(
+        [getter(point) for points in point_lists for point in points], dtype=float
+    ).reshape(-1, 2)
@@ -0,0 +1,21 @@
+from locintel.core.datamodel.geo import GeoCoordinate
+from locintel.core.datamodel.routing import Waypoint
+
+
+class GeocodedCoordinate(GeoCoordinate):
+    def __init__(self, lat, lng, confidence=None, address=None, query=None, **kwargs):
+        """
+        :param confidence: provider's confidence in the result, in [0, 1] (None if not reported)
+        :param address: address of the result, as formatted by the provider
+        :param query: (normalised) query the coordinate was geocoded from
+        """
+        super().__init__(lat, lng)
+        self.confidence = confidence
+        self.address = address
+        self.query = query
+
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    def to_waypoint(self, **kwargs):
+        return Waypoint(self.lat, self.lng, **kwargs)
@@ -9,7 +9,7 @@ from locintel.core.datamodel.routing import Route, RoutePlan
 
 @dataclass
 class TestResult(object):
-    def __init__(self, name, plan, routes, metrics=None):
+    def __init__(self, name, plan, routes, metrics=None, timed_out=None):
         """
         Container class for a routing experiment, for several providers. It assumes 1 RoutePlan -> 1+ Route
 
@@ -18,17 +18,21 @@ class TestResult(object):
         :param routes: route results as dict with providers as keys (e.g. routes={'mapbox':
         :param metrics: metrics associated to test, as dict, these are usually comparative between included routes,
                         for example, like route geometry comparison
+        :param timed_out: providers which did not answer within their deadline, and so have no route
         """
         self.name = name
         self.plan = plan
         self.routes = routes
         self.metrics = metrics or {}
+        self.timed_out = list(timed_out or [])
 
     def __repr__(self):
         return f"TestResult(id={self.name},plan={self.plan},results={len(self.routes)})"
 
     def get_providers(self):
-        return self.routes.keys()
+        return list(self.routes.keys()) + [
+            provider for provider in self.timed_out if provider not in self.routes
+        ]
 
     @classmethod
     def from_database_documents(cls, docs, test_name):
@@ -60,13 +64,16 @@ class TestResult(object):
 
 @dataclass
 class ExperimentResult(object):
-    def __init__(self, tests: Sequence[TestResult]):
+    def __init__(self, tests: Sequence[TestResult], telemetry=None):
         """
         Container class for routing experiment
 
         :param tests: list of test results for the experiment, as TestResults object sequence
+        :param telemetry: per-provider request latency and size percentiles, as dict of provider -> metric -> summary
+                          (see locintel.harvest.telemetry.Telemetry.summary)
         """
         self.tests = tests
+        self.telemetry = telemetry
 
     def __iter__(self):
         yield from self.tests
@@ -143,7 +150,7 @@ class ExperimentResult(object):
                 + self.__get_attrs(test, "distance")
                 + self.__get_attrs(test, "duration")
                 + [
-                    geometry.to_polyline()
+                    geometry.to_polyline() if geometry is not None else None
                     for geometry in self.__get_attrs(test, "geometry")
                 ]
                 + [test.metrics.get(metric, np.nan) for metric in metrics]
@@ -151,8 +158,10 @@ class ExperimentResult(object):
         return rows
 
     def __get_attrs(self, test, attribute):
+        # None (an empty cell) for providers without route in test, so that rows line up with columns
         return [
             getattr(test.routes[provider], attribute)
-            for provider in self.get_providers()
             if provider in test.routes
+            else None
+            for provider in self.get_providers()
         ]
@@ -0,0 +1,25 @@
+"""
+Per-process state of multiprocessing pool workers, set once by the pool initializer to avoid pickling large or
+costly arguments (geometries, runner configuration) with every task
+"""
+
+_states = dict()
+
+
+def worker_state(name):
+    """
+    :param name: state owner, usually the __name__ of the module running the pool
+    :return: dict of state of current process for given name, shared by all its callers
+    """
+    return _states.setdefault(name, dict())
+
+
+def init_worker_state(name, make_state, *initargs):
+    """
+    Pool initializer, e.g. Pool(initializer=init_worker_state, initargs=(__name__, make_state, *initargs))
+
+    :param make_state: module-level function (*initargs) -> dict of state (picklable by reference)
+    """
+    state = worker_state(name)
+    state.clear()
+    state.update(make_state(*initargs))
@@ -1,12 +1,18 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import asyncio
 import logging
+import time
 
 from locintel.core.algorithms.itertools import pairwise, tripletwise
+from locintel.core.datamodel.geo import Geometry
 from locintel.core.datamodel.matching import MatchPlan, MatchWaypoint
-from locintel.quality.metrics.geometry import GeometryComparator
-from locintel.services.matching import MapboxMatcher
-
+from locintel.core.datamodel.routing import Route
+from locintel.harvest.matches import MapboxMatcher
+from locintel.routes.metrics.edges import matching_nodes
+from locintel.routes.metrics.geometry import GeometryComparator
 
 from .base import BaseMaskGenerator
+from .store import path_fingerprint
 from ...datamodel.jurbey import Mask
 from ...processing.paths import PathsGenerator
 
@@ -25,7 +31,24 @@ class RouteMatchingMaskGenerator(BaseMaskGenerator):
         timestamps_speed=None,
         search_radius=None,
         filter_hausdorff_distance=False,
+        base_graph=None,
+        store=None,
     ):
+        """
+        With filter_hausdorff_distance, matches are filtered by Hausdorff distance between matched geometry and path
+        geometry (see _result_is_invalid), at a single matcher request per path: given the base graph, only nodes are
+        requested (OSRM reports better nodes for matches without geometries) and the matched geometry is rebuilt from
+        base graph node coordinates, otherwise nodes and geometry are requested together.
+
+        Given a store, generation is incremental: paths whose fingerprint (geometry and matcher options, see
+        locintel.graphs.masks.generate.store.path_fingerprint) is stored reuse their stored node, edge and relation
+        sets, only new or changed paths are matched, and entries of paths which no longer exist are pruned from the
+        store, the mask being rebuilt from the contributions of current paths only.
+
+        :param base_graph: Jurbey graph the matcher matches against, whose node coordinates rebuild matched geometries
+        :param store: locintel.graphs.masks.generate.store.MatchStore of matches of previous runs (of the same matcher
+                      and base graph)
+        """
         super().__init__("matching")
         self.odd_graph = odd_graph
         self.paths_generator = paths_generator
@@ -38,55 +61,206 @@ class RouteMatchingMaskGenerator(BaseMaskGenerator):
         self.lanes_threshold = lanes_threshold
         self.search_radius = search_radius
         self.filter_hausdorff_distance = filter_hausdorff_distance
+        self.base_graph = base_graph
+        self.store = store
+
+    def generate(self, jobs=1, progress=None, log_interval=60):
+        """
+        Matches paths with up to jobs matcher requests in flight (threads, or asyncio tasks sharing one session for
+        asyncio matchers, see locintel.harvest.aio), merging node, edge and relation sets of paths as they are matched.
+        Sets are merged by union, so the mask does not depend on the order in which matches complete.
 
-    def generate(self):
-        ignored_paths = 0
-        for i, path in enumerate(self.paths):
+        Progress is kept in self.stats: paths, processed, matched, ignored (below lanes_threshold), failed (matcher
+        errors), filtered (Hausdorff filter), nodes, edges and relations so far, elapsed seconds and throughput
+        (processed paths per second), and reused (stored matches of unchanged paths, also counted as matched or
+        filtered) and pruned (store entries of removed paths) with a store.
 
-            if self.lanes_threshold and len(path.edges) < self.lanes_threshold:
-                ignored_paths += 1
-                continue
+        :param jobs: maximum number of paths matched concurrently
+        :param progress: callable, called with self.stats after every processed path
+        :param log_interval: minimum number of seconds between progress log lines
+        """
+        self.stats = dict(
+            paths=len(self.paths),
+            processed=0,
+            matched=0,
+            ignored=0,
+            failed=0,
+            filtered=0,
+            reused=0,
+            pruned=0,
+            nodes=len(self.nodes),
+            edges=len(self.edges),
+            relations=len(self.relations),
+            elapsed=0.0,
+            throughput=0.0,
+        )
+        self._start = self._last_log = time.perf_counter()
+        self._progress = progress
+        self._log_interval = log_interval
+        self._fingerprints = set()
+        if self.store is not None:
+            self.nodes, self.edges, self.relations = set(), set(), set()
 
-            if i % 100 == 0:
-                logging.info(f"Processed {i} paths")
-                logging.info(f"Matched {len(self.nodes)} nodes")
-                logging.info(f"Matched {len(self.edges)} edges")
+        if asyncio.iscoroutinefunction(self.matcher.calculate):
+            asyncio.run(self._generate_async(jobs))
+        else:
+            self._generate_threaded(jobs)
+        if self.store is not None:
+            self.stats["pruned"] = self.store.prune(self._fingerprints)
 
-            options = {}
-            if self.timestamps_speed:
-                options["timestamps"] = self.timestamps_speed
-            if self.search_radius:
-                options["radius"] = self.search_radius
+        self._log_progress()
+        return Mask(self.nodes, self.edges, self.relations)
 
-            plan = MatchPlan(
-                [MatchWaypoint(coord.lat, coord.lng) for coord in path.geometry]
-            )
-            try:
-                match = self.matcher.calculate(plan, report_geometry=False, **options)
-            except BaseException as e:
-                logging.warning(e)
-                continue
+    def _generate_threaded(self, jobs):
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            pending = dict()
+            for path in self.paths:
+                key, stored = self._lookup(path)
+                if stored is not None:
+                    self._merge(*stored, reused=True)
+                    continue
+                # bounds queued paths (and their plans) to a couple per thread
+                if len(pending) >= 2 * jobs:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._merge(*future.result(), key=pending.pop(future))
+                pending[executor.submit(self._match_path, path)] = key
+            for future in as_completed(pending):
+                self._merge(*future.result(), key=pending[future])
 
-            # there's a bug in OSRM that makes the reported nodes in matches without geometries better but for
-            # filtering out bad matches, we need the geometry. thus the double map match load
-            if self.filter_hausdorff_distance:
-                if match.metadata["raw"]["matchings"]:
+    async def _generate_async(self, jobs):
+        paths = iter(self.paths)
+        async with self.matcher.create_session(jobs) as session:
+
+            async def worker():
+                for path in paths:
+                    key, stored = self._lookup(path)
+                    if stored is not None:
+                        self._merge(*stored, reused=True)
+                        continue
+                    plan, options = self._prepare(path)
+                    if plan is None:
+                        self._merge("ignored")
+                        continue
                     try:
-                        geom_match = self.matcher.calculate(plan, report_geometry=True)
-                    except BaseException as e:
+                        match = await self.matcher.calculate(
+                            plan, session=session, **options
+                        )
+                    except Exception as e:
                         logging.warning(e)
+                        self._merge("failed")
                         continue
+                    self._merge(*self._process_match(match, path), key=key)
 
-                    if self._result_is_invalid(match, geom_match, path.coords):
-                        continue
+            await asyncio.gather(*(worker() for _ in range(jobs)))
+
+    def _prepare(self, path):
+        """
+        :return: (MatchPlan, matcher options) of path, or (None, None) if path is ignored
+        """
+        if self._is_ignored(path):
+            return None, None
+        plan = MatchPlan(
+            [MatchWaypoint(coord.lat, coord.lng) for coord in path.geometry]
+        )
+        return plan, self._options()
 
-            nodes, edges, relations = self._decompose_match(match)
+    def _is_ignored(self, path):
+        return self.lanes_threshold and len(path.edges) < self.lanes_threshold
 
+    def _options(self):
+        options = {}
+        if self.timestamps_speed:
+            options["timestamps"] = self.timestamps_speed
+        if self.search_radius:
+            options["radius"] = self.search_radius
+        # there's a bug in OSRM that makes the reported nodes in matches without geometries better, so geometry
+        # is only requested when it is needed for filtering and can't be rebuilt from the base graph
+        options["report_geometry"] = (
+            bool(self.filter_hausdorff_distance) and self.base_graph is None
+        )
+        return options
+
+    def _lookup(self, path):
+        """
+        :return: (fingerprint, stored (status, (nodes, edges, relations)) or None) of path, (None, None) without store
+                 or for ignored paths
+        """
+        if self.store is None or self._is_ignored(path):
+            return None, None
+        key = path_fingerprint(
+            path,
+            dict(
+                self._options(),
+                filter_hausdorff_distance=bool(self.filter_hausdorff_distance),
+            ),
+        )
+        self._fingerprints.add(key)
+        return key, self.store.get(key)
+
+    def _match_path(self, path):
+        """
+        :return: (status, (nodes, edges, relations) of matched path, or None if path was not matched)
+        """
+        plan, options = self._prepare(path)
+        if plan is None:
+            return "ignored", None
+        try:
+            match = self.matcher.calculate(plan, **options)
+        except Exception as e:
+            logging.warning(e)
+            return "failed", None
+        return self._process_match(match, path)
+
+    def _process_match(self, match, path):
+        if self.filter_hausdorff_distance:
+            try:
+                geom_match = (
+                    match
+                    if self.base_graph is None
+                    else self._rebuild_geometry(match, self.base_graph)
+                )
+            except Exception as e:
+                logging.warning(e)
+                return "failed", None
+            if self._result_is_invalid(match, geom_match, path.geometry):
+                return "filtered", None
+        return "matched", self._decompose_match(match)
+
+    def _merge(self, status, decomposed=None, key=None, reused=False):
+        if key is not None and status in ("matched", "filtered"):
+            self.store.set(key, status, decomposed)
+        if decomposed is not None:
+            nodes, edges, relations = decomposed
             self.nodes.update(nodes)
             self.edges.update(edges)
             self.relations.update(relations)
 
-        return Mask(self.nodes, self.edges, self.relations)
+        now = time.perf_counter()
+        self.stats[status] += 1
+        self.stats["reused"] += reused
+        self.stats["processed"] += 1
+        self.stats.update(
+            nodes=len(self.nodes),
+            edges=len(self.edges),
+            relations=len(self.relations),
+            elapsed=now - self._start,
+        )
+        self.stats["throughput"] = self.stats["processed"] / max(
+            self.stats["elapsed"], 1e-9
+        )
+        if self._progress is not None:
+            self._progress(self.stats)
+        if now - self._last_log >= self._log_interval:
+            self._last_log = now
+            self._log_progress()
+
+    def _log_progress(self):
+        logging.info(
+            "Mask generation: {processed}/{paths} paths processed ({matched} matched, {ignored} ignored, "
+            "{failed} failed, {filtered} filtered, {reused} reused), {nodes} nodes, {edges} edges, {relations} relations, "
+            "{elapsed:.1f}s, {throughput:.2f} paths/s".format(**self.stats)
+        )
 
     def _decompose_match(self, match):
         nodes, edges, relations = set(), set(), set()
@@ -98,6 +272,24 @@ class RouteMatchingMaskGenerator(BaseMaskGenerator):
                 relations.update(tripletwise(leg_nodes))
         return nodes, edges, relations
 
+    @staticmethod
+    def _rebuild_geometry(match, graph):
+        """
+        :return: Route of first matching of match, with geometry rebuilt from graph coordinates of matched nodes (None
+                 if match has no matchings)
+        :raises ValueError: if a matched node is not in graph
+        """
+        matchings = match.metadata["raw"]["matchings"]
+        if not matchings:
+            return None
+        try:
+            coords = [
+                graph.nodes[node]["data"].coord for node in matching_nodes(matchings[0])
+            ]
+        except KeyError as e:
+            raise ValueError(f"Matched node {e.args[0]} not found in base graph")
+        return Route(Geometry(coords), match.distance, match.duration)
+
     @staticmethod
     def _result_is_invalid(match, geom_match, trace, filter_configs=None):
         filter_configs = filter_configs or [
@@ -105,13 +297,13 @@ class RouteMatchingMaskGenerator(BaseMaskGenerator):
             {"max_hausdorff_distance": 40, "min_confidence": 0.1},
         ]
 
-        if not match.get("matchings"):
+        if not match.metadata["raw"].get("matchings"):
             return True
 
         confidence = match.metadata["confidence"]
         snap_distance = match.metadata["max_snap_distance"]
         num_failed_points = match.metadata["failed_points"]
-        hausdorff_distance = GeometryComparator.compare(
+        hausdorff_distance = GeometryComparator().compare(
             geom_match.geometry, trace, method="hausdorff"
         )
 
@@ -0,0 +1,103 @@
+"""
+Persistent store of per-path match decompositions, so that mask generation only re-matches paths which are new or
+changed since a previous run
+"""
+import hashlib
+import json
+import sqlite3
+import zlib
+
+
+def path_fingerprint(path, options=None, precision=7):
+    """
+    Canonical hash of path geometry (coordinates rounded to precision decimals) and matcher options, independent of
+    options key order
+
+    :param path: locintel.graphs.datamodel.jurbey.Path
+    :param options: JSON-serializable matcher (and filter) options the path is matched with
+    """
+    coords = [[round(c.lat, precision), round(c.lng, precision)] for c in path.geometry]
+    canonical = json.dumps([coords, options], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class MatchStore(object):
+    def __init__(self, path):
+        """
+        Sqlite-backed store of (status, (nodes, edges, relations)) of matched paths, keyed by path fingerprint
+
+        Only results of a given matcher and base graph should share a store, as neither is part of fingerprints.
+
+        :param path: sqlite database file
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS matches (fingerprint TEXT PRIMARY KEY, status TEXT, decomposition BLOB)"
+            )
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+
+    def __contains__(self, fingerprint):
+        return self.get(fingerprint) is not None
+
+    def get(self, fingerprint):
+        """
+        :return: (status, (nodes, edges, relations) sets or None), or None if fingerprint is not stored
+        """
+        row = self.connection.execute(
+            "SELECT status, decomposition FROM matches WHERE fingerprint = ?",
+            (fingerprint,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        status, data = row
+        if data is None:
+            return status, None
+        nodes, edges, relations = json.loads(zlib.decompress(data))
+        return (
+            status,
+            (set(nodes), set(map(tuple, edges)), set(map(tuple, relations))),
+        )
+
+    def set(self, fingerprint, status, decomposition=None):
+        data = None
+        if decomposition is not None:
+            data = zlib.compress(
+                json.dumps(
+                    [sorted(elements) for elements in decomposition],
+                    separators=(",", ":"),
+                ).encode()
+            )
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?)",
+                (fingerprint, status, data),
+            )
+
+    def prune(self, fingerprints):
+        """
+        Removes all entries but those of given fingerprints
+
+        :return: number of removed entries
+        """
+        with self.connection:
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS keep (fingerprint TEXT PRIMARY KEY)"
+            )
+            self.connection.execute("DELETE FROM keep")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO keep VALUES (?)", ((f,) for f in fingerprints)
+            )
+            removed = self.connection.execute(
+                "DELETE FROM matches WHERE fingerprint NOT IN (SELECT fingerprint FROM keep)"
+            ).rowcount
+            self.connection.execute("DELETE FROM keep")
+        return removed
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM matches")
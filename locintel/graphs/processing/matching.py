@@ -0,0 +1,234 @@
+"""
+Offline map matching of traces onto graphs, with a hidden Markov model (Newson & Krumm, "Hidden Markov map matching
+through noise and sparseness", 2009): hidden states are candidate positions on edges near each trace point, emission
+probabilities fall off with distance from trace point to candidate (gaussian GPS noise), and transition probabilities
+fall off with the difference between route distance and great circle distance of consecutive points
+"""
+import math
+
+import networkx as nx
+import numpy as np
+
+from .spatial import EdgeIndex
+
+# km/h, for edges without (valid) speed attribute
+DEFAULT_SPEED = 50
+
+
+class HMMMatcher(object):
+    def __init__(
+        self,
+        graph,
+        sigma=5,
+        beta=50,
+        radius=50,
+        max_candidates=8,
+        max_detour=3,
+        default_speed=DEFAULT_SPEED,
+        index=None,
+    ):
+        """
+        :param graph: locintel.graphs.datamodel.jurbey.Jurbey object (or any networkx.DiGraph with node "data"
+                      attributes holding coord), with optional edge speed attributes (km/h) for durations
+        :param sigma: standard deviation of trace points noise, in meters
+        :param beta: scale of the difference between route and great circle distances of consecutive points, in meters
+        :param radius: default search radius of candidates, in meters
+        :param max_candidates: maximum number of candidate edges per trace point
+        :param max_detour: route distance bound between consecutive points, as a factor of their great circle distance
+                           (plus twice the search radius), beyond which routes are not searched
+        :param default_speed: speed of edges without speed attribute, in km/h
+        :param index: locintel.graphs.processing.spatial.EdgeIndex of graph (built if not given)
+        """
+        self.graph = graph
+        self.sigma = sigma
+        self.beta = beta
+        self.radius = radius
+        self.max_candidates = max_candidates
+        self.max_detour = max_detour
+        self.index = index or EdgeIndex(graph)
+
+        speeds = np.array(
+            [graph.edges[edge].get("speed") or -1 for edge in self.index.edges],
+            dtype=float,
+        ).reshape(-1)
+        speeds = np.where(speeds > 0, speeds, default_speed)
+        self.durations = self.index.lengths / (speeds / 3.6)
+
+    def match(self, lats, lngs, radiuses=None, report_geometry=False):
+        """
+        Matches a trace, decoding the most likely sequence of candidates with the Viterbi algorithm
+
+        Trace points without candidates within their radius are skipped (null tracepoints). Where no route connects
+        any candidate of consecutive points the trace is split, and decoding restarts at the next point, into
+        another matching; matchings of a single point are dropped.
+
+        :param lats: trace point latitudes
+        :param lngs: trace point longitudes
+        :param radiuses: search radius of each point, in meters (None for default radius)
+        :param report_geometry: if True, legs have geometry of the matched route (as lists of lat/lon dicts)
+        :return: match response, in the format of MapboxMatcher responses (see
+                 locintel.harvest.matches.MapboxMatcherResponseAdapter), with nodes of the graph in legs
+        """
+        radiuses = [r or self.radius for r in (radiuses or [None] * len(lats))]
+        x, y = self.index.project(lats, lngs)
+
+        runs, run = list(), list()
+        for t in range(len(lats)):
+            edges, offsets, distances = self.index.nearest(
+                lats[t], lngs[t], radiuses[t], self.max_candidates
+            )
+            if not len(edges):
+                continue
+            candidates = dict(t=t, edges=edges, offsets=offsets, distances=distances)
+            emissions = -0.5 * (distances / self.sigma) ** 2
+
+            if run:
+                previous = run[-1]
+                great_circle = math.hypot(
+                    x[t] - x[previous["t"]], y[t] - y[previous["t"]]
+                )
+                routes, paths = self._route_distances(
+                    previous,
+                    candidates,
+                    great_circle + 2 * max(radiuses[t], radiuses[previous["t"]]),
+                )
+                transitions = -np.abs(routes - great_circle) / self.beta
+                scores = previous["scores"][:, None] + transitions
+                if np.isfinite(scores).any():
+                    candidates.update(
+                        back=np.argmax(scores, axis=0),
+                        scores=np.max(scores, axis=0) + emissions,
+                        routes=routes,
+                        paths=paths,
+                        great_circle=great_circle,
+                    )
+                    run.append(candidates)
+                    continue
+                runs.append(run)
+
+            candidates["scores"] = emissions
+            run = [candidates]
+        if run:
+            runs.append(run)
+
+        return self._build_response(
+            len(lats), [run for run in runs if len(run) > 1], report_geometry
+        )
+
+    def _route_distances(self, previous, candidates, reach):
+        """
+        :return: (matrix of route distances between previous and next candidates, inf where unreachable within bound,
+                 dict of node paths between them by source node)
+        """
+        bound = self.max_detour * reach
+        routes = np.full((len(previous["edges"]), len(candidates["edges"])), np.inf)
+        paths = dict()
+        for i, (edge, offset) in enumerate(zip(previous["edges"], previous["offsets"])):
+            source = self.index.edges[edge][1]
+            remaining = self.index.lengths[edge] - offset
+            if source not in paths:
+                paths[source] = nx.single_source_dijkstra(
+                    self.graph, source, cutoff=bound, weight=self._length
+                )
+            lengths, _ = paths[source]
+            for j, (next_edge, next_offset) in enumerate(
+                zip(candidates["edges"], candidates["offsets"])
+            ):
+                if next_edge == edge and next_offset >= offset - self.sigma:
+                    # moving forward (or standing still, within noise) along the same edge
+                    routes[i, j] = max(next_offset - offset, 0)
+                    continue
+                between = lengths.get(self.index.edges[next_edge][0])
+                if between is not None:
+                    routes[i, j] = remaining + between + next_offset
+        routes[routes > bound] = np.inf
+        return routes, paths
+
+    def _length(self, u, v, data):
+        return self.index.lengths[self.index.ids[(u, v)]]
+
+    def _build_response(self, n, runs, report_geometry):
+        tracepoints = [None] * n
+        matchings = list()
+        for m, run in enumerate(runs):
+            # backtracking of most likely candidates
+            states = [int(np.argmax(run[-1]["scores"]))]
+            for step in reversed(run[1:]):
+                states.append(int(step["back"][states[-1]]))
+            states.reverse()
+
+            for w, (step, j) in enumerate(zip(run, states)):
+                edge, offset = step["edges"][j], step["offsets"][j]
+                lat, lng = self.index.locate(edge, offset)
+                tracepoints[step["t"]] = {
+                    "location": [lng, lat],
+                    "name": "",
+                    "matchings_index": m,
+                    "waypoint_index": w,
+                    "alternatives_count": len(step["edges"]) - 1,
+                    "snapDistance": float(step["distances"][j]),
+                }
+
+            legs, likelihoods = list(), list()
+            for previous, step, i, j in zip(run, run[1:], states, states[1:]):
+                leg = self._build_leg(previous, step, i, j, report_geometry)
+                legs.append(leg)
+                likelihoods.append(
+                    math.exp(-abs(leg["distance"] - step["great_circle"]) / self.beta)
+                )
+            matchings.append(
+                {
+                    "confidence": float(np.mean(likelihoods)),
+                    "distance": sum(leg["distance"] for leg in legs),
+                    "duration": sum(leg["duration"] for leg in legs),
+                    "legs": legs,
+                }
+            )
+
+        return {
+            "code": "Ok" if matchings else "NoMatch",
+            "matchNumber": len(matchings),
+            "matchings": matchings,
+            "tracepoints": tracepoints,
+        }
+
+    def _build_leg(self, previous, step, i, j, report_geometry):
+        edge, offset = previous["edges"][i], previous["offsets"][i]
+        next_edge, next_offset = step["edges"][j], step["offsets"][j]
+        distance = float(step["routes"][i, j])
+        u, v = self.index.edges[edge]
+
+        if next_edge == edge and next_offset >= offset - self.sigma:
+            nodes, edges = [u, v], [edge]
+            duration = (
+                self.durations[edge] * distance / max(self.index.lengths[edge], 1e-9)
+            )
+            geometry = self.index.sub_geometry(edge, offset, max(next_offset, offset))
+        else:
+            _, paths = step["paths"][v]
+            path = paths[self.index.edges[next_edge][0]]
+            nodes = [u] + path + [self.index.edges[next_edge][1]]
+            edges = [self.index.ids[e] for e in zip(nodes[1:-2], nodes[2:-1])]
+            duration = (
+                self.durations[edge]
+                * (1 - offset / max(self.index.lengths[edge], 1e-9))
+                + self.durations[edges].sum()
+                + self.durations[next_edge]
+                * next_offset
+                / max(self.index.lengths[next_edge], 1e-9)
+            )
+            geometry = self.index.sub_geometry(edge, offset)
+            for e in edges:
+                geometry.extend(self.index.sub_geometry(e)[1:])
+            geometry.extend(self.index.sub_geometry(next_edge, 0, next_offset)[1:])
+
+        leg = {
+            "distance": distance,
+            "duration": float(duration),
+            "nodes": nodes,
+            "traceFromIndex": previous["t"],
+            "traceToIndex": step["t"],
+        }
+        if report_geometry:
+            leg["geometry"] = [{"lat": lat, "lon": lng} for lat, lng in geometry]
+        return leg
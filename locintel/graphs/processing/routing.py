@@ -0,0 +1,283 @@
+"""
+Offline routing over graphs: bidirectional A* on array-backed (CSR) adjacency, with haversine heuristics
+"""
+import heapq
+import math
+
+import numpy as np
+
+from locintel.core.algorithms.geo import earth_radius, haversine_distances
+
+from .matching import DEFAULT_SPEED
+from .spatial import EdgeIndex
+
+# heuristics are scaled down a hair, so that rounding errors never make them inadmissible
+HEURISTIC_SLACK = 1 - 1e-9
+
+
+class RoutingGraph(object):
+    def __init__(self, graph, default_speed=DEFAULT_SPEED, snap_radius=100, index=None):
+        """
+        Graph compiled for routing: node coordinates and edge lengths (meters) and durations (seconds, from edge speed
+        attributes) in flat arrays, forward and reverse adjacency in compressed sparse row form
+
+        Compile once and reuse, routing queries do not touch the networkx graph.
+
+        :param graph: locintel.graphs.datamodel.jurbey.Jurbey object (or any networkx.DiGraph with node "data"
+                      attributes holding coord), with edge speed attributes in km/h (as set by OsmAdapter)
+        :param default_speed: speed of edges without (valid) speed attribute, in km/h
+        :param snap_radius: maximum distance from waypoints to the graph, in meters
+        :param index: locintel.graphs.processing.spatial.EdgeIndex of graph (built if not given)
+        """
+        self.index = index or EdgeIndex(graph)
+        self.snap_radius = snap_radius
+        self.nodes = list(graph.nodes)
+        ids = {node: i for i, node in enumerate(self.nodes)}
+        lats = np.radians([graph.nodes[n]["data"].coord.lat for n in self.nodes])
+        lngs = np.radians([graph.nodes[n]["data"].coord.lng for n in self.nodes])
+        # unit sphere positions, for trigonometry free (chordal) heuristics
+        self.xs, self.ys, self.zs = _unit_vectors(lats, lngs).tolist()
+
+        sources = np.array([ids[u] for u, _ in self.index.edges], dtype=np.int64)
+        targets = np.array([ids[v] for _, v in self.index.edges], dtype=np.int64)
+        speeds = np.array(
+            [graph.edges[edge].get("speed") or -1 for edge in self.index.edges],
+            dtype=float,
+        ).reshape(-1)
+        speeds = np.where(speeds > 0, speeds, default_speed) / 3.6
+        # great circle lengths, for haversine heuristics to be consistent (index lengths are projected)
+        coords = (
+            np.concatenate(self.index.coords) if self.index.coords else np.empty((0, 2))
+        )
+        owners = np.repeat(
+            np.arange(len(self.index.coords)), [len(c) for c in self.index.coords]
+        )
+        same_edge = owners[:-1] == owners[1:]
+        distances = haversine_distances(
+            coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1]
+        )
+        lengths = np.bincount(
+            owners[:-1][same_edge],
+            weights=distances[same_edge],
+            minlength=len(self.index.edges),
+        )
+        self.lengths = lengths.tolist()
+        self.durations = (lengths / speeds).tolist()
+        self.max_speed = float(speeds.max()) if len(speeds) else default_speed / 3.6
+        self.sources, self.targets = sources.tolist(), targets.tolist()
+        self.forward = self._adjacency(sources, targets)
+        self.reverse = self._adjacency(targets, sources)
+
+    def _adjacency(self, tails, heads):
+        """
+        :return: (row pointers, head nodes, edge ids) of edges grouped by tail node
+        """
+        order = np.argsort(tails, kind="stable")
+        pointers = np.concatenate(
+            [[0], np.cumsum(np.bincount(tails, minlength=len(self.nodes)))]
+        )
+        return pointers.tolist(), heads[order].tolist(), order.tolist()
+
+    def snap(self, lat, lng):
+        """
+        :return: list of (edge id, offset) of closest edges to coordinate (several for equidistant edges, e.g. both
+                 directions of a two-way road)
+        :raises ValueError: if no edge is within snap radius
+        """
+        edges, offsets, distances = self.index.nearest(lat, lng, self.snap_radius, 8)
+        if not len(edges):
+            raise ValueError(
+                f"No edge within {self.snap_radius}m of ({lat}, {lng}) to route from/to"
+            )
+        closest = distances <= distances[0] + 1
+        return list(zip(edges[closest].tolist(), offsets[closest].tolist()))
+
+    def route(self, waypoints, shortest=False):
+        """
+        Fastest (or shortest) route through waypoints, each snapped to closest edges
+
+        :param waypoints: sequence of (lat, lng), at least two
+        :param shortest: if True, route is shortest in distance instead of duration
+        :return: dict of distance (meters), duration (seconds), geometry (list of (lat, lng)) and nodes
+        :raises ValueError: if a waypoint is too far from graph or no route connects consecutive waypoints
+        """
+        weights = self.lengths if shortest else self.durations
+        speed = 1 if shortest else self.max_speed
+        snapped = [self.snap(lat, lng) for lat, lng in waypoints]
+
+        distance = duration = 0
+        geometry, nodes = list(), list()
+        for k in range(len(waypoints) - 1):
+            (start, start_offset), edges, (end, end_offset) = self._search(
+                snapped[k],
+                snapped[k + 1],
+                weights,
+                waypoints[k],
+                waypoints[k + 1],
+                speed,
+            )
+            if start == end and not edges and end_offset >= start_offset:
+                fraction = self._fraction(start, start_offset, end_offset)
+                leg_distance = self.lengths[start] * fraction
+                leg_duration = self.durations[start] * fraction
+                leg_geometry = self.index.sub_geometry(start, start_offset, end_offset)
+                leg_nodes = [self.sources[start], self.targets[start]]
+            else:
+                first = self._fraction(start, start_offset)
+                last = self._fraction(end, 0, end_offset)
+                leg_distance = (
+                    self.lengths[start] * first
+                    + sum(self.lengths[e] for e in edges)
+                    + self.lengths[end] * last
+                )
+                leg_duration = (
+                    self.durations[start] * first
+                    + sum(self.durations[e] for e in edges)
+                    + self.durations[end] * last
+                )
+                leg_geometry = self.index.sub_geometry(start, start_offset)
+                for e in edges:
+                    leg_geometry.extend(self.index.sub_geometry(e)[1:])
+                leg_geometry.extend(self.index.sub_geometry(end, 0, end_offset)[1:])
+                # nodes of start and end edges which are not reached (waypoints at edge ends) are left out
+                leg_nodes = [self.sources[start]] if first > 0 else []
+                leg_nodes += [self.targets[start]] + [self.targets[e] for e in edges]
+                leg_nodes += [self.targets[end]] if last > 0 else []
+
+            distance += leg_distance
+            duration += leg_duration
+            geometry.extend(leg_geometry if not geometry else leg_geometry[1:])
+            # consecutive legs share the edge (or node) of the waypoint between them
+            overlap = next((k for k in (2, 1) if nodes[-k:] == leg_nodes[:k]), 0)
+            nodes.extend(leg_nodes[overlap:])
+
+        return {
+            "distance": distance,
+            "duration": duration,
+            "geometry": geometry,
+            "nodes": [self.nodes[n] for n in nodes],
+        }
+
+    def _fraction(self, edge, start, end=None):
+        """
+        :return: fraction of edge between offsets start and end (edge end if None)
+        """
+        length = self.index.lengths[edge]
+        end = length if end is None else end
+        return (end - start) / length if length > 0 else 0
+
+    def _search(self, starts, ends, weights, origin, destination, speed):
+        """
+        Bidirectional A*, from the end nodes of start edges to the start nodes of end edges, with consistent (averaged)
+        potentials: the forward search is guided by half the heuristic towards destination minus the one towards
+        origin, and the backward search by its opposite, so that searches can stop as soon as the sum of their
+        smallest keys reaches the cost of the best route found
+
+        Heuristics are chord lengths (straight through the earth), never longer than great circle distances and thus
+        edge lengths, which only take a few multiplications and a square root per relaxed edge.
+
+        :return: ((start edge, offset), edges in between, (end edge, offset))
+        :raises ValueError: if no route connects starts to ends
+        """
+        (x_o, x_d), (y_o, y_d), (z_o, z_d) = _unit_vectors(
+            *np.radians([origin, destination]).T
+        ).tolist()
+        # halved, potentials average the heuristics of both searches
+        scale = HEURISTIC_SLACK * earth_radius * 1000 / speed / 2
+        xs, ys, zs, sqrt = self.xs, self.ys, self.zs, math.sqrt
+
+        def potential(node):
+            x, y, z = xs[node], ys[node], zs[node]
+            return scale * (
+                sqrt((x - x_d) ** 2 + (y - y_d) ** 2 + (z - z_d) ** 2)
+                - sqrt((x - x_o) ** 2 + (y - y_o) ** 2 + (z - z_o) ** 2)
+            )
+
+        best, meeting, direct = math.inf, None, None
+        for start, start_offset in starts:
+            for end, end_offset in ends:
+                if start == end and end_offset >= start_offset:
+                    cost = weights[start] * self._fraction(
+                        start, start_offset, end_offset
+                    )
+                    if cost < best:
+                        best, direct = cost, ((start, start_offset), (end, end_offset))
+
+        # labels: node -> cost, edge from previous (forward) or to next (backward) node; seeds: node -> (edge, offset)
+        costs, previous, seeds, heaps = (
+            (dict(), dict()),
+            (dict(), dict()),
+            (dict(), dict()),
+            ([], []),
+        )
+        for side, snapped in enumerate((starts, ends)):
+            for edge, offset in snapped:
+                if side == 0:
+                    cost = weights[edge] * self._fraction(edge, offset)
+                    node = self.targets[edge]
+                else:
+                    cost = weights[edge] * self._fraction(edge, 0, offset)
+                    node = self.sources[edge]
+                if cost < costs[side].get(node, math.inf):
+                    costs[side][node], previous[side][node] = cost, None
+                    seeds[side][node] = (edge, offset)
+                    key = (
+                        cost + potential(node) if side == 0 else cost - potential(node)
+                    )
+                    heapq.heappush(heaps[side], (key, cost, node))
+        for node in costs[0].keys() & costs[1].keys():
+            if costs[0][node] + costs[1][node] < best:
+                best, meeting = costs[0][node] + costs[1][node], node
+
+        adjacency = (self.forward, self.reverse)
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            labels, others, heap = costs[side], costs[1 - side], heaps[side]
+            pointers, heads, ids = adjacency[side]
+            _, cost, node = heapq.heappop(heap)
+            if cost > labels[node]:
+                continue  # stale entry
+            for j in range(pointers[node], pointers[node + 1]):
+                head, edge = heads[j], ids[j]
+                head_cost = cost + weights[edge]
+                if head_cost < labels.get(head, math.inf):
+                    labels[head] = head_cost
+                    previous[side][head] = edge
+                    h = potential(head)
+                    heapq.heappush(
+                        heap,
+                        (
+                            head_cost + h if side == 0 else head_cost - h,
+                            head_cost,
+                            head,
+                        ),
+                    )
+                    if head in others and head_cost + others[head] < best:
+                        best, meeting = head_cost + others[head], head
+
+        if meeting is None:
+            if direct is None:
+                raise ValueError(f"No route found from {origin} to {destination}")
+            return direct[0], [], direct[1]
+
+        edges, node = list(), meeting
+        while previous[0][node] is not None:
+            edges.append(previous[0][node])
+            node = self.sources[edges[-1]]
+        first = seeds[0][node]
+        edges.reverse()
+        node = meeting
+        while previous[1][node] is not None:
+            edges.append(previous[1][node])
+            node = self.targets[edges[-1]]
+        return first, edges, seeds[1][node]
+
+
+def _unit_vectors(lats, lngs):
+    """
+    :return: x, y and z coordinates on the unit sphere of latitudes and longitudes (radians)
+    """
+    cosines = np.cos(lats)
+    return np.array([cosines * np.cos(lngs), cosines * np.sin(lngs), np.sin(lats)])
@@ -0,0 +1,158 @@
+"""
+Spatial index of graph edges, for snapping coordinates onto edges (e.g. candidates of map matching, route endpoints)
+"""
+from collections import defaultdict
+import math
+
+import numpy as np
+
+from locintel.core.algorithms.geo import METERS_PER_DEGREE
+
+
+class EdgeIndex(object):
+    def __init__(self, graph, cell_size=100):
+        """
+        Grid index of edge segments, on a local equirectangular projection (in meters) centred on the graph
+
+        Edges are polylines of their geometry where available, falling back to straight lines between edge nodes.
+        Every segment is registered in the grid cells its bounding box overlaps, so that lookups only measure
+        segments of cells within search radius. Distances and offsets along edges are measured on the projection,
+        accurate for city to region scale graphs.
+
+        :param graph: locintel.graphs.datamodel.jurbey.Jurbey object (or any networkx.DiGraph with node "data"
+                      attributes holding coord and optional edge "data" attributes holding geometry)
+        :param cell_size: side of grid cells, in meters
+        """
+        self.graph = graph
+        self.cell_size = cell_size
+        self.edges = list()
+        self.ids = dict()
+        self.coords = list()
+        self.offsets = list()
+
+        lats = [data["data"].coord.lat for _, data in graph.nodes(data=True)] or [0]
+        lngs = [data["data"].coord.lng for _, data in graph.nodes(data=True)] or [0]
+        self.origin = (float(np.mean(lats)), float(np.mean(lngs)))
+        self.lng_scale = METERS_PER_DEGREE * math.cos(math.radians(self.origin[0]))
+
+        segments = list()
+        for i, (u, v, data) in enumerate(graph.edges(data=True)):
+            self.ids[(u, v)] = i
+            self.edges.append((u, v))
+            geometry = getattr(data.get("data"), "geometry", None)
+            if geometry:
+                coords = [(coord.lat, coord.lng) for coord in geometry]
+            else:
+                coords = [
+                    (graph.nodes[n]["data"].coord.lat, graph.nodes[n]["data"].coord.lng)
+                    for n in (u, v)
+                ]
+            coords = np.array(coords, dtype=float)
+            x, y = self.project(coords[:, 0], coords[:, 1])
+            offsets = np.concatenate([[0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))])
+            self.coords.append(coords)
+            self.offsets.append(offsets)
+            segments.extend(
+                (x[k], y[k], x[k + 1], y[k + 1], i, offsets[k])
+                for k in range(len(coords) - 1)
+            )
+
+        segments = np.array(segments, dtype=float).reshape(-1, 6)
+        self.ax, self.ay, self.bx, self.by = segments[:, :4].T
+        self.segment_edges = segments[:, 4].astype(np.int64)
+        self.segment_offsets = segments[:, 5]
+        self.lengths = np.array(
+            [offsets[-1] for offsets in self.offsets], dtype=float
+        ).reshape(-1)
+
+        cells = defaultdict(list)
+        for s in range(len(segments)):
+            for cx in self._range(
+                min(self.ax[s], self.bx[s]), max(self.ax[s], self.bx[s])
+            ):
+                for cy in self._range(
+                    min(self.ay[s], self.by[s]), max(self.ay[s], self.by[s])
+                ):
+                    cells[(cx, cy)].append(s)
+        self.cells = {key: np.array(ids) for key, ids in cells.items()}
+
+    def __len__(self):
+        return len(self.edges)
+
+    def project(self, lats, lngs):
+        """
+        :return: (x, y) of coordinates on the local projection, in meters
+        """
+        return (
+            (np.asarray(lngs, dtype=float) - self.origin[1]) * self.lng_scale,
+            (np.asarray(lats, dtype=float) - self.origin[0]) * METERS_PER_DEGREE,
+        )
+
+    def nearest(self, lat, lng, radius, max_candidates=None):
+        """
+        Closest point of every edge within radius of a coordinate
+
+        :param radius: search radius, in meters
+        :param max_candidates: maximum number of edges returned (None for all within radius)
+        :return: (edge ids, offsets along edges, distances) arrays, distances in meters, closest edges first
+        """
+        x, y = self.project(lat, lng)
+        ids = [
+            self.cells[key]
+            for key in (
+                (cx, cy)
+                for cx in self._range(x - radius, x + radius)
+                for cy in self._range(y - radius, y + radius)
+            )
+            if key in self.cells
+        ]
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+
+        s = np.unique(np.concatenate(ids))
+        dx, dy = self.bx[s] - self.ax[s], self.by[s] - self.ay[s]
+        squared = dx ** 2 + dy ** 2
+        t = np.clip(
+            ((x - self.ax[s]) * dx + (y - self.ay[s]) * dy)
+            / np.where(squared > 0, squared, 1),
+            0,
+            1,
+        )
+        distances = np.hypot(x - self.ax[s] - t * dx, y - self.ay[s] - t * dy)
+        offsets = self.segment_offsets[s] + t * np.sqrt(squared)
+        edges = self.segment_edges[s]
+
+        order = np.argsort(distances, kind="stable")
+        order = order[distances[order] <= radius]
+        # closest segment of every edge
+        _, first = np.unique(edges[order], return_index=True)
+        order = order[np.sort(first)][:max_candidates]
+        return edges[order], offsets[order], distances[order]
+
+    def locate(self, edge, offset):
+        """
+        :return: (lat, lng) at offset (in meters) along edge
+        """
+        offsets, coords = self.offsets[edge], self.coords[edge]
+        return (
+            float(np.interp(offset, offsets, coords[:, 0])),
+            float(np.interp(offset, offsets, coords[:, 1])),
+        )
+
+    def sub_geometry(self, edge, start=0, end=None):
+        """
+        :return: list of (lat, lng) of edge geometry between offsets start and end (in meters)
+        """
+        end = self.lengths[edge] if end is None else end
+        offsets, coords = self.offsets[edge], self.coords[edge]
+        inner = (offsets > start) & (offsets < end)
+        return (
+            [self.locate(edge, start)]
+            + [tuple(coord) for coord in coords[inner]]
+            + [self.locate(edge, end)]
+        )
+
+    def _range(self, low, high):
+        return range(
+            math.floor(low / self.cell_size), math.floor(high / self.cell_size) + 1
+        )
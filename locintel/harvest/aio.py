@@ -0,0 +1,338 @@
+"""
+Asyncio counterparts of routers and matchers, holding hundreds of requests in flight from a single process
+"""
+import asyncio
+from datetime import datetime
+import functools
+import time
+
+try:
+    import aiohttp
+except ImportError:  # optional asyncio harvesting dependency (pip install locintel[aio])
+    aiohttp = None
+
+from locintel.core.datamodel.matching import MatchPlan
+
+from .cache import loads
+from .matches import (
+    MapboxMatcher,
+    chunk_windows,
+    merge_timings,
+    stitch_match_responses,
+)
+from .routes import GoogleRouter, MapboxRouter
+from .concurrency import THROTTLE_STATUSES
+from .sessions import RETRY_STATUSES, get_backoff_time
+from .telemetry import telemetry
+
+
+class AsyncHarvesterMixin(object):
+    def __init__(
+        self,
+        *args,
+        timeout=60,
+        retries=3,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES + THROTTLE_STATUSES,
+        **kwargs,
+    ):
+        """
+        Turns a router or matcher into an asyncio one, reusing its payload builders and response adapters
+
+        Requests are retried on connection errors, timeouts and status_forcelist responses with equal-jitter
+        exponential backoff (Retry-After headers are respected). Responses go through the router/matcher cache and
+        rate limiter, if any (see locintel.harvest.cache.ResponseCache and locintel.harvest.limiters.TokenBucket),
+        and every attempt takes a limiter token.
+
+        :param timeout: total timeout per request attempt, in seconds
+        :param retries: maximum number of retries per request
+        :param backoff_factor: base for exponential backoff between retries, in seconds
+        :param status_forcelist: HTTP status codes on which to retry
+        :param args: positional arguments for the synchronous router/matcher
+        :param kwargs: keyword arguments for the synchronous router/matcher
+        """
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = tuple(status_forcelist)
+
+    def _generate_request(self, plan, **kwargs):
+        """
+        :return: (method, url, keyword arguments for aiohttp.ClientSession.request)
+        """
+        raise NotImplementedError("Please implement subclass method")
+
+    def create_session(self, concurrency=100):
+        """
+        Creates aiohttp session with connection pool sized for given concurrency, must be called in a running loop
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "aiohttp is required for asyncio harvesting, pip install locintel[aio]"
+            )
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            trace_configs=[_timing_trace_config()],
+        )
+
+    async def calculate(self, plan, session=None, **kwargs):
+        """
+        :param plan: RoutePlan (routers) or MatchPlan (matchers)
+        :param session: aiohttp.ClientSession (a one-off session is created if not given)
+        :param kwargs: additional options for payload generation
+        """
+        if session is None:
+            async with self.create_session(concurrency=1) as session:
+                return await self.calculate(plan, session, **kwargs)
+
+        response, timing = await self._fetch_plan(plan, session, **kwargs)
+        return self.adapter(response).get_route(
+            metadata={
+                "calc_time": timing["calc_time"],
+                "date": datetime.now(),
+                "timing": timing,
+            }
+        )
+
+    async def _fetch_plan(self, plan, session, **kwargs):
+        """
+        :return: (response json, timing dict)
+        """
+        method, url, request_kwargs = self._generate_request(plan, **kwargs)
+        key = cached = None
+        if self.cache is not None:
+            key = self.cache.key(method, url, request_kwargs.get("json"))
+            cached = await _in_thread(self.cache.lookup, key)
+
+        if cached is not None:
+            response, calc_time = cached
+            timing = {"calc_time": calc_time, "cached": True}
+        else:
+            timing = {"dns": 0.0, "connect": 0.0}
+            start = time.perf_counter()
+            response = await self._request(
+                session,
+                method,
+                url,
+                limiter=self.get_limiter(),
+                trace_request_ctx=timing,
+                **request_kwargs,
+            )
+            timing["total"] = time.perf_counter() - start
+            timing["calc_time"] = timing.get("ttfb", timing["total"])
+            telemetry.record(getattr(self, "name", None), timing)
+            if self.cache is not None:
+                await _in_thread(self.cache.set, key, response, timing["calc_time"])
+        return response, timing
+
+    async def calculate_many(
+        self, plans, concurrency=100, session=None, return_exceptions=False, **kwargs
+    ):
+        """
+        Calculates all plans with at most concurrency requests in flight
+
+        :param plans: iterable of RoutePlan (routers) or MatchPlan (matchers)
+        :param concurrency: maximum number of requests in flight
+        :param session: aiohttp.ClientSession (one with a connection pool of size concurrency is created if not given)
+        :param return_exceptions: if True, failed requests yield their exception instead of aborting all requests
+        :param kwargs: additional options for payload generation
+        :return: list of Route objects, in plans order
+        """
+        if session is None:
+            async with self.create_session(concurrency) as session:
+                return await self.calculate_many(
+                    plans, concurrency, session, return_exceptions, **kwargs
+                )
+
+        plans = list(plans)
+        results = [None] * len(plans)
+        pending = iter(enumerate(plans))
+
+        async def worker():
+            for i, plan in pending:
+                try:
+                    results[i] = await self.calculate(plan, session, **kwargs)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[i] = e
+
+        workers = [
+            asyncio.ensure_future(worker()) for _ in range(min(concurrency, len(plans)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return results
+
+    async def _request(self, session, method, url, limiter=None, **kwargs):
+        for attempt in range(self.retries + 1):
+            if limiter is not None:
+                await asyncio.sleep(await _in_thread(limiter.reserve))
+            retry_after = None
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    if (
+                        response.status not in self.status_forcelist
+                        or attempt == self.retries
+                    ):
+                        response.raise_for_status()
+                        return await response.json(loads=loads, content_type=None)
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(
+                get_backoff_time(attempt, self.backoff_factor, retry_after)
+            )
+
+
+async def _in_thread(func, *args):
+    """
+    Runs blocking func (e.g. sqlite cache lookups) in the default executor, keeping the event loop free
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(func, *args)
+    )
+
+
+def _timing_trace_config():
+    """
+    Records DNS, connect and time to first byte of requests (from having sent request to receiving response
+    headers), and request and response sizes, into the timing dict given as trace_request_ctx (dns and connect add
+    up over retries, other measurements are those of last attempt)
+    """
+
+    def _timing(context):
+        timing = context.trace_request_ctx
+        return timing if isinstance(timing, dict) else None
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+        timing = _timing(context)
+        if timing is not None:
+            timing.update(request_size=0, response_size=0)
+
+    async def on_dns_resolvehost_start(session, context, params):
+        context.dns_start = time.perf_counter()
+
+    async def on_dns_resolvehost_end(session, context, params):
+        timing = _timing(context)
+        if timing is not None:
+            dns = time.perf_counter() - context.dns_start
+            timing["dns"] = timing.get("dns", 0.0) + dns
+            context.dns = getattr(context, "dns", 0.0) + dns
+
+    async def on_connection_create_start(session, context, params):
+        context.connect_start = time.perf_counter()
+        context.dns = 0.0
+
+    async def on_connection_create_end(session, context, params):
+        timing = _timing(context)
+        if timing is not None:
+            connect = time.perf_counter() - context.connect_start - context.dns
+            timing["connect"] = timing.get("connect", 0.0) + connect
+
+    async def on_request_headers_sent(session, context, params):
+        context.sent = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        timing = _timing(context)
+        if timing is not None:
+            timing["ttfb"] = time.perf_counter() - context.sent
+
+    async def on_request_chunk_sent(session, context, params):
+        context.sent = time.perf_counter()
+        timing = _timing(context)
+        if timing is not None:
+            timing["request_size"] += len(params.chunk)
+
+    async def on_response_chunk_received(session, context, params):
+        timing = _timing(context)
+        if timing is not None:
+            timing["response_size"] += len(params.chunk)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_request_headers_sent.append(on_request_headers_sent)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
+
+
+def _basic_auth(user, password):
+    return aiohttp.BasicAuth(user, password or "") if user is not None else None
+
+
+class AsyncMapboxRouter(AsyncHarvesterMixin, MapboxRouter):
+    def _generate_request(self, route_plan, **kwargs):
+        return (
+            "POST",
+            self._generate_url(route_plan),
+            {
+                "json": self._generate_payload(route_plan, **kwargs),
+                "auth": _basic_auth(self.user, self.password),
+            },
+        )
+
+
+class AsyncGoogleRouter(AsyncHarvesterMixin, GoogleRouter):
+    def _generate_request(self, route_plan):
+        return "GET", self._generate_url(route_plan), {}
+
+
+class AsyncMapboxMatcher(AsyncHarvesterMixin, MapboxMatcher):
+    async def calculate(self, match_plan, session=None, **options):
+        """
+        Match plans longer than max_points are split into overlapping windows, requested concurrently and stitched
+        back into one route (see locintel.harvest.matches.MapboxMatcher)
+        """
+        windows = chunk_windows(len(match_plan.points), self.max_points, self.overlap)
+        if len(windows) == 1:
+            return await super().calculate(match_plan, session, **options)
+        if session is None:
+            async with self.create_session(concurrency=len(windows)) as session:
+                return await self.calculate(match_plan, session, **options)
+
+        responses, timings = zip(
+            *await asyncio.gather(
+                *(
+                    self._fetch_plan(
+                        MatchPlan(match_plan.points[start:end]), session, **options
+                    )
+                    for start, end in windows
+                )
+            )
+        )
+        return self._build_route(
+            stitch_match_responses(responses, windows), merge_timings(timings)
+        )
+
+    def _generate_request(self, match_plan, **options):
+        return (
+            "POST",
+            self.host,
+            {
+                "json": self._generate_payload(match_plan, **options),
+                "auth": _basic_auth(self.user, self.password),
+                "headers": self.headers,
+            },
+        )
+
+
+ASYNC_ROUTERS = {
+    "mapbox": AsyncMapboxRouter,
+    "google": AsyncGoogleRouter,
+    "mapbox-traffic": functools.partial(AsyncMapboxRouter, traffic=True),
+}
+
+ASYNC_MATCHERS = {"mapbox": AsyncMapboxMatcher}
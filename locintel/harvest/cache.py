@@ -0,0 +1,490 @@
+"""
+Caches in front of routers and matchers: a persistent, content-addressed cache of raw service responses, so that
+experiments can be re-run (or replayed offline) without re-requesting unchanged plans, and an approximate, in-memory
+route cache matching plans whose waypoints are within a spatial tolerance
+"""
+from collections import defaultdict
+import copy
+import hashlib
+import itertools
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+import requests
+
+try:
+    import orjson
+except ImportError:  # optional fast JSON decoder (pip install locintel[fast])
+    orjson = None
+
+from locintel.core.algorithms.geo import haversine_distances, METERS_PER_DEGREE
+
+from .concurrency import THROTTLE_STATUSES, get_controller
+from .limiters import get_limiter
+from .telemetry import connection_timing, start_connection_timing, telemetry
+
+# fraction of max_size that eviction brings the cache down to, so that it runs once per batch of inserts
+EVICTION_TARGET = 0.9
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+def loads(data):
+    """
+    Parses JSON bytes or str, with orjson when installed
+    """
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class ResponseCache(object):
+    def __init__(self, path, ttl=None, max_size=None, replay=False):
+        """
+        Sqlite-backed cache of raw (JSON) responses, keyed by a canonical hash of request method, URL and payload
+
+        Credentials passed as auth/headers are not part of the key, and URLs are never stored (only hashed).
+        Safe to share across threads and processes: connections are opened lazily per process and thread, and are
+        never pickled.
+
+        :param path: sqlite database file
+        :param ttl: time to live of entries, in seconds (None for no expiry)
+        :param max_size: maximum total size of stored (compressed) responses, in bytes; least recently used entries
+                         are evicted beyond it, down to EVICTION_TARGET of it (None for unbounded)
+        :param replay: strict offline replay mode, misses raise CacheMiss instead of reaching the network
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.replay = replay
+        self._local = threading.local()
+        self._pid = None
+        self._get_connection()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_local=None, _pid=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def __len__(self):
+        return (
+            self._get_connection()
+            .execute("SELECT COUNT(*) FROM responses")
+            .fetchone()[0]
+        )
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @staticmethod
+    def key(method, url, payload=None):
+        """
+        Canonical request hash, independent of payload key order
+        """
+        canonical = json.dumps(
+            [method.upper(), url, payload], sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        :return: (response, calc_time) tuple, or None if key is missing or expired
+        """
+        connection = self._get_connection()
+        row = connection.execute(
+            "SELECT response, calc_time, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        response, calc_time, created = row
+        now = time.time()
+        if self.ttl is not None and created + self.ttl < now:
+            with connection:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+
+        with connection:
+            connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return loads(zlib.decompress(response)), calc_time
+
+    def lookup(self, key):
+        """
+        As get, but raises CacheMiss on misses in replay mode
+        """
+        result = self.get(key)
+        if result is None and self.replay:
+            raise CacheMiss(key)
+        return result
+
+    def set(self, key, response, calc_time=None):
+        data = zlib.compress(json.dumps(response, separators=(",", ":")).encode())
+        now = time.time()
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "response = excluded.response, calc_time = excluded.calc_time, created = excluded.created, "
+                "accessed = excluded.accessed, size = excluded.size",
+                (key, data, calc_time, now, now, len(data)),
+            )
+            if self.max_size is not None and self._size(connection) > self.max_size:
+                self._evict(connection, self.max_size * EVICTION_TARGET)
+
+    def delete(self, key):
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def size(self):
+        """
+        Total size of stored responses, in bytes
+        """
+        return self._size(self._get_connection())
+
+    def evict(self, max_size):
+        """
+        Evicts least recently used entries until total size is at most max_size bytes
+        """
+        connection = self._get_connection()
+        with connection:
+            self._evict(connection, max_size)
+
+    @staticmethod
+    def _size(connection):
+        # running total, kept by triggers on responses
+        return connection.execute("SELECT size FROM stats").fetchone()[0]
+
+    def _evict(self, connection, max_size):
+        excess = self._size(connection) - max_size
+        if excess <= 0:
+            return
+
+        keys, freed = [], 0
+        for key, size in connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def purge(self):
+        """
+        Removes expired entries
+        """
+        if self.ttl is None:
+            return
+        connection = self._get_connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+            )
+
+    def clear(self):
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM responses")
+
+    def _get_connection(self):
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response BLOB, calc_time REAL, "
+                    "created REAL, accessed REAL, size INTEGER)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+                )
+                self._create_stats(connection)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _create_stats(connection):
+        """
+        Single row table holding the total size of responses, so that inserts need not sum it
+        """
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)"
+        )
+        if connection.execute("SELECT COUNT(*) FROM stats").fetchone()[0] == 0:
+            # databases created before the table existed
+            connection.execute(
+                "INSERT OR IGNORE INTO stats SELECT 0, COALESCE(SUM(size), 0) FROM responses"
+            )
+        for trigger, event, change in (
+            ("insert", "INSERT", "new.size"),
+            ("delete", "DELETE", "-old.size"),
+            ("update", "UPDATE OF size", "new.size - old.size"),
+        ):
+            connection.execute(
+                f"CREATE TRIGGER IF NOT EXISTS responses_size_{trigger} AFTER {event} ON responses "
+                f"BEGIN UPDATE stats SET size = size + {change}; END"
+            )
+
+
+def fetch(session, method, url, cache=None, limiter=None, controller=None, **kwargs):
+    """
+    Requests JSON response, going through cache if given (only successful responses are cached)
+
+    Throttled requests (429/503) are retried up to session.retries times, with session backoff, and every attempt
+    takes a limiter token, so that the limiter bounds actual HTTP requests.
+
+    Timing of requests holds calc_time (service response time, from sending request to parsing response headers,
+    cached along with response), and for requests which were not cached, dns and connect (time spent opening new
+    connections, zero if pooled connections were reused), ttfb (from having sent request to receiving response
+    headers, None unless session connections are timed, see locintel.harvest.telemetry.TimedHTTPAdapter), total
+    (including response body and retries), in seconds, and request_size and response_size, in bytes.
+
+    :param session: locintel.harvest.sessions.HarvestSession
+    :param method: HTTP method
+    :param url: request URL
+    :param cache: ResponseCache object (None for no caching)
+    :param limiter: locintel.harvest.limiters.TokenBucket, acquired before every attempt (cache hits are not limited)
+    :param controller: locintel.harvest.concurrency.AdaptiveConcurrency, holding a slot while each attempt is in
+                       flight, and told whether it was throttled (429/503 or timeout)
+    :param kwargs: request keyword arguments (json payload is part of cache key)
+    :return: (response json, timing dict, requests.Response or None on cache hits)
+    """
+    key = None
+    if cache is not None:
+        key = cache.key(method, url, kwargs.get("json"))
+        cached = cache.lookup(key)
+        if cached is not None:
+            response, calc_time = cached
+            return response, {"calc_time": calc_time, "cached": True}, None
+
+    start_connection_timing()
+    start = time.perf_counter()
+    for attempt in itertools.count():
+        if limiter is not None:
+            limiter.acquire()
+        response = _attempt(session, method, url, controller, **kwargs)
+        if response.status_code not in THROTTLE_STATUSES or attempt >= session.retries:
+            break
+        time.sleep(
+            session.get_backoff_time(attempt, response.headers.get("Retry-After"))
+        )
+    response.raise_for_status()
+    data = loads(response.content)
+    dns, connect, ttfb = connection_timing()
+    calc_time = response.elapsed.total_seconds()
+    timing = {
+        "calc_time": calc_time,
+        "dns": dns,
+        "connect": connect,
+        "ttfb": ttfb,
+        "total": time.perf_counter() - start,
+        "request_size": len(response.request.body or b""),
+        "response_size": len(response.content),
+    }
+    if cache is not None:
+        cache.set(key, data, calc_time)
+    return data, timing, response
+
+
+class HarvesterMixin(object):
+    """
+    Requests of routers, matchers, matrix routers and geocoders (holding session, cache, limiter and last_response
+    attributes): through fetch, with their rate limiter and concurrency controller, recorded into telemetry under
+    their name
+    """
+
+    def get_limiter(self):
+        return self.limiter or get_limiter(getattr(self, "name", None))
+
+    def get_controller(self):
+        return get_controller(getattr(self, "name", None))
+
+    def _fetch(self, method, url, use_cache=True, **kwargs):
+        """
+        :param use_cache: go through cache (harvesters caching per query rather than per request set it to False)
+        :return: (response json, timing dict)
+        """
+        response, timing, self.last_response = fetch(
+            self.session,
+            method,
+            url,
+            cache=self.cache if use_cache else None,
+            limiter=self.get_limiter(),
+            controller=self.get_controller(),
+            **kwargs,
+        )
+        if not timing.get("cached"):
+            telemetry.record(getattr(self, "name", None), timing)
+        return response, timing
+
+
+def _attempt(session, method, url, controller=None, **kwargs):
+    if controller is None:
+        return session.request(method, url, **kwargs)
+
+    slot = controller.acquire()
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.Timeout:
+        controller.release(slot, throttled=True)
+        raise
+    except BaseException:
+        controller.release(slot, failed=True)
+        raise
+    controller.release(slot, throttled=response.status_code in THROTTLE_STATUSES)
+    return response
+
+
+class SpatialRouteCache(object):
+    def __init__(self, radius=50):
+        """
+        In-memory approximate route cache: a RoutePlan hits a cached route if it has the same number of waypoints,
+        vehicle and strategy, and all its waypoints are within radius of the cached plan's ones
+
+        Cached plans are indexed on a grid over their start waypoints (cells of at least radius side), so lookups
+        only compare plans starting in neighbouring cells. Hits return a copy of the cached route, flagged as
+        approximate in its metadata (with the maximum waypoint offset, in meters).
+
+        :param radius: maximum distance between corresponding waypoints, in meters
+        """
+        self.radius = radius
+        self.cell_degrees = radius / METERS_PER_DEGREE
+        self.cells = defaultdict(list)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.cells.values())
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "size": len(self),
+        }
+
+    def get(self, route_plan, provider=None):
+        """
+        :param route_plan: RoutePlan object
+        :param provider: provider name, cached routes are only shared within provider
+        :return: closest cached Route (flagged as approximate), or None
+        """
+        waypoints = self._waypoints(route_plan)
+        group = self._group(route_plan, provider)
+        row = math.floor(waypoints[0][0] / self.cell_degrees)
+        best, best_offset = None, None
+
+        with self._lock:
+            for r in (row - 1, row, row + 1):
+                width = self._cell_width(r)
+                c = math.floor(waypoints[0][1] / width)
+                for key in ((group, r, c - 1), (group, r, c), (group, r, c + 1)):
+                    for cached_waypoints, route in self.cells.get(key, ()):
+                        offset = self._offset(waypoints, cached_waypoints)
+                        if offset is not None and (
+                            best_offset is None or offset < best_offset
+                        ):
+                            best, best_offset = route, offset
+
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        route = copy.copy(best)
+        route.metadata = dict(
+            best.metadata, approximate=True, approximate_offset=best_offset
+        )
+        return route
+
+    def set(self, route_plan, route, provider=None):
+        waypoints = self._waypoints(route_plan)
+        row, col = self._cell(*waypoints[0])
+        with self._lock:
+            self.cells[(self._group(route_plan, provider), row, col)].append(
+                (waypoints, route)
+            )
+
+    def clear(self):
+        with self._lock:
+            self.cells.clear()
+            self.hits = self.misses = 0
+
+    def _offset(self, waypoints, cached_waypoints):
+        if len(waypoints) != len(cached_waypoints):
+            return None
+        distances = haversine_distances(
+            waypoints[:, 0],
+            waypoints[:, 1],
+            cached_waypoints[:, 0],
+            cached_waypoints[:, 1],
+        )
+        offset = float(distances.max())
+        return offset if offset <= self.radius else None
+
+    def _cell(self, lat, lng):
+        row = math.floor(lat / self.cell_degrees)
+        return row, math.floor(lng / self._cell_width(row))
+
+    def _cell_width(self, row):
+        """
+        Cell width in degrees of longitude for given grid row, so that cells are at least radius wide in the row and
+        in its neighbouring rows
+        """
+        lat = (max(abs(row), abs(row + 1)) + 1) * self.cell_degrees
+        return self.cell_degrees / max(math.cos(math.radians(min(lat, 89))), 1e-6)
+
+    @staticmethod
+    def _waypoints(route_plan):
+        return np.array([(w.lat, w.lng) for w in route_plan.get_waypoints()])
+
+    @staticmethod
+    def _group(route_plan, provider):
+        return provider, route_plan.vehicle, route_plan.strategy
+
+
+class ApproximateRouter(object):
+    def __init__(self, router, cache):
+        """
+        Router wrapper serving routes from a SpatialRouteCache, falling back to (and populating the cache from)
+        the wrapped router
+
+        :param router: router object (e.g. locintel.harvest.routes.MapboxRouter)
+        :param cache: SpatialRouteCache object
+        """
+        self.router = router
+        self.cache = cache
+        self.name = getattr(router, "name", str(router))
+
+    def calculate(self, route_plan, **kwargs):
+        route = self.cache.get(route_plan, self.name)
+        if route is None:
+            route = self.router.calculate(route_plan, **kwargs)
+            self.cache.set(route_plan, route, self.name)
+        return route
@@ -0,0 +1,161 @@
+"""
+Adaptive (AIMD) concurrency control: number of in-flight requests per provider grows while latency stays flat and
+the provider does not throttle, and is cut multiplicatively when it does
+"""
+from collections import deque
+import threading
+import time
+
+THROTTLE_STATUSES = (429, 503)
+
+# provider name (router/matcher name attribute) -> AdaptiveConcurrency keyword arguments
+CONCURRENCY_LIMITS = dict()
+
+_controllers = dict()
+
+
+class AdaptiveConcurrency(object):
+    def __init__(
+        self,
+        initial=4,
+        minimum=1,
+        maximum=64,
+        backoff=0.5,
+        tolerance=2.0,
+        smoothing=0.2,
+        window=100,
+    ):
+        """
+        Additive-increase/multiplicative-decrease limit on concurrent requests, shared by the threads of a process
+
+        Every successful request under the limit adds 1 / limit, i.e. the limit grows by one per round of requests
+        (until the first decrease, every successful request adds 1, doubling the limit per round, so that the limit
+        quickly reaches provider capacity from a conservative initial value). The limit is multiplied by backoff
+        when a request is throttled (429/503) or times out, or when smoothed latency exceeds tolerance times the
+        baseline latency (minimum over the last window requests). Requests failing otherwise leave the limit as is.
+        Only requests started after the last decrease can trigger another one, so a single congestion episode backs
+        off once.
+
+        :param initial: initial limit
+        :param minimum: minimum limit
+        :param maximum: maximum limit
+        :param backoff: multiplicative decrease factor
+        :param tolerance: latency increase over baseline considered congestion
+        :param smoothing: weight of last latency in exponentially smoothed latency
+        :param window: number of latencies for baseline
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.latencies = deque(maxlen=window)
+        self.latency = None
+        self.in_flight = 0
+        self.decreases = 0
+        self.slow_start = True
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_condition=None, in_flight=0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._condition = threading.Condition()
+
+    @property
+    def baseline(self):
+        return min(self.latencies) if self.latencies else None
+
+    def acquire(self):
+        """
+        Blocks until a request slot is available
+
+        :return: start time, to be given back on release
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, start, throttled=False, failed=False):
+        """
+        Frees request slot, and adapts limit to the outcome of the request
+
+        :param start: start time, as returned by acquire
+        :param throttled: whether request was throttled (429/503) or timed out
+        :param failed: whether request failed for another reason (e.g. invalid request, connection refused), in which
+                       case the limit is left unchanged
+        """
+        now = time.monotonic()
+        with self._condition:
+            self.in_flight -= 1
+            if failed and not throttled:
+                self._condition.notify_all()
+                return
+            congested = throttled
+            if not throttled:
+                latency = now - start
+                self.latencies.append(latency)
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else (1 - self.smoothing) * self.latency + self.smoothing * latency
+                )
+                congested = self.latency > self.tolerance * self.baseline
+
+            if congested:
+                if start >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.decreases += 1
+                    self.slow_start = False
+            else:
+                increase = 1 if self.slow_start else 1 / self.limit
+                self.limit = min(self.maximum, self.limit + increase)
+            self._condition.notify_all()
+
+    def stats(self):
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "baseline": self.baseline,
+            "decreases": self.decreases,
+        }
+
+
+def set_adaptive_concurrency(name, **kwargs):
+    """
+    Enables adaptive concurrency control of a provider, applied by every router/matcher with that name in this
+    process
+
+    :param name: provider name, as in router/matcher name attribute (e.g. "mapbox-routing", "google")
+    :param kwargs: AdaptiveConcurrency keyword arguments
+    """
+    _controllers.pop(name, None)
+    CONCURRENCY_LIMITS[name] = kwargs
+
+
+def disable_adaptive_concurrency(name):
+    """
+    Removes concurrency control of a provider
+    """
+    _controllers.pop(name, None)
+    CONCURRENCY_LIMITS.pop(name, None)
+
+
+def get_controller(name):
+    """
+    :return: AdaptiveConcurrency configured for provider name, or None if provider concurrency is not controlled
+    """
+    if name not in CONCURRENCY_LIMITS:
+        return None
+    if name not in _controllers:
+        _controllers[name] = AdaptiveConcurrency(**CONCURRENCY_LIMITS[name])
+    return _controllers[name]
@@ -0,0 +1,327 @@
+"""
+Streaming, resumable experiment runner: results are appended to a JSONL file as they complete, so memory is bounded
+regardless of the number of plans and a crashed run resumes where it stopped
+"""
+from datetime import datetime
+import functools
+import json
+import multiprocessing
+import os
+import queue
+import traceback
+
+import numpy as np
+
+from locintel.core.datamodel.geo import Geometry
+from locintel.core.datamodel.routing import Route, RoutePlan, Waypoint
+from locintel.core.datamodel.testing import ExperimentResult, TestResult
+from locintel.core.utils.workers import init_worker_state, worker_state
+
+from .routes import calculate_competitive
+from .telemetry import Telemetry
+
+OK = "ok"
+ERROR = "error"
+
+_worker_state = worker_state(__name__)
+
+
+def _run_test(task):
+    """
+    :return: (status, serialized record) tuple
+    """
+    plan_id, route_plan = task
+    try:
+        test = calculate_competitive(route_plan, **_worker_state)
+        return OK, dumps_record(plan_id, test)
+    except Exception as e:
+        return ERROR, _dumps_error(plan_id, e, traceback.format_exc())
+
+
+def _to_json(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _dumps_error(plan_id, error, trace=None):
+    return json.dumps(
+        {"id": plan_id, "status": ERROR, "error": repr(error), "traceback": trace},
+        default=_to_json,
+    )
+
+
+def dumps_record(plan_id, test):
+    """
+    Serializes TestResult into a single JSON line
+    """
+    plan = test.plan
+    record = {
+        "id": plan_id,
+        "status": OK,
+        "name": test.name,
+        "plan": {
+            "waypoints": [(w.lng, w.lat) for w in plan.get_waypoints()],
+            "vehicle": plan.vehicle,
+            "strategy": plan.strategy,
+            "metadata": plan.metadata,
+        },
+        "routes": {
+            provider: {
+                "geometry": route.geometry.to_lng_lat_tuples(),
+                "distance": route.distance,
+                "duration": route.duration,
+                "metadata": route.metadata,
+            }
+            for provider, route in test.routes.items()
+        },
+        "metrics": test.metrics,
+        "timed_out": test.timed_out,
+    }
+    return json.dumps(record, default=_to_json)
+
+
+def loads_record(record):
+    """
+    Deserializes successful record (as dict) into TestResult
+    """
+    waypoints = [Waypoint(lat, lng) for lng, lat in record["plan"]["waypoints"]]
+    plan = RoutePlan(
+        waypoints[0],
+        waypoints[-1],
+        intermediate_waypoints=waypoints[1:-1],
+        vehicle=record["plan"]["vehicle"],
+        strategy=record["plan"]["strategy"],
+        metadata=record["plan"]["metadata"],
+    )
+    routes = dict()
+    for provider, route in record["routes"].items():
+        metadata = route["metadata"]
+        if isinstance(metadata.get("date"), str):
+            metadata["date"] = datetime.fromisoformat(metadata["date"])
+        routes[provider] = Route(
+            Geometry.from_lng_lat_tuples(route["geometry"]),
+            route["distance"],
+            route["duration"],
+            metadata=metadata,
+        )
+    return TestResult(
+        record["name"],
+        plan,
+        routes,
+        record["metrics"],
+        timed_out=record.get("timed_out"),
+    )
+
+
+def read_records(path):
+    """
+    Iterates over records of a results file, ignoring a truncated last line (e.g. from a crashed run)
+    """
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                return
+            yield json.loads(line)
+
+
+def load_experiment(path):
+    """
+    Loads successful tests of results file(s) into memory, as ExperimentResult (last record per plan id wins), with
+    request telemetry of its routes
+
+    :param path: results file, or list of results files
+    """
+    tests = [loads_record(record) for record in _last_records(path, OK).values()]
+    return ExperimentResult(tests, telemetry=Telemetry.from_experiment(tests).summary())
+
+
+def load_failures(path):
+    """
+    :param path: results file, or list of results files
+    :return: dict of plan id -> error record, for plans whose last record is a failure
+    """
+    return _last_records(path, ERROR)
+
+
+def _last_records(path, status):
+    paths = [path] if isinstance(path, (str, os.PathLike)) else path
+    records = dict()
+    for results_file in paths:
+        for record in read_records(results_file):
+            if record["status"] == status:
+                records[record["id"]] = record
+            else:
+                records.pop(record["id"], None)
+    return records
+
+
+def default_plan_id(index, route_plan):
+    """
+    Plan name (attribute or metadata), falling back to its position in the input sequence
+    """
+    return (
+        getattr(route_plan, "name", None)
+        or getattr(route_plan, "metadata", {}).get("name")
+        or index
+    )
+
+
+class ExperimentRunner(object):
+    def __init__(
+        self,
+        providers,
+        comparators=None,
+        jobs=7,
+        cache=None,
+        write_geojson=None,
+        max_pending=None,
+    ):
+        """
+        Streaming counterpart of locintel.harvest.routes.run_experiment
+
+        Each completed plan is appended to a JSONL results file as soon as it is done (one record per line, with
+        status "ok" or "error"), and plans already completed in the file are skipped, so interrupted runs can be
+        resumed. Failures are recorded (with traceback) instead of aborting the run. At most max_pending plans are
+        in flight, so memory is bounded for arbitrarily large (lazy) plan iterables.
+
+        The worker pool is created on first run and reused across runs, until close (or context manager exit).
+
+        :param providers: list of providers (see locintel.harvest.routes.ROUTERS)
+        :param comparators: list of geometry comparators (see locintel.harvest.routes.calculate_competitive)
+        :param jobs: number of worker processes (1 runs in-process)
+        :param cache: locintel.harvest.cache.ResponseCache object
+        :param write_geojson: directory to write route geometries to, as geojson
+        :param max_pending: maximum number of plans in flight (defaults to 4 * jobs)
+        """
+        self.providers = providers
+        self.jobs = jobs
+        self.max_pending = max_pending or 4 * jobs
+        self.worker_kwargs = {
+            "providers": providers,
+            "comparators": comparators,
+            "write_geojson": write_geojson,
+            "cache": cache,
+        }
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self.jobs,
+                initializer=init_worker_state,
+                initargs=(__name__, dict, self.worker_kwargs),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def run(self, route_plans, output, plan_id=default_plan_id, retry_failed=True):
+        """
+        :param route_plans: iterable of RoutePlan objects (consumed lazily)
+        :param output: JSONL results file, appended to
+        :param plan_id: function (index, route_plan) -> unique, JSON-serializable plan id
+        :param retry_failed: if True, plans whose last record is a failure are calculated again
+        :return: dict with number of completed, failed and skipped plans
+        """
+        done = set()
+        for record in read_records(output):
+            if record["status"] == OK or not retry_failed:
+                done.add(record["id"])
+            else:
+                done.discard(record["id"])
+        _truncate_partial_line(output)
+
+        summary = {"completed": 0, "failed": 0, "skipped": 0}
+        tasks = (
+            (plan_id(i, route_plan), route_plan)
+            for i, route_plan in enumerate(route_plans)
+        )
+        pending = (task for task in tasks if not _skip(task, done, summary))
+
+        with open(output, "a") as f:
+
+            def write(result):
+                status, line = result
+                f.write(line + "\n")
+                f.flush()
+                summary["completed" if status == OK else "failed"] += 1
+
+            if self.jobs == 1:
+                init_worker_state(__name__, dict, self.worker_kwargs)
+                for task in pending:
+                    write(_run_test(task))
+            else:
+                self._run_pool(pending, write)
+
+        return summary
+
+    def _run_pool(self, tasks, write):
+        results = queue.Queue()
+        tasks = iter(tasks)
+        in_flight = 0
+        while True:
+            if in_flight >= self.max_pending:
+                write(results.get())
+                in_flight -= 1
+                continue
+            task = next(tasks, None)
+            if task is None:
+                break
+            self.pool.apply_async(
+                _run_test,
+                (task,),
+                callback=results.put,
+                error_callback=functools.partial(_put_error, results, task[0]),
+            )
+            in_flight += 1
+        for _ in range(in_flight):
+            write(results.get())
+
+
+def _skip(task, done, summary):
+    if task[0] in done:
+        summary["skipped"] += 1
+        return True
+    return False
+
+
+def _put_error(results, plan_id, error):
+    results.put((ERROR, _dumps_error(plan_id, error)))
+
+
+def _truncate_partial_line(path):
+    """
+    Drops trailing partial line left by a crashed run, so that appended records start on a new line
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = position = f.tell()
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != size:
+            f.truncate(position)
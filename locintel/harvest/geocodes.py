@@ -0,0 +1,297 @@
+"""
+Geocoders: address queries are normalised and deduplicated, requested in batches where providers have a batch
+endpoint, concurrently, and cached per query (so that cached results are reused whatever batch they come from)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import re
+import unicodedata
+from urllib.parse import urlencode
+
+from locintel.core.datamodel.geocoding import GeocodedCoordinate
+
+from .cache import HarvesterMixin
+from .sessions import default_session
+
+
+def normalize_query(query):
+    """
+    Canonical form of an address query: unicode compatibility form, single spaces, ", " between address components,
+    no leading or trailing separators, case folded (geocoders are case insensitive)
+    """
+    query = unicodedata.normalize("NFKC", query)
+    query = re.sub(r"\s*(,\s*)+", ", ", query)
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(" ,;.").casefold()
+
+
+class AbstractGeocoder(HarvesterMixin):
+    # maximum number of queries per request
+    batch_size = 1
+
+    def __init__(
+        self, endpoint, adapter, session=None, cache=None, limiter=None, **kwargs
+    ):
+        """
+        :param endpoint: service endpoint
+        :param adapter: response adapter class, converting service responses (of a single query) into
+                        GeocodedCoordinate objects
+        :param session: locintel.harvest.sessions.HarvestSession (defaults to process-wide pooled session)
+        :param cache: locintel.harvest.cache.ResponseCache, to reuse raw responses of already geocoded queries
+        :param limiter: locintel.harvest.limiters.TokenBucket (defaults to limiter configured for provider name, see
+                        locintel.harvest.limiters.set_rate_limit)
+        :param kwargs: provider query options (e.g. language, country)
+        """
+        self.endpoint = endpoint
+        self.adapter = adapter
+        self.session = session or default_session
+        self.cache = cache
+        self.limiter = limiter
+        self.options = kwargs
+        self.last_response = None
+
+    def geocode(self, query):
+        """
+        :return: GeocodedCoordinate, or None if query could not be geocoded
+        """
+        return self.geocode_many([query], jobs=1)[0]
+
+    def geocode_many(self, queries, jobs=8):
+        """
+        Geocodes queries, requesting every distinct (normalised) query once, in batches of up to batch_size queries
+        calculated by up to jobs threads
+
+        Failed batches are logged, and their queries are not geocoded (nor cached).
+
+        :param queries: iterable of address strings
+        :param jobs: maximum number of requests in flight
+        :return: list of GeocodedCoordinate (None for queries which could not be geocoded), in queries order
+        """
+        normalized = [normalize_query(query) for query in queries]
+        results = dict()
+        missing = list()
+        for query in dict.fromkeys(query for query in normalized if query):
+            cached = (
+                self.cache.lookup(self._cache_key(query))
+                if self.cache is not None
+                else None
+            )
+            if cached is None:
+                missing.append(query)
+            else:
+                results[query] = self.adapter(cached[0]).get_geocode(query)
+
+        batches = [
+            missing[i : i + self.batch_size]
+            for i in range(0, len(missing), self.batch_size)
+        ]
+
+        def geocode_batch(batch):
+            try:
+                return self._geocode_batch(batch)
+            except Exception as e:
+                logging.warning(
+                    f"Geocoding batch of {len(batch)} queries ({batch[0]}, ...) failed: {e}"
+                )
+                return dict()
+
+        with ThreadPoolExecutor(
+            max_workers=max(min(jobs, len(batches)), 1)
+        ) as executor:
+            for batch_results in executor.map(geocode_batch, batches):
+                results.update(batch_results)
+        return [results.get(query) for query in normalized]
+
+    def _geocode_batch(self, queries):
+        method, url, kwargs = self._generate_request(queries)
+        # cached per query below, rather than per batch request
+        response, timing = self._fetch(method, url, use_cache=False, **kwargs)
+
+        responses = self._split_response(response, queries)
+        results = {
+            query: self.adapter(raw).get_geocode(query)
+            for query, raw in zip(queries, responses)
+        }
+        if self.cache is not None:
+            for query, raw in zip(queries, responses):
+                self.cache.set(self._cache_key(query), raw, timing["calc_time"])
+        return results
+
+    def _generate_request(self, queries):
+        """
+        :return: (method, url, keyword arguments for requests) of a batch of queries
+        """
+        raise NotImplementedError("Please implement subclass method")
+
+    def _split_response(self, response, queries):
+        """
+        :return: raw response of each query of a batch
+        """
+        return [response]
+
+    def _cache_key(self, query):
+        return self.cache.key(
+            "GEOCODE", self.endpoint, {"query": query, "options": self.options}
+        )
+
+
+class GoogleGeocoder(AbstractGeocoder):
+    def __init__(
+        self,
+        endpoint="https://maps.googleapis.com/maps/api/geocode/json?",
+        key="",
+        adapter=None,
+        session=None,
+        cache=None,
+        limiter=None,
+        **kwargs,
+    ):
+        adapter = adapter or GoogleGeocoderResponseAdapter
+        super().__init__(endpoint, adapter, session, cache, limiter, **kwargs)
+        self.key = key
+        self.name = "google"  # same quota (and rate limiter) as GoogleRouter
+
+    def _generate_request(self, queries):
+        (query,) = queries
+        return (
+            "GET",
+            self.endpoint
+            + urlencode({"address": query, **self.options, "key": self.key}),
+            {},
+        )
+
+
+class MapboxGeocoder(AbstractGeocoder):
+    batch_size = 1000
+
+    def __init__(
+        self,
+        endpoint="https://api.mapbox.com/search/geocode/v6/batch",
+        access_token="",
+        adapter=None,
+        session=None,
+        cache=None,
+        limiter=None,
+        **kwargs,
+    ):
+        adapter = adapter or GeoJSONGeocoderResponseAdapter
+        super().__init__(endpoint, adapter, session, cache, limiter, **kwargs)
+        self.access_token = access_token
+        self.name = "mapbox-geocoding"
+
+    def _generate_request(self, queries):
+        return (
+            "POST",
+            f"{self.endpoint}?access_token={self.access_token}",
+            {"json": [{"q": query, "limit": 1, **self.options} for query in queries]},
+        )
+
+    def _split_response(self, response, queries):
+        try:
+            responses = response["batch"]
+        except KeyError:
+            raise ValueError('Could not find batch field in response (["batch"])')
+        if len(responses) != len(queries):
+            raise ValueError(
+                f"Batch response has {len(responses)} results for {len(queries)} queries"
+            )
+        return responses
+
+
+class AbstractGeocoderResponseAdapter(object):
+    def __init__(self, response):
+        self.response = response
+
+    def get_geocode(self, query=None):
+        """
+        :return: GeocodedCoordinate of best match, or None if there was no match
+        :raises ValueError: on error responses
+        """
+        raise NotImplementedError("Please implement subclass method")
+
+
+class GeoJSONGeocoderResponseAdapter(AbstractGeocoderResponseAdapter):
+    """
+    Adapter of GeoJSON FeatureCollection responses (Mapbox, Pelias, Photon, ...), first feature being the best match
+
+    Confidence is read from feature properties: numeric confidence (Pelias), Mapbox match_code confidence level, or
+    relevance (Mapbox v5).
+    """
+
+    MATCH_CODE_CONFIDENCE = {"exact": 1.0, "high": 0.8, "medium": 0.5, "low": 0.2}
+
+    def get_geocode(self, query=None):
+        try:
+            features = self.response["features"]
+        except KeyError:
+            raise ValueError('Could not find features field in response (["features"])')
+        if not features:
+            return None
+
+        lng, lat = features[0]["geometry"]["coordinates"][:2]
+        properties = features[0].get("properties") or {}
+        return GeocodedCoordinate(
+            lat,
+            lng,
+            confidence=self.get_confidence(properties),
+            address=properties.get("full_address")
+            or properties.get("label")
+            or properties.get("name"),
+            query=query,
+        )
+
+    def get_confidence(self, properties):
+        if isinstance(properties.get("confidence"), (int, float)):
+            return properties["confidence"]
+        match_code = properties.get("match_code") or {}
+        if match_code.get("confidence") in self.MATCH_CODE_CONFIDENCE:
+            return self.MATCH_CODE_CONFIDENCE[match_code["confidence"]]
+        return properties.get("relevance")
+
+
+class GoogleGeocoderResponseAdapter(AbstractGeocoderResponseAdapter):
+    # confidence of result location types, halved for partial matches
+    LOCATION_TYPE_CONFIDENCE = {
+        "ROOFTOP": 1.0,
+        "RANGE_INTERPOLATED": 0.8,
+        "GEOMETRIC_CENTER": 0.6,
+        "APPROXIMATE": 0.4,
+    }
+
+    def get_geocode(self, query=None):
+        status = self.response.get("status")
+        if status == "ZERO_RESULTS":
+            return None
+        if status != "OK":
+            raise ValueError(
+                f"Geocoding failed with status {status}: {self.response.get('error_message')}"
+            )
+
+        result = self.response["results"][0]
+        location = result["geometry"]["location"]
+        confidence = self.LOCATION_TYPE_CONFIDENCE.get(
+            result["geometry"].get("location_type")
+        )
+        if confidence is not None and result.get("partial_match"):
+            confidence /= 2
+        return GeocodedCoordinate(
+            location["lat"],
+            location["lng"],
+            confidence=confidence,
+            address=result.get("formatted_address"),
+            query=query,
+        )
+
+
+GEOCODERS = {"google": GoogleGeocoder, "mapbox": MapboxGeocoder}
+
+
+def geocode(queries, provider, jobs=8, **kwargs):
+    """
+    :param queries: iterable of address strings
+    :param provider: provider name, in GEOCODERS
+    :param jobs: maximum number of requests in flight
+    :param kwargs: geocoder arguments (e.g. key, cache, provider query options)
+    :return: list of GeocodedCoordinate (None for queries which could not be geocoded), in queries order
+    """
+    return GEOCODERS[provider](**kwargs).geocode_many(queries, jobs)
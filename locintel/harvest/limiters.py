@@ -0,0 +1,182 @@
+"""
+Token-bucket rate limiters shared by all threads and processes of a host, so that provider quotas hold no matter how
+many workers harvest concurrently
+"""
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # e.g. Windows, buckets are then shared by the threads of a process only
+    fcntl = None
+
+STATE = struct.Struct("dd")  # tokens, last refill time
+
+# provider name (router/matcher name attribute) -> TokenBucket keyword arguments, see set_rate_limit
+RATE_LIMITS = dict()
+
+_limiters = dict()
+
+
+class TokenBucket(object):
+    def __init__(self, name, rate, capacity=None, path=None):
+        """
+        Token bucket whose state lives in a lock file, shared by every TokenBucket of the same name on the host
+        (on platforms without fcntl, state lives in memory and is shared by the threads of a process only)
+
+        Tokens refill at rate per second up to capacity (burst size). Acquiring more tokens than available reserves
+        them (the bucket goes negative), and the caller sleeps until they would have refilled, so waiting callers
+        are served in arrival order without polling.
+
+        :param name: bucket name (e.g. provider name)
+        :param rate: sustained rate, in tokens (requests) per second
+        :param capacity: maximum burst, in tokens (defaults to one second worth of tokens)
+        :param path: state file (defaults to a file named after the bucket in the temporary directory)
+        """
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.path = path or os.path.join(
+            tempfile.gettempdir(), f"locintel-ratelimit-{name}.bucket"
+        )
+        self.acquisitions = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._fd = None
+        self._pid = None
+        self._state = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_fd=None, _pid=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        Takes tokens from the bucket, without waiting
+
+        :return: time to wait before using the tokens, in seconds
+        """
+        with self._lock:
+            if fcntl is None:
+                self._state = self._take(self._state, tokens)
+                available = self._state[0]
+            else:
+                fd = self._get_fd()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    data = os.pread(fd, STATE.size, 0)
+                    state = self._take(
+                        STATE.unpack(data) if len(data) == STATE.size else None, tokens
+                    )
+                    os.pwrite(fd, STATE.pack(*state), 0)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                available = state[0]
+
+            wait = max(-available / self.rate, 0.0)
+            self.acquisitions += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait > 0:
+                self.waits += 1
+        return wait
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, sleeping until they are available
+
+        :return: time waited, in seconds
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        """
+        Wait-time statistics of this process' acquisitions
+        """
+        return {
+            "acquisitions": self.acquisitions,
+            "waits": self.waits,
+            "total_wait": self.total_wait,
+            "max_wait": self.max_wait,
+            "mean_wait": self.total_wait / self.acquisitions
+            if self.acquisitions
+            else 0.0,
+        }
+
+    def reset(self):
+        """
+        Refills bucket (for all processes) and clears statistics
+        """
+        with self._lock:
+            if fcntl is None:
+                self._state = (self.capacity, time.time())
+            else:
+                fd = self._get_fd()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    os.pwrite(fd, STATE.pack(self.capacity, time.time()), 0)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self.acquisitions = self.waits = 0
+            self.total_wait = self.max_wait = 0.0
+
+    def _take(self, state, tokens):
+        """
+        :param state: (tokens, last refill time) of bucket, None for a new (full) bucket
+        :return: state after refilling bucket up to now and taking tokens
+        """
+        now = time.time()
+        available, last = state if state is not None else (self.capacity, now)
+        available = min(self.capacity, available + max(now - last, 0) * self.rate)
+        return available - tokens, now
+
+    def _get_fd(self):
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._pid = os.getpid()
+        return self._fd
+
+
+def set_rate_limit(name, rate, capacity=None, path=None):
+    """
+    Configures rate limit of a provider, applied by every router/matcher with that name (set it before forking
+    workers, or in their initializer)
+
+    :param name: provider name, as in router/matcher name attribute (e.g. "mapbox-routing", "google")
+    :param rate: requests per second (None to remove limit)
+    :param capacity: burst capacity, in requests
+    :param path: shared state file
+    """
+    _limiters.pop(name, None)
+    if rate is None:
+        RATE_LIMITS.pop(name, None)
+    else:
+        RATE_LIMITS[name] = {"rate": rate, "capacity": capacity, "path": path}
+
+
+def get_limiter(name):
+    """
+    :return: TokenBucket configured for provider name, or None if provider is not rate limited
+    """
+    if name not in RATE_LIMITS:
+        return None
+    if name not in _limiters:
+        _limiters[name] = TokenBucket(name, **RATE_LIMITS[name])
+    return _limiters[name]
+
+
+if os.getenv("ROUTER_ENV") == "staging":
+    set_rate_limit("mapbox-matching", rate=1200 / 60)  # allow 20req/s
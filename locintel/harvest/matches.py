@@ -1,26 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import os
+import time
 
-from ratelimit import limits, sleep_and_retry
-import requests
+import numpy as np
 
-from locintel.core.datamodel.geo import GeoCoordinate, Geometry
+from locintel.core.datamodel.geo import LazyGeometry, lat_lng_array
 from locintel.core.datamodel.routing import Route
 from locintel.core.datamodel.matching import MatchPlan
 
-ROUTER_CALLS = 1200 if os.getenv("ROUTER_ENV") == "staging" else -1
-ROUTER_PERIOD = 60 if os.getenv("ROUTER_ENV") == "staging" else -1
+from .cache import HarvesterMixin
+from .sessions import default_session
+from .telemetry import SIZES, TIMINGS
 
+# Mapbox map matching limit of points per request, for MapboxMatcher(max_points=MAX_POINTS)
+MAX_POINTS = 100
 
-class AbstractMatcher(object):
-    def __init__(self, host, adapter):
+
+class AbstractMatcher(HarvesterMixin):
+    def __init__(self, host, adapter, session=None, cache=None, limiter=None):
+        """
+        :param host: service endpoint
+        :param adapter: response adapter class, converting service responses into Route objects
+        :param session: locintel.harvest.sessions.HarvestSession (defaults to process-wide pooled session)
+        :param cache: locintel.harvest.cache.ResponseCache, to reuse raw responses of identical requests
+        :param limiter: locintel.harvest.limiters.TokenBucket (defaults to limiter configured for provider name, see
+                        locintel.harvest.limiters.set_rate_limit)
+        """
         self.host = host
         self.adapter = adapter
+        self.session = session or default_session
+        self.cache = cache
+        self.limiter = limiter
         self.last_response = None
 
     def calculate(self, *arg, **kwargs):
         raise NotImplementedError("Please implement subclass method")
 
+    def _get_route(self, method, url, **kwargs):
+        return self._build_route(*self._fetch(method, url, **kwargs))
+
+    def _build_route(self, response, timing):
+        return self.adapter(response).get_route(
+            metadata={
+                "calc_time": timing["calc_time"],
+                "date": datetime.now(),
+                "timing": timing,
+            }
+        )
+
 
 class MapboxMatcher(AbstractMatcher):
     def __init__(
@@ -30,31 +57,64 @@ class MapboxMatcher(AbstractMatcher):
         password=None,
         headers=None,
         adapter=None,
+        session=None,
+        cache=None,
+        limiter=None,
+        max_points=None,
+        overlap=10,
+        chunk_workers=8,
     ):
+        """
+        Match plans longer than max_points, if given, are split into windows of max_points, overlapping by (at least)
+        overlap points, requested concurrently and stitched back into one route (see stitch_match_responses)
+
+        :param max_points: maximum number of points per request, e.g. MAX_POINTS for services enforcing the Mapbox
+                           limit (None to never split plans, leaving long plans to the service)
+        :param overlap: number of points shared by consecutive windows, giving the matcher context at window ends
+        :param chunk_workers: maximum number of windows of a plan requested concurrently
+        """
         adapter = adapter or MapboxMatcherResponseAdapter
-        super().__init__(endpoint, adapter)
+        super().__init__(endpoint, adapter, session, cache, limiter)
+        if max_points is not None and not 0 <= overlap < max_points - 1:
+            raise ValueError(
+                f"Overlap ({overlap}) must be non-negative and less than max_points - 1 ({max_points - 1})"
+            )
         self.user = user
         self.password = password
         self.headers = {"Content-Type": "application/json"} or headers
+        self.max_points = max_points
+        self.overlap = overlap
+        self.chunk_workers = chunk_workers
         self.name = "mapbox-matching"
 
-    @sleep_and_retry
-    @limits(calls=ROUTER_CALLS, period=ROUTER_PERIOD)  # allow 20req/s
     def calculate(self, match_plan: MatchPlan, **options):
-        payload = self._generate_payload(match_plan, **options)
-        url = self.host
-        self.last_response = requests.post(
-            url, json=payload, auth=(self.user, self.password), headers=self.headers
-        )
+        windows = chunk_windows(len(match_plan.points), self.max_points, self.overlap)
+        if len(windows) == 1:
+            return self._get_route(
+                "POST", self.host, **self._request_kwargs(match_plan, **options)
+            )
 
-        self.last_response.raise_for_status()
-        return self.adapter(self.last_response.json()).get_route(
-            metadata={
-                "calc_time": self.last_response.elapsed.microseconds / 1e6,
-                "date": datetime.now(),
-            }
+        def calculate_window(window):
+            plan = MatchPlan(match_plan.points[window[0] : window[1]])
+            return self._fetch(
+                "POST", self.host, **self._request_kwargs(plan, **options)
+            )
+
+        with ThreadPoolExecutor(
+            max_workers=min(len(windows), self.chunk_workers)
+        ) as executor:
+            responses, timings = zip(*executor.map(calculate_window, windows))
+        return self._build_route(
+            stitch_match_responses(responses, windows), merge_timings(timings)
         )
 
+    def _request_kwargs(self, match_plan, **options):
+        return {
+            "json": self._generate_payload(match_plan, **options),
+            "auth": (self.user, self.password),
+            "headers": self.headers,
+        }
+
     @staticmethod
     def _generate_payload(match_plan: MatchPlan, **kwargs):
         locations = []
@@ -87,6 +147,145 @@ class MapboxMatcher(AbstractMatcher):
         return payload
 
 
+class LocalMatcher(AbstractMatcher):
+    def __init__(self, graph, adapter=None, **kwargs):
+        """
+        Offline matcher over a graph, with a hidden Markov model (see locintel.graphs.processing.matching.HMMMatcher),
+        whose responses have the format of MapboxMatcher ones (nodes being graph nodes)
+
+        :param graph: locintel.graphs.datamodel.jurbey.Jurbey object
+        :param kwargs: HMMMatcher parameters (e.g. sigma, beta, radius)
+        """
+        # graph dependencies (networkx) are only required by local matchers
+        from locintel.graphs.processing.matching import HMMMatcher
+
+        super().__init__(None, adapter or MapboxMatcherResponseAdapter)
+        self.hmm = HMMMatcher(graph, **kwargs)
+        self.name = "local-matching"
+
+    def calculate(
+        self, match_plan: MatchPlan, radius=None, report_geometry=False, **options
+    ):
+        """
+        :param radius: search radius of points without radius, in meters (defaults to matcher radius)
+        :param report_geometry: if True, matched geometry is reported
+        :param options: other service options (e.g. timestamps), ignored
+        """
+        start = time.perf_counter()
+        response = self.hmm.match(
+            [point.lat for point in match_plan.points],
+            [point.lng for point in match_plan.points],
+            [point.radius or radius for point in match_plan.points],
+            report_geometry=report_geometry,
+        )
+        if not response["matchings"]:
+            raise ValueError("Could not match trace onto graph")
+        calc_time = time.perf_counter() - start
+        return self._build_route(response, {"calc_time": calc_time, "total": calc_time})
+
+
+def chunk_windows(n, size=None, overlap=0):
+    """
+    Splits n trace points into windows of at most size points, consecutive windows sharing at least overlap points
+    (last window is aligned to the end of the trace, sharing more points with previous one if needed)
+
+    :return: list of (start, end) index ranges, a single (0, n) window if n <= size or size is None
+    """
+    if size is None or n <= size:
+        return [(0, n)]
+    windows = list()
+    start = 0
+    while start + size < n:
+        windows.append((start, start + size))
+        start += size - overlap
+    windows.append((n - size, n))
+    return windows
+
+
+def stitch_match_responses(responses, windows):
+    """
+    Stitches match responses of overlapping windows of a trace (see chunk_windows) into one response of the whole
+    trace, as if it had been matched in one request
+
+    Each window is trusted up to the middle of its overlap with the next one, where it has context on both sides:
+    legs are taken from the window in which they start, from where legs of previous window end, so that every leg
+    (and its nodes, distance and duration) is counted once. Legs are chained into one matching when a leg starts at
+    the trace point where previous one ends, otherwise a new matching is started (as the service does on gaps).
+    Tracepoints are taken from the same window as legs around them (None for windows without tracepoints), and
+    matching confidences are averaged over stitched windows, weighted by distance. Code is Ok if any window matched.
+
+    :param responses: match responses (see MapboxMatcherResponseAdapter), one per window
+    :param windows: (start, end) trace index range of each response
+    :return: match response, with trace indexes relative to the whole trace
+    """
+    matchings, confidences, tracepoints = list(), list(), list()
+    boundary = 0
+    for i, (response, (start, end)) in enumerate(zip(responses, windows)):
+        cut = (windows[i + 1][0] + end) // 2 if i + 1 < len(windows) else end
+        reach = cut
+        for matching in response.get("matchings", []):
+            for leg in matching["legs"]:
+                leg = dict(
+                    leg,
+                    traceFromIndex=leg["traceFromIndex"] + start,
+                    traceToIndex=leg["traceToIndex"] + start,
+                )
+                if not boundary <= leg["traceFromIndex"] < cut:
+                    continue
+                if (
+                    not matchings
+                    or matchings[-1]["legs"][-1]["traceToIndex"]
+                    != leg["traceFromIndex"]
+                ):
+                    matchings.append({"legs": []})
+                    confidences.append(list())
+                matchings[-1]["legs"].append(leg)
+                confidences[-1].append((matching["confidence"], leg["distance"]))
+                reach = max(reach, leg["traceToIndex"])
+        # windows without matches (e.g. NoMatch responses) may come without tracepoints
+        window_tracepoints = response.get("tracepoints") or [None] * (end - start)
+        tracepoints.extend(window_tracepoints[boundary - start : reach - start])
+        boundary = reach
+
+    for matching, weights in zip(matchings, confidences):
+        values, distances = np.array(weights, dtype=float).T
+        matching["confidence"] = float(
+            np.average(values, weights=distances)
+            if distances.sum() > 0
+            else values.mean()
+        )
+    return {
+        "code": "Ok" if matchings else responses[0].get("code", "Ok"),
+        "matchNumber": len(matchings),
+        "matchings": matchings,
+        "tracepoints": tracepoints,
+    }
+
+
+def merge_timings(timings):
+    """
+    Merges timings of requests made concurrently for one route: durations are those of the slowest request, sizes
+    add up, and the route counts as cached only if all requests were
+    """
+    merged = {"calc_time": max(timing["calc_time"] for timing in timings)}
+    for metric in TIMINGS:
+        values = [
+            timing[metric] for timing in timings if timing.get(metric) is not None
+        ]
+        if values:
+            merged[metric] = max(values)
+    for metric in SIZES:
+        values = [
+            timing[metric] for timing in timings if timing.get(metric) is not None
+        ]
+        if values:
+            merged[metric] = sum(values)
+    if all(timing.get("cached") for timing in timings):
+        merged["cached"] = True
+    merged["requests"] = len(timings)
+    return merged
+
+
 class AbstractMatcherResponseAdapter(object):
     def __init__(self, response):
         self.response = response
@@ -126,15 +325,9 @@ class MapboxMatcherResponseAdapter(AbstractMatcherResponseAdapter):
 
     def get_geometry(self, index=0):
         match = self.response["matchings"][index]
-        match_geometry = []
-        for leg in match["legs"]:
-            match_geometry.extend(
-                map(
-                    lambda geo: GeoCoordinate(float(geo["lat"]), float(geo["lon"])),
-                    leg["geometry"],
-                )
-            )
-        return Geometry(match_geometry)
+        return LazyGeometry(
+            lat_lng_array, [leg.get("geometry", []) for leg in match["legs"]]
+        )
 
     def get_distance(self, index=0):
         match = self.response["matchings"][index]
@@ -158,11 +351,13 @@ class MapboxMatcherResponseAdapter(AbstractMatcherResponseAdapter):
             [
                 tracepoint.get("snapDistance", 0)
                 for tracepoint in self.response["tracepoints"]
-            ]
+                if tracepoint
+            ],
+            default=0,
         )
 
     def get_failed_points(self):
         return len(list(filter(lambda x: not x, self.response["tracepoints"])))
 
 
-MATCHERS = {"mapbox": MapboxMatcher}
+MATCHERS = {"mapbox": MapboxMatcher, "local": LocalMatcher}
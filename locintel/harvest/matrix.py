@@ -0,0 +1,255 @@
+"""
+Many-to-many travel time and distance matrices: requests are tiled into blocks within provider limits (or, for
+providers without a matrix endpoint, split into pairwise routes), calculated concurrently, and assembled into dense
+matrices
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+
+import numpy as np
+
+from locintel.core.datamodel.routing import RoutePlan
+
+from .cache import HarvesterMixin
+from .routes import GoogleRouter, ROUTERS
+from .sessions import default_session
+
+
+class TravelMatrix(object):
+    def __init__(self, origins, destinations, durations, distances, metadata=None):
+        """
+        Travel durations (seconds) and distances (meters) from every origin to every destination
+
+        :param origins: sequence of Waypoint, one per row
+        :param destinations: sequence of Waypoint, one per column
+        :param durations: (origins, destinations) float array, NaN where the cell could not be calculated
+        :param distances: (origins, destinations) float array, NaN where the cell could not be calculated
+        """
+        self.origins = origins
+        self.destinations = destinations
+        self.durations = durations
+        self.distances = distances
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f"TravelMatrix(shape={self.shape}, failed={int(self.failed.sum())})"
+
+    @property
+    def shape(self):
+        return self.durations.shape
+
+    @property
+    def failed(self):
+        """
+        Boolean mask of cells that could not be calculated (failed request or no route found)
+        """
+        return np.isnan(self.durations) | np.isnan(self.distances)
+
+
+class AbstractMatrixRouter(HarvesterMixin):
+    # provider limits per request: origins, destinations and cells (None for no limit)
+    max_origins = None
+    max_destinations = None
+    max_elements = None
+
+    def __init__(self, endpoint, session=None, cache=None, limiter=None):
+        """
+        :param endpoint: service endpoint
+        :param session: locintel.harvest.sessions.HarvestSession (defaults to process-wide pooled session)
+        :param cache: locintel.harvest.cache.ResponseCache, to reuse raw responses of identical requests
+        :param limiter: locintel.harvest.limiters.TokenBucket (defaults to limiter configured for provider name, see
+                        locintel.harvest.limiters.set_rate_limit)
+        """
+        self.endpoint = endpoint
+        self.session = session or default_session
+        self.cache = cache
+        self.limiter = limiter
+        self.last_response = None
+
+    def calculate(self, origins, destinations, vehicle="CAR"):
+        """
+        Calculates one tile, within provider limits
+
+        :return: (durations, distances) arrays of shape (origins, destinations), NaN for cells without route
+        """
+        raise NotImplementedError("Please implement subclass method")
+
+    def tile_shape(self, origins, destinations):
+        """
+        :return: (rows, columns) of largest tiles within provider limits, for given matrix size
+        """
+        columns = max(
+            min(
+                destinations,
+                self.max_destinations or destinations,
+                self.max_elements or destinations,
+            ),
+            1,
+        )
+        rows = min(
+            origins,
+            self.max_origins or origins,
+            (self.max_elements or origins * columns) // columns,
+        )
+        return max(rows, 1), columns
+
+
+class GoogleMatrixRouter(AbstractMatrixRouter):
+    max_origins = 25
+    max_destinations = 25
+    max_elements = 100
+
+    def __init__(
+        self,
+        endpoint="https://maps.googleapis.com/maps/api/distancematrix/json?",
+        key="",
+        session=None,
+        cache=None,
+        limiter=None,
+        **kwargs,
+    ):
+        super().__init__(endpoint, session, cache, limiter)
+        self.key = key
+        self.options = {"units": "metric"}
+        self.options.update(**kwargs)
+        self.name = "google"  # same quota (and rate limiter) as GoogleRouter
+
+    def calculate(self, origins, destinations, vehicle="CAR"):
+        response, _ = self._fetch(
+            "GET", self._generate_url(origins, destinations, vehicle)
+        )
+        if response.get("status") != "OK":
+            raise ValueError(
+                f"Matrix request failed with status {response.get('status')}: {response.get('error_message')}"
+            )
+        durations = np.full((len(origins), len(destinations)), np.nan)
+        distances = np.full((len(origins), len(destinations)), np.nan)
+        for i, row in enumerate(response["rows"]):
+            for j, element in enumerate(row["elements"]):
+                if element.get("status") == "OK":
+                    durations[i, j] = element["duration"]["value"]
+                    distances[i, j] = element["distance"]["value"]
+        return durations, distances
+
+    def _generate_url(self, origins, destinations, vehicle="CAR"):
+        origins = "|".join(f"{w.lat},{w.lng}" for w in origins)
+        destinations = "|".join(f"{w.lat},{w.lng}" for w in destinations)
+        mode = GoogleRouter.GOOGLE_OPTIONS_TRANSLATOR["vehicle"][vehicle]
+
+        url = f"{self.endpoint}origins={origins}&destinations={destinations}&mode={mode}&key={self.key}"
+        for k, v in self.options.items():
+            url += f"&{k}={v}"
+        return url
+
+
+class PairwiseMatrixRouter(AbstractMatrixRouter):
+    max_origins = 1
+    max_destinations = 1
+
+    def __init__(self, router):
+        """
+        Matrix router calculating every cell as a route, for providers without matrix endpoint
+
+        :param router: router object (see locintel.harvest.routes.ROUTERS)
+        """
+        super().__init__(
+            getattr(router, "endpoint", None), getattr(router, "session", None)
+        )
+        self.router = router
+        self.name = getattr(router, "name", None)
+
+    def calculate(self, origins, destinations, vehicle="CAR"):
+        durations = np.full((len(origins), len(destinations)), np.nan)
+        distances = np.full((len(origins), len(destinations)), np.nan)
+        for i, origin in enumerate(origins):
+            for j, destination in enumerate(destinations):
+                route = self.router.calculate(
+                    RoutePlan(origin, destination, vehicle=vehicle)
+                )
+                durations[i, j], distances[i, j] = route.duration, route.distance
+        return durations, distances
+
+
+MATRIX_ROUTERS = {"google": GoogleMatrixRouter}
+
+
+def get_matrix_router(provider, **kwargs):
+    """
+    :return: matrix router of provider, or PairwiseMatrixRouter over its router if provider has no matrix endpoint
+    """
+    if provider in MATRIX_ROUTERS:
+        return MATRIX_ROUTERS[provider](**kwargs)
+    return PairwiseMatrixRouter(ROUTERS[provider](**kwargs))
+
+
+def tiles(origins, destinations, rows, columns):
+    """
+    :return: list of (row slice, column slice) covering an (origins, destinations) matrix in tiles of rows x columns
+    """
+    return [
+        (slice(i, min(i + rows, origins)), slice(j, min(j + columns, destinations)))
+        for i in range(0, origins, rows)
+        for j in range(0, destinations, columns)
+    ]
+
+
+def calculate_matrix(
+    origins, destinations, provider, jobs=8, vehicle="CAR", router=None, **kwargs
+):
+    """
+    Calculates travel durations and distances from every origin to every destination
+
+    The matrix is tiled into blocks within provider limits (single cells for providers without matrix endpoint,
+    calculated as routes), calculated by up to jobs threads. Requests go through the provider's rate limiter and
+    adaptive concurrency controller, shared with its routers (see locintel.harvest.limiters and
+    locintel.harvest.concurrency). Failed tiles are logged and masked, without aborting the matrix.
+
+    :param origins: sequence of Waypoint
+    :param destinations: sequence of Waypoint
+    :param provider: provider name, in MATRIX_ROUTERS or locintel.harvest.routes.ROUTERS
+    :param jobs: maximum number of tiles calculated concurrently
+    :param vehicle: vehicle type, as in RoutePlan
+    :param router: matrix router object, instead of one created for provider
+    :param kwargs: arguments of provider's (matrix) router, e.g. key, session or cache
+    :return: TravelMatrix
+    """
+    origins, destinations = list(origins), list(destinations)
+    router = router or get_matrix_router(provider, **kwargs)
+    durations = np.full((len(origins), len(destinations)), np.nan)
+    distances = np.full((len(origins), len(destinations)), np.nan)
+    blocks = tiles(
+        len(origins),
+        len(destinations),
+        *router.tile_shape(len(origins), len(destinations)),
+    )
+
+    def calculate_tile(block):
+        rows, columns = block
+        try:
+            durations[block], distances[block] = router.calculate(
+                origins[rows], destinations[columns], vehicle
+            )
+            return True
+        except Exception as e:
+            logging.warning(
+                f"Matrix tile (origins {rows.start}-{rows.stop}, destinations {columns.start}-{columns.stop}) of "
+                f"{provider} failed: {e}"
+            )
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(min(jobs, len(blocks)), 1)) as executor:
+        succeeded = list(executor.map(calculate_tile, blocks))
+
+    return TravelMatrix(
+        origins,
+        destinations,
+        durations,
+        distances,
+        metadata={
+            "provider": provider,
+            "date": datetime.now(),
+            "tiles": len(blocks),
+            "failed_tiles": succeeded.count(False),
+        },
+    )
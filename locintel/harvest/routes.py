@@ -1,23 +1,62 @@
+import collections
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import functools
 import itertools
+import logging
 import multiprocessing
-import requests
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
 
-from locintel.core.datamodel.geo import Geometry
+import numpy as np
+
+from locintel.core.algorithms.geo import decode_polyline
+from locintel.core.datamodel.geo import LazyGeometry, lat_lng_array
 from locintel.core.datamodel.routing import Route
 from locintel.core.datamodel.testing import TestResult, ExperimentResult
 
-
-class AbstractRouter(object):
-    def __init__(self, endpoint, adapter):
+from .cache import ApproximateRouter, HarvesterMixin
+from .concurrency import (
+    CONCURRENCY_LIMITS,
+    disable_adaptive_concurrency,
+    set_adaptive_concurrency,
+)
+from .sessions import default_session
+from .telemetry import Telemetry
+
+
+class AbstractRouter(HarvesterMixin):
+    def __init__(self, endpoint, adapter, session=None, cache=None, limiter=None):
+        """
+        :param endpoint: service endpoint
+        :param adapter: response adapter class, converting service responses into Route objects
+        :param session: locintel.harvest.sessions.HarvestSession (defaults to process-wide pooled session)
+        :param cache: locintel.harvest.cache.ResponseCache, to reuse raw responses of identical requests
+        :param limiter: locintel.harvest.limiters.TokenBucket (defaults to limiter configured for provider name, see
+                        locintel.harvest.limiters.set_rate_limit)
+        """
         self.endpoint = endpoint
         self.adapter = adapter
+        self.session = session or default_session
+        self.cache = cache
+        self.limiter = limiter
         self.last_response = None
 
     def calculate(self, *arg, **kwargs):
         raise NotImplementedError("Please implement subclass method")
 
+    def _get_route(self, method, url, **kwargs):
+        response, timing = self._fetch(method, url, **kwargs)
+        return self.adapter(response).get_route(
+            metadata={
+                "calc_time": timing["calc_time"],
+                "date": datetime.now(),
+                "timing": timing,
+            }
+        )
+
 
 class MapboxRouter(AbstractRouter):
     def __init__(
@@ -27,9 +66,12 @@ class MapboxRouter(AbstractRouter):
         password=None,
         traffic=False,
         adapter=None,
+        session=None,
+        cache=None,
+        limiter=None,
     ):
         adapter = adapter or MapboxResponseAdapter
-        super().__init__(endpoint, adapter)
+        super().__init__(endpoint, adapter, session, cache, limiter)
         self.user = user
         self.password = password
         self.traffic = traffic
@@ -37,20 +79,15 @@ class MapboxRouter(AbstractRouter):
 
     def calculate(self, route_plan, **kwargs):
         payload = MapboxRouter._generate_payload(route_plan, **kwargs)
-        url = self.endpoint.format(
-            vehicle_type=route_plan.vehicle.lower()
-            + ("-traffic" if self.traffic else "")
-        )
-        self.last_response = requests.post(
-            url, json=payload, auth=(self.user, self.password)
+        url = self._generate_url(route_plan)
+        return self._get_route(
+            "POST", url, json=payload, auth=(self.user, self.password)
         )
 
-        self.last_response.raise_for_status()
-        return self.adapter(self.last_response.json()).get_route(
-            metadata={
-                "calc_time": self.last_response.elapsed.microseconds / 1e6,
-                "date": datetime.now(),
-            }
+    def _generate_url(self, route_plan):
+        return self.endpoint.format(
+            vehicle_type=route_plan.vehicle.lower()
+            + ("-traffic" if self.traffic else "")
         )
 
     @staticmethod
@@ -78,10 +115,13 @@ class GoogleRouter(AbstractRouter):
         endpoint="https://maps.googleapis.com/maps/api/directions/json?",
         key="",
         adapter=None,
+        session=None,
+        cache=None,
+        limiter=None,
         **kwargs,
     ):
         adapter = adapter or GoogleResponseAdapter
-        super().__init__(endpoint, adapter)
+        super().__init__(endpoint, adapter, session, cache, limiter)
         self.key = key
         self.options = {"units": "metric"}
         self.options.update(**kwargs)
@@ -90,6 +130,10 @@ class GoogleRouter(AbstractRouter):
         self.name = "google"
 
     def calculate(self, route_plan):
+        url = self._generate_url(route_plan)
+        return self._get_route("GET", url)
+
+    def _generate_url(self, route_plan):
         if route_plan.intermediate_waypoints:
             raise NotImplementedError
 
@@ -99,13 +143,66 @@ class GoogleRouter(AbstractRouter):
         url = f"{self.endpoint}origin={origin}&destination={destination}&key={self.key}"
         for k, v in self.options.items():
             url += f"&{k}={v}"
+        return url
+
 
-        self.last_response = requests.get(url)
-        return self.adapter(self.last_response.json()).get_route(
+# graph of "local" routers created without one (e.g. by calculate_competitive), see set_local_graph
+_local_graph = None
+
+
+def set_local_graph(graph, **kwargs):
+    """
+    Sets graph routed over by "local" routers created without graph (e.g. by calculate, calculate_competitive and
+    run_experiment), compiled once and shared by all of them (set it before forking workers, or in their initializer)
+
+    :param graph: locintel.graphs.datamodel.jurbey.Jurbey object (None to unset)
+    :param kwargs: locintel.graphs.processing.routing.RoutingGraph parameters (e.g. default_speed, snap_radius)
+    """
+    global _local_graph
+    _local_graph = None
+    if graph is not None:
+        from locintel.graphs.processing.routing import RoutingGraph
+
+        _local_graph = RoutingGraph(graph, **kwargs)
+
+
+class LocalRouter(AbstractRouter):
+    def __init__(self, graph=None, **kwargs):
+        """
+        Offline router over a graph, with bidirectional A* (see locintel.graphs.processing.routing.RoutingGraph),
+        fastest by edge speed attributes (or shortest, for route plans of SHORTEST strategy)
+
+        :param graph: locintel.graphs.datamodel.jurbey.Jurbey object, or RoutingGraph compiled from one (defaults to
+                      graph set with set_local_graph)
+        :param kwargs: RoutingGraph parameters, if graph is to be compiled
+        """
+        # graph dependencies (networkx) are only required by local routers
+        from locintel.graphs.processing.routing import RoutingGraph
+
+        super().__init__(None, None)
+        graph = graph if graph is not None else _local_graph
+        if graph is None:
+            raise ValueError("No graph to route over, see set_local_graph")
+        self.graph = (
+            graph if isinstance(graph, RoutingGraph) else RoutingGraph(graph, **kwargs)
+        )
+        self.name = "local"
+
+    def calculate(self, route_plan):
+        start = time.perf_counter()
+        route = self.graph.route(
+            [(w.lat, w.lng) for w in route_plan.get_waypoints()],
+            shortest=route_plan.strategy == "SHORTEST",
+        )
+        return Route(
+            LazyGeometry(np.array, route["geometry"]),
+            route["distance"],
+            route["duration"],
             metadata={
-                "calc_time": self.last_response.elapsed.microseconds / 1e6,
+                "calc_time": time.perf_counter() - start,
                 "date": datetime.now(),
-            }
+                "nodes": route["nodes"],
+            },
         )
 
 
@@ -131,15 +228,13 @@ class MapboxResponseAdapter(AbstractResponseAdapter):
         super().__init__(response)
 
     def get_geometry(self, index=0):
-        geometry = list()
         try:
-            for leg in self.response["routes"][index]["legs"]:
-                geometry.extend(leg["geometry"])
+            legs = [leg["geometry"] for leg in self.response["routes"][index]["legs"]]
         except KeyError:
             raise ValueError(
                 'Could not find geometry field in response (["routes"][index]["legs"][index]["geometry"])'
             )
-        return Geometry.from_lat_lon_dicts(geometry)
+        return LazyGeometry(lat_lng_array, legs)
 
     def get_distance(self, index=0):
         try:
@@ -172,8 +267,9 @@ class GoogleResponseAdapter(AbstractResponseAdapter):
 
     def get_geometry(self, index=0):
         try:
-            return Geometry.from_polyline(
-                self.response["routes"][index]["overview_polyline"]["points"]
+            return LazyGeometry(
+                decode_polyline,
+                self.response["routes"][index]["overview_polyline"]["points"],
             )
         except KeyError:
             raise ValueError(
@@ -219,6 +315,16 @@ ROUTERS = {
     "mapbox": MapboxRouter,
     "google": GoogleRouter,
     "mapbox-traffic": functools.partial(MapboxRouter, traffic=True),
+    "local": LocalRouter,
+}
+
+# provider -> name attribute of its routers (limiter, concurrency controller and telemetry name), for providers
+# whose routers cannot be created without configuration (e.g. "local")
+PROVIDER_NAMES = {
+    "mapbox": "mapbox-routing",
+    "google": "google",
+    "mapbox-traffic": "mapbox-routing-traffic",
+    "local": "local",
 }
 
 
@@ -226,17 +332,177 @@ def calculate(route_plan, provider, **kwargs):
     return ROUTERS[provider](**kwargs).calculate(route_plan)
 
 
-def calculate_competitive(route_plan, providers, comparators=None, write_geojson=None):
+class LatencyTracker(object):
+    def __init__(self, window=1000, min_samples=20):
+        """
+        Sliding window of recent calculation latencies per provider, used to time hedged requests
+
+        :param window: number of latencies kept per provider
+        :param min_samples: minimum number of latencies for percentiles to be reported
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window)
+        )
+        self._lock = threading.Lock()
+
+    def record(self, provider, latency):
+        with self._lock:
+            self.latencies[provider].append(latency)
+
+    def percentile(self, provider, q=95):
+        """
+        :return: q-th percentile of provider latencies, in seconds (None if not enough samples)
+        """
+        with self._lock:
+            latencies = list(self.latencies.get(provider, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return float(np.percentile(latencies, q))
+
+
+# process-wide provider latencies, feeding hedged requests of calculate_competitive
+latencies = LatencyTracker()
+
+
+def _create_router(provider, cache=None, spatial_cache=None):
+    router_class = ROUTERS[provider]
+    # local routers request no service, there are no responses to cache
+    router = (
+        router_class() if router_class is LocalRouter else router_class(cache=cache)
+    )
+    if spatial_cache is not None:
+        router = ApproximateRouter(router, spatial_cache)
+    return router
+
+
+# shared by calculate_competitive calls of a process, as (pid, executor) so that forked workers create their own
+_executor = (None, None)
+_executor_lock = threading.Lock()
+COMPETITIVE_WORKERS = 64
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        pid, executor = _executor
+        if pid != os.getpid():
+            executor = ThreadPoolExecutor(
+                max_workers=COMPETITIVE_WORKERS, thread_name_prefix="competitive"
+            )
+            _executor = (os.getpid(), executor)
+        return executor
+
+
+def _timed_calculate(provider, route_plan, cache, spatial_cache):
+    start = time.monotonic()
+    route = _create_router(provider, cache, spatial_cache).calculate(route_plan)
+    latencies.record(provider, time.monotonic() - start)
+    return route
+
+
+def calculate_competitive(
+    route_plan,
+    providers,
+    comparators=None,
+    write_geojson=None,
+    cache=None,
+    spatial_cache=None,
+    deadlines=None,
+    hedge=False,
+):
     """
     Calculates test, in which multiple providers are assumed for a given RoutePlan/test
+
+    Providers are queried concurrently, and comparators run on each pair of providers as soon as both routes are
+    available. Providers not answering within their deadline are left out of routes (and of metrics) and listed in
+    timed_out of the TestResult; any other provider error is raised. Requests run on a thread pool shared by the
+    calls of a process (of COMPETITIVE_WORKERS threads), requests still pending on return are cancelled.
+
+    Responses are served from (and stored into) cache, if given (see locintel.harvest.cache.ResponseCache), and
+    routes of nearby plans from spatial_cache, if given (see locintel.harvest.cache.SpatialRouteCache)
+
+    :param deadlines: deadline in seconds, for all providers or as dict provider -> deadline (None for no deadline)
+    :param hedge: if True, a duplicate request is sent to a provider which has not answered by its p95 latency
+                  (see locintel.harvest.routes.latencies), and the first answer is used
     """
+    if not isinstance(deadlines, dict):
+        deadlines = {provider: deadlines for provider in providers}
+    start = time.monotonic()
+    expiry = {
+        provider: start + deadlines[provider]
+        for provider in providers
+        if deadlines.get(provider) is not None
+    }
+    hedges = dict()
+    if hedge:
+        for provider in providers:
+            p95 = latencies.percentile(provider)
+            if p95 is not None:
+                hedges[provider] = start + p95
+
+    executor = _get_executor()
+    futures = dict()
     results = dict()
-    for provider in providers:
-        router = ROUTERS[provider]()
-        route = router.calculate(route_plan)
-        results[provider] = route
-
-        if write_geojson:
+    timed_out = list()
+    metrics = dict()
+    comparators = comparators or []
+    try:
+        for provider in providers:
+            futures[
+                executor.submit(
+                    _timed_calculate, provider, route_plan, cache, spatial_cache
+                )
+            ] = provider
+
+        while futures:
+            now = time.monotonic()
+            for provider, due in list(hedges.items()):
+                if due <= now:
+                    del hedges[provider]
+                    futures[
+                        executor.submit(
+                            _timed_calculate, provider, route_plan, cache, spatial_cache
+                        )
+                    ] = provider
+            for provider, due in list(expiry.items()):
+                if due <= now and provider not in results:
+                    logging.info(f"{provider} missed deadline for {route_plan}")
+                    timed_out.append(provider)
+                    del expiry[provider]
+                    hedges.pop(provider, None)
+                    _drop(futures, provider)
+
+            due = list(hedges.values()) + list(expiry.values())
+            timeout = max(min(due) - now, 0) if due else None
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider = futures.pop(future)
+                if provider in results:
+                    continue
+                error = future.exception()
+                if error is not None:
+                    if provider in futures.values():
+                        continue  # hedged request still in flight
+                    raise error
+
+                results[provider] = future.result()
+                expiry.pop(provider, None)
+                hedges.pop(provider, None)
+                _drop(futures, provider)
+                for other in providers:
+                    if other != provider and other in results:
+                        metrics.update(
+                            _compare(comparators, providers, provider, other, results)
+                        )
+    finally:
+        for future in futures:
+            future.cancel()
+
+    if write_geojson:
+        for provider, route in results.items():
             try:
                 route.geometry.to_geojson(
                     write_to=f"{write_geojson}/{route_plan.name}_{provider}.json"
@@ -246,37 +512,87 @@ def calculate_competitive(route_plan, providers, comparators=None, write_geojson
                     "No name found on RoutePlan, must specify name to write to geojson"
                 )
 
-    comparators = comparators or []
-    metrics = dict()
+    ordered_metrics = dict()
     for comparator in comparators:
         score_name = getattr(comparator, "name", str(comparator))
-        for pair in itertools.combinations(providers, 2):
-            provider1, provider2 = pair[0], pair[1]
-            score = comparator(results[provider1].geometry, results[provider2].geometry)
-            metrics[score_name + f"_{provider1}_vs_{provider2}"] = score
+        for provider1, provider2 in itertools.combinations(providers, 2):
+            key = score_name + f"_{provider1}_vs_{provider2}"
+            if key in metrics:
+                ordered_metrics[key] = metrics[key]
 
     return TestResult(
-        getattr(route_plan, "name", str(route_plan)), route_plan, results, metrics
+        getattr(route_plan, "name", str(route_plan)),
+        route_plan,
+        {provider: results[provider] for provider in providers if provider in results},
+        ordered_metrics,
+        timed_out=[provider for provider in providers if provider in timed_out],
     )
 
 
+def _drop(futures, provider):
+    for future, other in list(futures.items()):
+        if other == provider:
+            future.cancel()
+            del futures[future]
+
+
+def _compare(comparators, providers, provider, other, results):
+    if providers.index(provider) > providers.index(other):
+        provider, other = other, provider
+    metrics = dict()
+    for comparator in comparators:
+        score_name = getattr(comparator, "name", str(comparator))
+        score = comparator(results[provider].geometry, results[other].geometry)
+        metrics[score_name + f"_{provider}_vs_{other}"] = score
+    return metrics
+
+
 def run_experiment(
-    providers, route_plans, jobs=7, comparators=None, write_geojson=None
+    providers,
+    route_plans,
+    jobs=7,
+    comparators=None,
+    write_geojson=None,
+    cache=None,
+    adaptive=False,
 ):
     """
     Calculates experiments, in which multiple providers are assumed for multiples RoutePlans.
 
-    Uses multiprocessing to parallelize requests and improve performance
-    """
-    p = multiprocessing.Pool(jobs)
+    Uses multiprocessing to parallelize requests and improve performance. All results are kept in memory and any
+    failing plan aborts the experiment, see locintel.harvest.experiments.ExperimentRunner for large experiments.
+    Per-provider latency and size percentiles of requests are exported as the telemetry of the ExperimentResult.
 
+    With adaptive=True, plans are calculated by up to jobs threads instead, and the number of in-flight requests of
+    each provider is governed by its adaptive concurrency controller (see locintel.harvest.concurrency), enabled
+    with maximum=jobs for providers not configured with set_adaptive_concurrency. Set jobs to the highest
+    concurrency any provider may reach.
+    """
     calculate_providers = functools.partial(
         calculate_competitive,
         providers=providers,
         comparators=comparators,
         write_geojson=write_geojson,
+        cache=cache,
     )
 
-    return ExperimentResult(
-        [test_result for test_result in p.imap(calculate_providers, route_plans)]
-    )
+    enabled = list()
+    if adaptive:
+        for provider in providers:
+            name = PROVIDER_NAMES.get(provider, provider)
+            if name not in CONCURRENCY_LIMITS:
+                set_adaptive_concurrency(name, maximum=jobs)
+                enabled.append(name)
+        pool = ThreadPool(jobs)
+    else:
+        pool = multiprocessing.Pool(jobs)
+
+    try:
+        with pool as p:
+            tests = [
+                test_result for test_result in p.imap(calculate_providers, route_plans)
+            ]
+    finally:
+        for name in enabled:
+            disable_adaptive_concurrency(name)
+    return ExperimentResult(tests, telemetry=Telemetry.from_experiment(tests).summary())
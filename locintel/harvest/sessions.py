@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+
+import requests
+from urllib3.util.retry import Retry
+
+from .telemetry import TimedHTTPAdapter
+
+# server errors, retried within the session; throttling responses (429/503) are retried by
+# locintel.harvest.cache.fetch instead, which takes a rate limiter token before every attempt
+RETRY_STATUSES = (500, 502, 504)
+
+
+def _equal_jitter(backoff):
+    """
+    "Equal jitter": half of the backoff is fixed, half is random, so that concurrent clients throttled together do
+    not retry in lockstep
+    """
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def get_backoff_time(attempt, backoff_factor, retry_after=None):
+    """
+    Time to wait before retrying a failed attempt, shared by sync and asyncio harvesting
+
+    :param attempt: number of the failed attempt (0 for the first request)
+    :param backoff_factor: base for exponential backoff, in seconds
+    :param retry_after: Retry-After header of the failed attempt, if any (in seconds), takes precedence
+    :return: time to wait before next attempt, in seconds
+    """
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return _equal_jitter(backoff_factor * 2 ** attempt)
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry with equal jitter exponential backoff
+    """
+
+    def get_backoff_time(self):
+        return _equal_jitter(super().get_backoff_time())
+
+
+class HarvestSession(object):
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        timeout=(3.05, 60),
+        retries=3,
+        backoff_factor=0.5,
+        status_forcelist=RETRY_STATUSES,
+        headers=None,
+    ):
+        """
+        Connection-pooled HTTP session with keep-alive, timeouts and jittered exponential backoff on connection and
+        server errors, shared by routers and matchers (throttled requests are retried by fetch, with the same
+        retries and backoff, see get_backoff_time)
+
+        Safe to share across threads (urllib3 connection pools are thread-safe, at most pool_maxsize connections
+        are kept per host). Safe to share across processes: the underlying requests.Session is never pickled, and
+        is recreated in each process (e.g. after multiprocessing fork), so sockets are never shared.
+
+        :param pool_connections: number of hosts to keep connection pools for
+        :param pool_maxsize: maximum number of connections kept per host
+        :param timeout: default (connect, read) timeout, in seconds
+        :param retries: maximum number of retries per request (retries apply to POST requests too)
+        :param backoff_factor: base for exponential backoff between retries, in seconds
+        :param status_forcelist: HTTP status codes on which to retry (Retry-After headers are respected)
+        :param headers: default headers for every request
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = tuple(status_forcelist)
+        self.headers = headers or {}
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_session=None, _pid=None, _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._create_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def get_backoff_time(self, attempt, retry_after=None):
+        """
+        :param attempt: number of the failed attempt (0 for the first request)
+        :param retry_after: Retry-After header of the failed attempt, if any (in seconds)
+        :return: time to wait before next attempt, in seconds
+        """
+        return get_backoff_time(attempt, self.backoff_factor, retry_after)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _create_session(self):
+        retry = JitteredRetry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.status_forcelist,
+            allowed_methods=None,  # retry on any method, routing/matching POSTs are idempotent
+            # else 429/503 with Retry-After would be retried whatever status_forcelist, bypassing rate limiters
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = TimedHTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+
+# process-wide session shared by routers and matchers which are not given one
+default_session = HarvestSession()
@@ -0,0 +1,295 @@
+"""
+Request telemetry of routers and matchers: per-request timings (DNS, connect, time to first byte, total) and payload
+sizes, aggregated into per-provider histograms
+"""
+from collections import defaultdict
+import logging
+import math
+import socket
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+TIMINGS = ("dns", "connect", "ttfb", "total")
+SIZES = ("request_size", "response_size")
+PERCENTILES = (50, 95, 99)
+
+_connections = threading.local()
+
+
+class Histogram(object):
+    def __init__(self, growth=1.02, minimum=1e-4):
+        """
+        Log-bucketed histogram, with constant relative precision and bounded size no matter how many values are
+        recorded, mergeable across processes
+
+        :param growth: ratio between consecutive bucket bounds (percentiles are accurate within this ratio)
+        :param minimum: upper bound of first bucket, smaller positive values are counted in it (zero or negative values
+                        have a bucket of their own)
+        """
+        self.growth = growth
+        self.minimum = minimum
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value):
+        if value <= 0:
+            bucket = -1
+        elif value <= self.minimum:
+            bucket = 0
+        else:
+            bucket = math.ceil(math.log(value / self.minimum, self.growth))
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def percentile(self, q):
+        """
+        :param q: percentile, in [0, 100]
+        :return: upper bound of bucket holding the q-th percentile (clipped to recorded range), None if empty
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                bound = self.minimum * self.growth ** bucket if bucket >= 0 else 0.0
+                return min(max(bound, self.min), self.max)
+
+    def summary(self):
+        summary = {"count": self.count, "mean": self.mean}
+        summary.update({f"p{q}": self.percentile(q) for q in PERCENTILES})
+        summary["max"] = self.max if self.count else None
+        return summary
+
+
+class Telemetry(object):
+    def __init__(self):
+        """
+        Per-provider histograms of request timings (seconds) and sizes (bytes)
+        """
+        self.histograms = defaultdict(dict)
+        self.listeners = list()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(listeners=[], _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, provider, timing):
+        """
+        Records a request, and notifies listeners
+
+        :param provider: provider name
+        :param timing: dict of TIMINGS and SIZES measurements (missing or None measurements are ignored)
+        """
+        with self._lock:
+            histograms = self.histograms[provider]
+            for metric in TIMINGS + SIZES:
+                if timing.get(metric) is not None:
+                    if metric not in histograms:
+                        histograms[metric] = (
+                            Histogram(minimum=1) if metric in SIZES else Histogram()
+                        )
+                    histograms[metric].record(timing[metric])
+        for listener in self.listeners:
+            try:
+                listener(provider, timing)
+            except Exception:
+                logging.exception(f"Telemetry listener {listener} failed")
+
+    def add_listener(self, listener):
+        """
+        Registers a callable (provider, timing dict) called on every recorded request, e.g. to forward measurements
+        to a metrics backend
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def merge(self, other):
+        with self._lock:
+            for provider, histograms in other.histograms.items():
+                for metric, histogram in histograms.items():
+                    if metric in self.histograms[provider]:
+                        self.histograms[provider][metric].merge(histogram)
+                    else:
+                        merged = Histogram(histogram.growth, histogram.minimum)
+                        merged.merge(histogram)
+                        self.histograms[provider][metric] = merged
+
+    def summary(self):
+        """
+        :return: dict of provider -> metric -> count, mean, p50, p95, p99 and max
+        """
+        return {
+            provider: {
+                metric: histogram.summary() for metric, histogram in histograms.items()
+            }
+            for provider, histograms in self.histograms.items()
+        }
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+    @classmethod
+    def from_experiment(cls, tests):
+        """
+        Aggregates timings recorded in routes metadata of experiment tests (e.g. calculated in other processes)
+
+        :param tests: ExperimentResult or iterable of TestResult objects
+        """
+        telemetry = cls()
+        for test in tests:
+            for provider, route in test.routes.items():
+                timing = route.metadata.get("timing") if route.metadata else None
+                if timing and not timing.get("cached"):
+                    telemetry.record(provider, timing)
+        return telemetry
+
+
+# process-wide telemetry of all router and matcher requests
+telemetry = Telemetry()
+
+
+def start_connection_timing():
+    """
+    Resets connection timings of current thread, see connection_timing
+    """
+    _connections.dns = _connections.connect = 0.0
+    _connections.ttfb = None
+
+
+def connection_timing():
+    """
+    :return: (dns, connect, ttfb) time spent opening connections in current thread since start_connection_timing
+             (zero when pooled connections were reused), and time to first byte of last request, from having sent
+             it to receiving response headers (None if no request went through a timed connection), in seconds
+    """
+    return (
+        getattr(_connections, "dns", 0.0),
+        getattr(_connections, "connect", 0.0),
+        getattr(_connections, "ttfb", None),
+    )
+
+
+class _TimedConnectionMixin(object):
+    """
+    Times DNS resolution and connection setup (TCP and TLS handshakes), and time to first byte of requests, into
+    thread-local connection timings
+
+    Hosts are resolved (once) before connecting to their addresses in turn, as urllib3 does, so that resolution is
+    timed apart from connection setup.
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        self._dns_time = 0.0
+        try:
+            super().connect()
+        finally:
+            _connections.dns = getattr(_connections, "dns", 0.0) + self._dns_time
+            _connections.connect = (
+                getattr(_connections, "connect", 0.0)
+                + time.perf_counter()
+                - start
+                - self._dns_time
+            )
+
+    def _new_conn(self):
+        host, start = self._dns_host, time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(
+                host.strip("[]"), self.port, allowed_gai_family(), socket.SOCK_STREAM
+            )
+        except OSError:
+            addresses = []
+        self._dns_time = time.perf_counter() - start
+        if not addresses:
+            return super()._new_conn()  # raises the appropriate resolution error
+
+        try:
+            for k, (*_, address) in enumerate(addresses):
+                # numeric hosts are not resolved again
+                self._dns_host = address[0]
+                try:
+                    return super()._new_conn()
+                except (NewConnectionError, ConnectTimeoutError):
+                    if k == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+
+    def request(self, *args, **kwargs):
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            self._sent = time.perf_counter()
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        sent = getattr(self, "_sent", None)
+        if sent is not None:
+            _connections.ttfb = time.perf_counter() - sent
+            self._sent = None
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections record DNS and connect times, see connection_timing
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
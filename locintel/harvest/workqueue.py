@@ -0,0 +1,280 @@
+"""
+Lease-based work queue over a shared directory, so that experiments can be calculated by any number of workers on
+any number of nodes, with no broker or service other than a shared filesystem
+"""
+import itertools
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+
+from .experiments import default_plan_id, load_experiment, load_failures, read_records
+
+PENDING = "pending"
+LEASED = "leased"
+PARTIAL = "partial"
+DONE = "done"
+
+
+class LeaseLost(Exception):
+    """
+    Raised on renewal or completion of a lease which expired and was reclaimed (or released) since
+    """
+
+    pass
+
+
+class WorkQueue(object):
+    def __init__(self, path, lease=600):
+        """
+        Work queue of RoutePlan shards (work items) in a shared directory
+
+        Items move between pending/, leased/ and done/ subdirectories by atomic renames, so each item is claimed by
+        a single worker. A claim is a lease, named after the item and a token unique to the claim: it is owned for
+        lease seconds after its last heartbeat (file modification time), after which any worker may reclaim the item,
+        e.g. if its node died, under a new lease. Renewal and completion of a lease fail once it has been reclaimed,
+        so a worker which lost its lease can neither extend nor publish it. Results are streamed to a partial/ file
+        per lease while an item is being calculated (seeded with the results of previous leases of the item, so a
+        reclaimed item resumes where the previous worker stopped) and moved to done/ once complete.
+
+        :param path: shared queue directory
+        :param lease: lease duration, in seconds (workers renew it every lease / 3 seconds)
+        """
+        self.path = path
+        self.lease = lease
+        for state in (PENDING, LEASED, PARTIAL, DONE):
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def submit(self, route_plans, chunk_size=100, plan_id=default_plan_id):
+        """
+        Shards plans into pending work items
+
+        :param route_plans: iterable of RoutePlan objects
+        :param chunk_size: number of plans per work item
+        :param plan_id: function (index, route_plan) -> unique, JSON-serializable plan id
+        :return: number of work items created
+        """
+        tasks = (
+            (plan_id(i, route_plan), route_plan)
+            for i, route_plan in enumerate(route_plans)
+        )
+        batch = uuid.uuid4().hex[:8]
+        items = 0
+        while True:
+            chunk = list(itertools.islice(tasks, chunk_size))
+            if not chunk:
+                return items
+            name = f"{batch}-{items:08d}"
+            temporary = self._file(PENDING, f".{name}.tmp")
+            with open(temporary, "wb") as f:
+                pickle.dump(chunk, f)
+            os.rename(temporary, self._file(PENDING, name))
+            items += 1
+
+    def claim(self):
+        """
+        Claims next pending (or expired) work item
+
+        :return: (lease name, list of (plan id, RoutePlan) tuples), or None if no item is available
+        """
+        self.requeue_expired()
+        for item in self._list(PENDING):
+            lease = f"{item}.{uuid.uuid4().hex[:12]}"
+            try:
+                # renamed files keep their mtime, which would make long pending items expire as soon as leased
+                os.utime(self._file(PENDING, item))
+                os.rename(self._file(PENDING, item), self._file(LEASED, lease))
+            except FileNotFoundError:
+                continue  # claimed by another worker
+            try:
+                self.renew(lease)
+                self._seed_partial_file(lease)
+                with open(self._file(LEASED, lease), "rb") as f:
+                    return lease, pickle.load(f)
+            except (LeaseLost, FileNotFoundError):
+                continue  # requeued (and possibly claimed) by another worker meanwhile
+        return None
+
+    def renew(self, lease):
+        """
+        Heartbeat, extends lease on claimed item
+
+        :raises LeaseLost: if lease expired and was reclaimed since
+        """
+        try:
+            os.utime(self._file(LEASED, lease))
+        except FileNotFoundError:
+            raise LeaseLost(lease) from None
+
+    def release(self, lease):
+        """
+        Gives claimed item back to the queue, without results (no-op if lease was lost)
+        """
+        try:
+            os.rename(self._file(LEASED, lease), self._file(PENDING, _item(lease)))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, lease):
+        """
+        Marks claimed item as done, publishing partial results of lease
+
+        Lease is renewed first, so that it cannot expire while results are published.
+
+        :raises LeaseLost: if lease expired and was reclaimed since (results of lease are not published)
+        """
+        self.renew(lease)
+        item = _item(lease)
+        os.replace(self.partial_file(lease), self._file(DONE, f"{item}.jsonl"))
+        os.remove(self._file(LEASED, lease))
+        for name in self._partial_files(item):
+            try:
+                os.remove(self._file(PARTIAL, name))
+            except FileNotFoundError:
+                pass
+
+    def requeue_expired(self):
+        """
+        Moves items whose lease expired back to pending
+        """
+        now = time.time()
+        for lease in self._list(LEASED):
+            try:
+                expired = os.path.getmtime(self._file(LEASED, lease)) + self.lease < now
+                if expired:
+                    os.rename(
+                        self._file(LEASED, lease), self._file(PENDING, _item(lease))
+                    )
+            except FileNotFoundError:
+                continue
+
+    def partial_file(self, lease):
+        return self._file(PARTIAL, f"{lease}.jsonl")
+
+    def status(self):
+        """
+        :return: dict with number of pending, leased and done work items
+        """
+        return {state: len(self._list(state)) for state in (PENDING, LEASED, DONE)}
+
+    def is_finished(self):
+        status = self.status()
+        return not status[PENDING] and not status[LEASED]
+
+    def results_files(self):
+        return [self._file(DONE, name) for name in self._list(DONE)]
+
+    def merge(self):
+        """
+        Builds ExperimentResult from all done work items
+        """
+        return load_experiment(self.results_files())
+
+    def failures(self):
+        """
+        :return: dict of plan id -> error record, for failed plans of done work items
+        """
+        return load_failures(self.results_files())
+
+    def _partial_files(self, item):
+        return [name for name in self._list(PARTIAL) if _item(name) == item]
+
+    def _seed_partial_file(self, lease):
+        """
+        Starts partial file of lease with complete records of previous leases of its item (whose workers may still
+        be appending to their own files)
+        """
+        with open(self.partial_file(lease), "w") as f:
+            for name in self._partial_files(_item(lease)):
+                if name == f"{lease}.jsonl":
+                    continue
+                for record in read_records(self._file(PARTIAL, name)):
+                    f.write(json.dumps(record) + "\n")
+
+    def _file(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _list(self, state):
+        return sorted(
+            name
+            for name in os.listdir(os.path.join(self.path, state))
+            if not name.startswith(".")
+        )
+
+
+def _item(name):
+    """
+    :return: item name of a lease or partial file name
+    """
+    return name.split(".", 1)[0]
+
+
+class Heartbeat(object):
+    def __init__(self, work_queue, lease):
+        """
+        Context manager renewing lease of a claimed item in a background thread (until the lease is lost, see lost)
+        """
+        self.work_queue = work_queue
+        self.lease = lease
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        while not self._stop.wait(self.work_queue.lease / 3):
+            try:
+                self.work_queue.renew(self.lease)
+            except LeaseLost:
+                self.lost = True
+                return
+
+
+def work(work_queue, runner, max_items=None, wait=False, poll=10):
+    """
+    Worker loop: claims items from work_queue and calculates them with runner
+
+    :param work_queue: WorkQueue object
+    :param runner: locintel.harvest.experiments.ExperimentRunner object, configured with providers and comparators
+    :param max_items: maximum number of items to process (None for all)
+    :param wait: if True, waits (polling every poll seconds) for items leased by other workers to finish or expire,
+                 instead of returning as soon as no item is pending
+    :return: number of items processed (items whose lease was lost before completion are not counted, their
+             results are left to the worker which reclaimed them)
+    """
+    processed = 0
+    while max_items is None or processed < max_items:
+        claimed = work_queue.claim()
+        if claimed is None:
+            if wait and not work_queue.is_finished():
+                time.sleep(poll)
+                continue
+            break
+
+        lease, tasks = claimed
+        ids = [plan_id for plan_id, _ in tasks]
+        try:
+            with Heartbeat(work_queue, lease):
+                runner.run(
+                    [route_plan for _, route_plan in tasks],
+                    work_queue.partial_file(lease),
+                    plan_id=lambda i, route_plan: ids[i],
+                )
+        except BaseException:
+            work_queue.release(lease)
+            raise
+        try:
+            work_queue.complete(lease)
+        except LeaseLost:
+            continue
+        processed += 1
+    return processed
@@ -0,0 +1,264 @@
+"""
+Cluster large route sets into corridors (DBSCAN-style), without materialising full distance matrices
+"""
+from bisect import bisect_right
+from collections import deque
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import islice
+import multiprocessing
+from typing import Any, Dict, List
+
+import numpy as np
+
+from locintel.core.utils.workers import init_worker_state, worker_state
+from locintel.routes.metrics.geometry import GeometryComparator
+from locintel.routes.metrics.lsh import RouteLSHIndex
+
+NOISE = -1
+
+# number of candidate pair chunks in flight at once, so that pairs are never all materialised
+CHUNKS_PER_BLOCK = 64
+
+_worker_state = worker_state(__name__)
+
+
+def _make_state(geometries, method, method_kwargs, index_kwargs):
+    return dict(
+        geometries=geometries,
+        method=method,
+        method_kwargs=method_kwargs,
+        index=RouteLSHIndex(threshold=None, **index_kwargs),
+        comparator=GeometryComparator(),
+    )
+
+
+def _signature(i, state=_worker_state):
+    return state["index"].signature(state["geometries"][i])
+
+
+def _score(pairs, state=_worker_state):
+    geometries = state["geometries"]
+    comparator = state["comparator"]
+    return [
+        comparator.compare(
+            geometries[i], geometries[j], state["method"], **state["method_kwargs"]
+        )
+        for i, j in pairs
+    ]
+
+
+@dataclass
+class Corridors:
+    """
+    Result of corridor clustering
+
+    :param keys: route identifiers, in input order
+    :param labels: cluster label per route (NOISE for unclustered routes)
+    :param representatives: cluster label -> index of representative route
+    :param geometries: route geometries, in input order (None when fitted from distance matrix)
+    """
+
+    keys: List[Any]
+    labels: np.ndarray
+    representatives: Dict[int, int] = field(default_factory=dict)
+    geometries: List[Any] = None
+
+    def __len__(self):
+        return len(self.representatives)
+
+    def members(self, label):
+        return [self.keys[i] for i in np.flatnonzero(self.labels == label)]
+
+    def get_representative_keys(self):
+        return {label: self.keys[i] for label, i in self.representatives.items()}
+
+    def get_representative_geometries(self):
+        if self.geometries is None:
+            raise ValueError("No geometries available, corridors fitted from distances")
+        return {label: self.geometries[i] for label, i in self.representatives.items()}
+
+
+class CorridorClusterer(object):
+    def __init__(
+        self,
+        eps=50,
+        min_samples=2,
+        method="hausdorff",
+        jobs=None,
+        cell_size=100,
+        num_perm=64,
+        bands=16,
+        chunksize=1000,
+        max_bucket_candidates=1000,
+        **method_kwargs,
+    ):
+        """
+        DBSCAN-style clustering of routes into corridors
+
+        Neighbourhoods are sparse: candidate pairs come from a locintel.routes.metrics.lsh.RouteLSHIndex and are
+        then verified with locintel.routes.metrics.geometry.GeometryComparator, so that only pairs sharing an LSH
+        bucket are ever compared. Signatures and comparisons run on a process pool, candidate pairs are generated
+        per route and streamed to it in blocks.
+
+        Representative of each cluster is its core route with most neighbours (an approximate medoid).
+
+        :param eps: maximum comparator score for two routes to be neighbours (e.g. meters for hausdorff)
+        :param min_samples: minimum neighbourhood size (including route itself) for a route to be a core route
+        :param method: GeometryComparator method used as distance
+        :param jobs: number of worker processes (None for all cores, 1 runs in-process)
+        :param cell_size: LSH grid cell side, in meters (should be in the order of eps)
+        :param num_perm: LSH signature length
+        :param bands: LSH bands
+        :param chunksize: number of candidate pairs per worker task
+        :param max_bucket_candidates: maximum number of routes each route is compared with per LSH bucket (None for
+                                      all), bounds work on degenerate buckets (e.g. thousands of identical routes)
+        :param method_kwargs: additional keyword arguments for the comparator method
+        """
+        self.eps = eps
+        self.min_samples = min_samples
+        self.method = method
+        self.method_kwargs = method_kwargs
+        self.jobs = jobs
+        self.chunksize = chunksize
+        self.max_bucket_candidates = max_bucket_candidates
+        self.index_kwargs = {
+            "cell_size": cell_size,
+            "num_perm": num_perm,
+            "bands": bands,
+        }
+
+    def fit(self, items):
+        """
+        :param items: sequence of (key, geometry) tuples (see items_from_experiment)
+        :return: Corridors object
+        """
+        items = list(items)
+        keys = [key for key, _ in items]
+        geometries = [geometry for _, geometry in items]
+        initargs = (geometries, self.method, self.method_kwargs, self.index_kwargs)
+
+        if self.jobs == 1:
+            state = _make_state(*initargs)
+            neighbours = self._neighbours(
+                geometries,
+                lambda func, iterable: map(partial(func, state=state), iterable),
+            )
+        else:
+            with multiprocessing.Pool(
+                self.jobs,
+                initializer=init_worker_state,
+                initargs=(__name__, _make_state, *initargs),
+            ) as pool:
+                neighbours = self._neighbours(
+                    geometries,
+                    lambda func, iterable: pool.imap(func, iterable, chunksize=1),
+                )
+
+        labels, representatives = self._cluster(neighbours)
+        return Corridors(keys, labels, representatives, geometries)
+
+    def fit_distances(self, distances, keys=None):
+        """
+        Clusters from a precomputed (n, n) distance matrix, for small route sets
+
+        :param distances: square array-like of comparator scores
+        :param keys: route identifiers (defaults to indices)
+        """
+        distances = np.asarray(distances)
+        neighbours = [
+            set(np.flatnonzero(row <= self.eps).tolist()) - {i}
+            for i, row in enumerate(distances)
+        ]
+        labels, representatives = self._cluster(neighbours)
+        keys = list(keys) if keys is not None else list(range(len(distances)))
+        return Corridors(keys, labels, representatives)
+
+    def _neighbours(self, geometries, map_func):
+        index = RouteLSHIndex(threshold=None, **self.index_kwargs)
+        for i, signature in enumerate(map_func(_signature, range(len(geometries)))):
+            index.insert(i, geometries[i], signature=signature)
+
+        neighbours = [set() for _ in geometries]
+        chunks = self._pair_chunks(index, len(geometries))
+        while True:
+            block = list(islice(chunks, CHUNKS_PER_BLOCK))
+            if not block:
+                return neighbours
+            for chunk, scores in zip(block, map_func(_score, block)):
+                for (i, j), score in zip(chunk, scores):
+                    if score <= self.eps:
+                        neighbours[i].add(j)
+                        neighbours[j].add(i)
+
+    def _pair_chunks(self, index, size):
+        """
+        Yields candidate pairs (i, j), i < j, in chunks, generated per route from the routes following it in each of
+        its buckets (buckets are sorted, routes being inserted in order)
+        """
+        cap = self.max_bucket_candidates
+        chunk = []
+        for i in range(size):
+            candidates = set()
+            for band, band_key in zip(
+                index.buckets, index._band_keys(index.signatures[i])
+            ):
+                bucket = band[band_key]
+                start = bisect_right(bucket, i)
+                candidates.update(
+                    bucket[start:] if cap is None else bucket[start : start + cap]
+                )
+
+            chunk.extend((i, j) for j in sorted(candidates))
+            while len(chunk) >= self.chunksize:
+                yield chunk[: self.chunksize]
+                chunk = chunk[self.chunksize :]
+
+        if chunk:
+            yield chunk
+
+    def _cluster(self, neighbours):
+        """
+        DBSCAN over sparse neighbour sets, deterministic for a given input order
+        """
+        labels = np.full(len(neighbours), NOISE, dtype=int)
+        is_core = [len(n) + 1 >= self.min_samples for n in neighbours]
+        representatives = dict()
+
+        label = 0
+        for seed in range(len(neighbours)):
+            if not is_core[seed] or labels[seed] != NOISE:
+                continue
+
+            labels[seed] = label
+            representative = seed
+            queue = deque([seed])
+            while queue:
+                current = queue.popleft()
+                if len(neighbours[current]) > len(neighbours[representative]):
+                    representative = current
+                for neighbour in sorted(neighbours[current]):
+                    if labels[neighbour] == NOISE:
+                        labels[neighbour] = label
+                        if is_core[neighbour]:
+                            queue.append(neighbour)
+
+            representatives[label] = representative
+            label += 1
+
+        return labels, representatives
+
+
+def items_from_experiment(experiment, providers=None):
+    """
+    Converts an ExperimentResult into (key, geometry) items for clustering, keyed by (test name, provider)
+
+    :param experiment: locintel.core.datamodel.testing.ExperimentResult object
+    :param providers: providers to include (defaults to all)
+    """
+    return [
+        ((test.name, provider), route.geometry)
+        for test in experiment
+        for provider, route in test.routes.items()
+        if providers is None or provider in providers
+    ]
@@ -0,0 +1,293 @@
+"""
+Locate sections where two route geometries diverge (split and rejoin points), with linear referencing
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+import utm
+
+from locintel.core.algorithms.geo import densify
+from locintel.core.datamodel.geo import GeoCoordinate
+
+# maximum number of point-segment pairs compared at once
+MAX_PAIRS = 2 ** 20
+
+
+@dataclass
+class Divergence:
+    """
+    Divergent section between two geometries, with measures (distance along each geometry from its start) in meters
+    """
+
+    start1: float
+    end1: float
+    start2: float
+    end2: float
+    split: GeoCoordinate
+    rejoin: GeoCoordinate
+    max_separation: float
+
+    @property
+    def detour1(self):
+        return self.end1 - self.start1
+
+    @property
+    def detour2(self):
+        return self.end2 - self.start2
+
+
+class DivergenceFinder(object):
+    def __init__(self, tolerance=20, min_length=0):
+        """
+        Finds divergent sections between two geometries, in near-linear time
+
+        Both geometries are densified and projected to UTM, and each point is checked against the other geometry
+        through a spatial hash of its segments. Contiguous runs of points further than tolerance from the other
+        geometry form a divergence, which is delimited by the last/first matching points (split/rejoin).
+
+        Can be used as a comparator in locintel.harvest.routes.calculate_competitive.
+
+        :param tolerance: maximum distance between geometries to consider them overlapping, in meters
+        :param min_length: minimum detour length (on either geometry) to report a divergence, in meters
+        """
+        self.tolerance = tolerance
+        self.min_length = min_length
+        self.name = "divergence"
+
+    def __call__(self, geo1, geo2):
+        return self.find(geo1, geo2)
+
+    def find(self, geo1, geo2):
+        """
+        :param geo1: locintel.core.datamodel.geo.Geometry object 1
+        :param geo2: locintel.core.datamodel.geo.Geometry object 2
+        :return: list of Divergence objects, sorted by position along geo1
+        """
+        xy1, zone = _project(geo1)
+        xy2, _ = _project(geo2, zone)
+        spacing = self.tolerance / 2
+
+        points1, measures1 = densify(xy1, spacing)
+        points2, measures2 = densify(xy2, spacing)
+        index1 = SegmentHash(points1, measures1, self.tolerance + spacing)
+        index2 = SegmentHash(points2, measures2, self.tolerance + spacing)
+
+        distances1, projections1 = index2.nearest(points1)
+        distances2, projections2 = index1.nearest(points2)
+
+        intervals = self._intervals(
+            distances1, measures1, projections1, measures2[-1]
+        ) + [
+            (a_start, a_end, b_start, b_end)
+            for b_start, b_end, a_start, a_end in self._intervals(
+                distances2, measures2, projections2, measures1[-1]
+            )
+        ]
+
+        divergences = list()
+        for a_start, a_end, b_start, b_end in _merge(intervals):
+            if max(a_end - a_start, b_end - b_start) < self.min_length:
+                continue
+
+            section1 = _section(measures1, a_start, a_end)
+            section2 = _section(measures2, b_start, b_end)
+            divergences.append(
+                Divergence(
+                    start1=a_start,
+                    end1=a_end,
+                    start2=b_start,
+                    end2=b_end,
+                    split=_unproject(points1[section1[0]], zone),
+                    rejoin=_unproject(points1[section1[-1]], zone),
+                    max_separation=max(
+                        _max_distance(points1, distances1, section1, index2),
+                        _max_distance(points2, distances2, section2, index1),
+                    ),
+                )
+            )
+
+        return divergences
+
+    def _intervals(self, distances, measures, projections, other_length):
+        """
+        Converts runs of off-route points into (start, end, other_start, other_end) measure intervals
+        """
+        off = distances > self.tolerance
+        if not off.any():
+            return []
+
+        edges = np.diff(np.concatenate([[0], off.astype(int), [0]]))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+
+        intervals = list()
+        last = len(measures) - 1
+        for i, j in zip(starts, ends):
+            split, rejoin = max(i - 1, 0), min(j + 1, last)
+            other_start = projections[split] if i > 0 else 0.0
+            other_end = projections[rejoin] if j < last else other_length
+            intervals.append(
+                (
+                    measures[split],
+                    measures[rejoin],
+                    min(other_start, other_end),
+                    max(other_start, other_end),
+                )
+            )
+        return intervals
+
+
+class SegmentHash(object):
+    def __init__(self, points, measures, cell_size):
+        """
+        Spatial hash over polyline segments, keyed by the grid cell of each segment's first point
+
+        Neighbouring cells are always searched, so segments no longer than cell_size - radius are guaranteed
+        to be found for any point within radius. Exhaustive searches retry points without such a guarantee on
+        hashes with doubling cell sizes.
+
+        :param points: (n, 2) array of projected points
+        :param measures: (n,) array of distance along polyline for each point
+        :param cell_size: grid cell side, in projected units
+        """
+        self.points = points
+        self.starts = points[:-1]
+        self.ends = points[1:]
+        self.measures = measures[:-1]
+        self.all_measures = measures
+        self.cell_size = cell_size
+        self.max_length = np.linalg.norm(self.ends - self.starts, axis=1).max(initial=0)
+        self.cells = defaultdict(list)
+        for i, cell in enumerate(map(tuple, self._cells(self.starts))):
+            self.cells[cell].append(i)
+        self._coarser = None
+
+    def nearest(self, points, exhaustive=False):
+        """
+        Distance from each point to nearest segment within neighbouring cells (inf if none), and respective measure
+
+        :param points: (n, 2) array of projected points
+        :param exhaustive: search beyond neighbouring cells, so that the nearest segment is always found
+        """
+        distances = np.full(len(points), np.inf)
+        projections = np.zeros(len(points))
+
+        point_cells = self._cells(points)
+        unique_cells, inverse = np.unique(point_cells, axis=0, return_inverse=True)
+        order = np.argsort(inverse.ravel(), kind="stable")
+        bounds = np.searchsorted(
+            inverse.ravel()[order], np.arange(len(unique_cells) + 1)
+        )
+        for k, (row, col) in enumerate(unique_cells):
+            segments = [
+                i
+                for d_row in (-1, 0, 1)
+                for d_col in (-1, 0, 1)
+                for i in self.cells.get((row + d_row, col + d_col), [])
+            ]
+            if not segments:
+                continue
+
+            members = order[bounds[k] : bounds[k + 1]]
+            # in blocks of points, bounding the (points, segments) arrays
+            step = max(MAX_PAIRS // len(segments), 1)
+            for block in range(0, len(members), step):
+                self._update(
+                    points,
+                    members[block : block + step],
+                    segments,
+                    distances,
+                    projections,
+                )
+
+        unresolved = np.flatnonzero(distances > self.cell_size - self.max_length)
+        if exhaustive and self.cells and len(unresolved):
+            if self._coarser is None:
+                self._coarser = SegmentHash(
+                    self.points, self.all_measures, self.cell_size * 2
+                )
+            distances[unresolved], projections[unresolved] = self._coarser.nearest(
+                points[unresolved], exhaustive=True
+            )
+
+        return distances, projections
+
+    def _update(self, points, members, segments, distances, projections):
+        segment_distances, t = _point_segment_distances(
+            points[members], self.starts[segments], self.ends[segments]
+        )
+        best = segment_distances.argmin(axis=1)
+        rows = np.arange(len(members))
+        distances[members] = segment_distances[rows, best]
+        lengths = np.linalg.norm(
+            self.ends[segments][best] - self.starts[segments][best], axis=1
+        )
+        projections[members] = self.measures[segments][best] + t[rows, best] * lengths
+
+    def _cells(self, points):
+        return np.floor(points / self.cell_size).astype(np.int64)
+
+
+def _project(geometry, zone=None):
+    lats, lngs = np.array(geometry.to_lat_lng_tuples(), dtype=float).T
+    if zone is None:
+        zone = utm.from_latlon(lats[0], lngs[0])[2:]
+    x, y, _, _ = utm.from_latlon(
+        lats, lngs, force_zone_number=zone[0], force_zone_letter=zone[1]
+    )
+    return np.column_stack([x, y]), zone
+
+
+def _unproject(point, zone):
+    lat, lng = utm.to_latlon(point[0], point[1], *zone, strict=False)
+    return GeoCoordinate(float(lat), float(lng))
+
+
+def _section(measures, start, end):
+    """
+    Indices of points within measure interval
+    """
+    section = np.flatnonzero((measures >= start) & (measures <= end))
+    if len(section) < 2:
+        # degenerate interval (e.g. spur on other geometry), use closest point
+        section = np.array([np.abs(measures - start).argmin()] * 2)
+    return section
+
+
+def _point_segment_distances(points, starts, ends):
+    directions = ends - starts
+    lengths = (directions ** 2).sum(axis=1)
+    lengths[lengths == 0] = 1
+    t = ((points[:, None, :] - starts[None]) * directions[None]).sum(axis=2) / lengths
+    t = np.clip(t, 0, 1)
+    projected = starts[None] + t[..., None] * directions[None]
+    return np.linalg.norm(points[:, None, :] - projected, axis=2), t
+
+
+def _max_distance(points, distances, section, other_index):
+    """
+    Maximum distance from section points to other geometry, completing distances beyond neighbouring cells (inf)
+    with an exhaustive search
+    """
+    distances = distances[section]
+    far = np.isinf(distances)
+    if far.any():
+        distances[far], _ = other_index.nearest(points[section[far]], exhaustive=True)
+    return float(distances.max())
+
+
+def _merge(intervals):
+    merged = list()
+    for interval in sorted(intervals):
+        if merged and interval[0] <= merged[-1][1]:
+            last = merged[-1]
+            merged[-1] = (
+                last[0],
+                max(last[1], interval[1]),
+                min(last[2], interval[2]),
+                max(last[3], interval[3]),
+            )
+        else:
+            merged.append(interval)
+    return merged
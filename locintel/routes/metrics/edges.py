@@ -0,0 +1,249 @@
+"""
+Route comparison over edge sequences of a graph (e.g. routes matched against a Jurbey graph)
+"""
+import inspect
+
+import numpy as np
+
+from locintel.core.algorithms.geo import haversine_distances
+from locintel.core.algorithms.itertools import pairwise
+
+
+class EdgeTable(object):
+    def __init__(self, graph):
+        """
+        Precomputed table of edge ids and lengths for a graph
+
+        Edge lengths are calculated from edge geometries where available, falling back to straight line
+        distance between edge nodes.
+
+        :param graph: locintel.graphs.datamodel.jurbey.Jurbey object (or any networkx.DiGraph with node "data"
+                      attributes holding coord and edge "data" attributes holding geometry)
+        """
+        self.ids = dict()
+        lats, lngs, owners = list(), list(), list()
+        for i, (u, v, data) in enumerate(graph.edges(data=True)):
+            self.ids[(u, v)] = i
+            geometry = getattr(data.get("data"), "geometry", None)
+            if geometry:
+                coords = [(coord.lat, coord.lng) for coord in geometry]
+            else:
+                coords = [
+                    (graph.nodes[n]["data"].coord.lat, graph.nodes[n]["data"].coord.lng)
+                    for n in (u, v)
+                ]
+            lats.extend(coord[0] for coord in coords)
+            lngs.extend(coord[1] for coord in coords)
+            owners.extend([i] * len(coords))
+
+        lats, lngs, owners = np.array(lats), np.array(lngs), np.array(owners)
+        same_edge = owners[:-1] == owners[1:]
+        distances = haversine_distances(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+        self.lengths = np.bincount(
+            owners[:-1][same_edge],
+            weights=distances[same_edge],
+            minlength=len(self.ids),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, edges):
+        """
+        Converts sequence of (from_node, to_node) edges into array of edge ids
+
+        :raises ValueError: when an edge does not exist in graph
+        """
+        try:
+            return np.array([self.ids[tuple(edge)] for edge in edges], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError(f"Edge {e.args[0]} not found in graph")
+
+    def length(self, edges):
+        return float(self.lengths[self.encode(edges)].sum())
+
+
+def matching_nodes(matching):
+    """
+    Extracts node sequence of a matching of a raw matcher response (consecutive legs share nodes at their
+    boundaries, these are deduplicated)
+
+    :param matching: element of "matchings" of raw matcher response
+    :return: list of node ids
+    """
+    nodes = list()
+    for leg in matching["legs"]:
+        leg_nodes = list(leg["nodes"])
+        overlap = next(
+            (
+                k
+                for k in range(min(len(nodes), len(leg_nodes)), 0, -1)
+                if nodes[-k:] == leg_nodes[:k]
+            ),
+            0,
+        )
+        nodes.extend(leg_nodes[overlap:])
+    return nodes
+
+
+def match_to_edges(match):
+    """
+    Extracts edge sequence from a match (see locintel.harvest.matches.MapboxMatcherResponseAdapter)
+
+    Consecutive legs share nodes at their boundaries, these are deduplicated. Separate matchings are not bridged.
+
+    :param match: locintel.core.datamodel.routing.Route object with raw matcher response in metadata
+    :return: list of (from_node, to_node) tuples
+    """
+    edges = list()
+    for matching in match.metadata["raw"]["matchings"]:
+        edges.extend(pairwise(matching_nodes(matching)))
+    return edges
+
+
+class EdgeSequenceComparator(object):
+    def __init__(self, table):
+        """
+        Compares routes represented as sequences of graph edges
+
+        All comparison methods work on batches of route pairs, returning one score per pair.
+
+        :param table: EdgeTable object for the graph in which routes are represented
+        """
+        self.table = table
+        self.methods = [
+            name[len("compare_") :]
+            for name, _ in inspect.getmembers(self)
+            if name.startswith("compare_")
+        ]
+
+    def compare(self, edges1, edges2, method, **kwargs):
+        """
+        Compares a single pair of edge sequences (see batch_compare)
+        """
+        return self.batch_compare([(edges1, edges2)], method, **kwargs)[0]
+
+    def batch_compare(self, pairs, method, **kwargs):
+        """
+        :param pairs: sequence of (edges1, edges2) tuples, each a sequence of (from_node, to_node) edges
+        :param method: comparison method, choose from self.methods
+        :return: numpy array with one score per pair
+        """
+        try:
+            func = getattr(self, f"compare_{method}")
+        except AttributeError:
+            raise AttributeError(
+                f'"{method}" not a valid method, choose from: {self.methods}'
+            )
+        ids1 = [self.table.encode(edges1) for edges1, _ in pairs]
+        ids2 = [self.table.encode(edges2) for _, edges2 in pairs]
+        return func(ids1, ids2, **kwargs)
+
+    def compare_jaccard(self, ids1, ids2):
+        """
+        Length-weighted Jaccard index between edge sets: shared length / union length
+        """
+        shared, length1, length2 = self._set_lengths(ids1, ids2)
+        union = length1 + length2 - shared
+        return np.divide(shared, union, out=np.ones_like(shared), where=union > 0)
+
+    def compare_shared_distance(self, ids1, ids2):
+        """
+        Ratio of first route's length which is also covered by second route
+        """
+        shared, length1, _ = self._set_lengths(ids1, ids2)
+        return np.divide(shared, length1, out=np.ones_like(shared), where=length1 > 0)
+
+    def compare_lcs(self, ids1, ids2, normalized=False):
+        """
+        Length-weighted longest common subsequence of edges, in meters
+
+        :param normalized: divide by length of longest route of the pair
+        """
+        scores = np.array(
+            [self._lcs(seq1, seq2) for seq1, seq2 in zip(ids1, ids2)], dtype=float
+        )
+        if normalized:
+            longest = np.array(
+                [
+                    max(self.table.lengths[seq1].sum(), self.table.lengths[seq2].sum())
+                    for seq1, seq2 in zip(ids1, ids2)
+                ]
+            )
+            scores = np.divide(
+                scores, longest, out=np.ones_like(scores), where=longest > 0
+            )
+        return scores
+
+    def compare_edit_distance(self, ids1, ids2, normalized=False):
+        """
+        Levenshtein distance between edge sequences, in number of edges
+
+        :param normalized: divide by number of edges of longest route of the pair
+        """
+        scores = np.array(
+            [self._edit_distance(seq1, seq2) for seq1, seq2 in zip(ids1, ids2)],
+            dtype=float,
+        )
+        if normalized:
+            longest = np.array(
+                [max(len(seq1), len(seq2)) for seq1, seq2 in zip(ids1, ids2)],
+                dtype=float,
+            )
+            scores = np.divide(
+                scores, longest, out=np.zeros_like(scores), where=longest > 0
+            )
+        return scores
+
+    def _set_lengths(self, ids1, ids2):
+        """
+        Shared, first and second route lengths over unique edges, for all pairs at once
+
+        Edge ids are offset by pair index, so that set operations for all pairs happen in one pass
+        """
+        n_pairs, n_edges = len(ids1), len(self.table)
+        keys1 = self._pair_keys(ids1, n_edges)
+        keys2 = self._pair_keys(ids2, n_edges)
+        shared = np.intersect1d(keys1, keys2, assume_unique=True)
+
+        def lengths(keys):
+            return np.bincount(
+                keys // n_edges,
+                weights=self.table.lengths[keys % n_edges],
+                minlength=n_pairs,
+            ).astype(float)
+
+        return lengths(shared), lengths(keys1), lengths(keys2)
+
+    @staticmethod
+    def _pair_keys(ids, n_edges):
+        keys = [i * n_edges + seq for i, seq in enumerate(ids)]
+        return np.unique(np.concatenate(keys + [np.array([], dtype=np.int64)]))
+
+    def _lcs(self, seq1, seq2):
+        """
+        Row-vectorized weighted LCS: L[i, j] = max(L[i - 1, j], L[i - 1, j - 1] + w[j] if match, L[i, j - 1]),
+        where the last term is a running maximum along the row
+        """
+        weights = self.table.lengths[seq2]
+        previous = np.zeros(len(seq2) + 1)
+        for edge in seq1:
+            candidates = np.maximum(
+                previous[1:], np.where(seq2 == edge, previous[:-1] + weights, 0)
+            )
+            previous = np.maximum.accumulate(np.concatenate([[0], candidates]))
+        return previous[-1]
+
+    @staticmethod
+    def _edit_distance(seq1, seq2):
+        """
+        Row-vectorized Levenshtein: insertions along the row are resolved with a running minimum of D[i, j] - j
+        """
+        columns = np.arange(len(seq2) + 1)
+        previous = columns.astype(float)
+        for i, edge in enumerate(seq1, 1):
+            row = np.empty(len(seq2) + 1)
+            row[0] = i
+            row[1:] = np.minimum(previous[1:] + 1, previous[:-1] + (seq2 != edge))
+            previous = np.minimum.accumulate(row - columns) + columns
+        return previous[-1]
@@ -0,0 +1,257 @@
+"""
+Locality-sensitive hashing over route geometries, for near-duplicate detection in large route sets
+"""
+from collections import defaultdict
+import math
+
+import numpy as np
+
+from locintel.core.algorithms.geo import densify, METERS_PER_DEGREE
+from locintel.routes.metrics.geometry import GeometryComparator
+
+MINHASH_PRIME = 4294967291  # largest prime below 2**32, keeps a * x + b within uint64
+
+
+def geometry_cells(geometry, cell_size=100, margin=None):
+    """
+    Calculates the set of grid cells touched by a geometry
+
+    Segments are densified to half the cell size, so that cells crossed between two distant points are also
+    accounted for. Cell width in longitude is corrected per grid row, so cells are roughly square in meters.
+
+    Points closer than margin to a cell border also touch the neighbouring cell, so that nearby geometries
+    running along a grid line still share cells.
+
+    :param geometry: locintel.core.datamodel.geo.Geometry object
+    :param cell_size: cell side, in meters
+    :param margin: distance to cell border under which neighbouring cells are touched, in meters
+                   (defaults to a quarter of cell size)
+    :return: set of (row, column) tuples
+    """
+    margin = cell_size / 4 if margin is None else margin
+    ratio = margin / cell_size
+    points = np.array(geometry.to_lat_lng_tuples(), dtype=float)
+    step = cell_size / 2 / METERS_PER_DEGREE
+
+    deltas = np.diff(points, axis=0)
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1] * np.cos(np.radians(points[:-1, 0])))
+    dense, _ = densify(points, step, lengths)
+
+    lat_step = cell_size / METERS_PER_DEGREE
+    row_position = dense[:, 0] / lat_step
+    rows = np.floor(row_position).astype(np.int64)
+    row_fraction = row_position - rows
+
+    cells = set()
+    for row_offset, row_mask in (
+        (0, np.ones(len(rows), dtype=bool)),
+        (-1, row_fraction < ratio),
+        (1, row_fraction > 1 - ratio),
+    ):
+        touched_rows = rows[row_mask] + row_offset
+        row_lat = np.radians((touched_rows + 0.5) * lat_step)
+        lng_step = lat_step / np.maximum(np.cos(row_lat), 1e-6)
+        col_position = dense[row_mask, 1] / lng_step
+        cols = np.floor(col_position).astype(np.int64)
+        col_fraction = col_position - cols
+
+        for col_offset, col_mask in (
+            (0, np.ones(len(cols), dtype=bool)),
+            (-1, col_fraction < ratio),
+            (1, col_fraction > 1 - ratio),
+        ):
+            cells.update(
+                zip(
+                    touched_rows[col_mask].tolist(),
+                    (cols[col_mask] + col_offset).tolist(),
+                )
+            )
+
+    return cells
+
+
+class MinHasher(object):
+    def __init__(self, num_perm=64, seed=1):
+        """
+        MinHash signature generator, using universal hashing (a * x + b) mod p as permutations
+
+        :param num_perm: number of permutations (signature length)
+        :param seed: seed for permutation parameters, signatures are only comparable for equal seeds
+        """
+        self.num_perm = num_perm
+        self.seed = seed
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, cells):
+        """
+        Calculates MinHash signature for a set of grid cells
+
+        :param cells: iterable of (row, column) tuples
+        :return: numpy array of num_perm unsigned integers
+        """
+        cells = np.array(list(cells), dtype=np.int64).reshape(-1, 2)
+        if not len(cells):
+            raise ValueError("Cannot compute signature of empty cell set")
+
+        cell_hashes = ((cells[:, 0] * 73856093) ^ (cells[:, 1] * 19349663)) & 0xFFFFFFFF
+        cell_hashes = (cell_hashes % MINHASH_PRIME).astype(np.uint64)
+        permuted = (np.outer(cell_hashes, self.a) + self.b) % np.uint64(MINHASH_PRIME)
+        return permuted.min(axis=0)
+
+    @staticmethod
+    def jaccard(signature1, signature2):
+        """
+        Estimates Jaccard similarity between the cell sets which originated two signatures
+        """
+        return float(np.mean(signature1 == signature2))
+
+
+class RouteLSHIndex(object):
+    def __init__(
+        self,
+        cell_size=100,
+        num_perm=64,
+        bands=16,
+        method="hausdorff",
+        threshold=50,
+        seed=1,
+        **method_kwargs,
+    ):
+        """
+        Locality-sensitive hashing index over route geometries (MinHash over touched grid cells, with banding)
+
+        Candidates are retrieved by sharing at least one band bucket with the query, and are only considered
+        similar after verification with locintel.routes.metrics.geometry.GeometryComparator.
+
+        :param cell_size: grid cell side, in meters
+        :param num_perm: MinHash signature length, must be divisible by bands
+        :param bands: number of LSH bands (more bands -> more candidates, higher recall, lower precision)
+        :param method: GeometryComparator method used to verify candidates (e.g. hausdorff, frechet)
+        :param threshold: maximum comparator score for a candidate to be considered similar, None skips verification
+        :param seed: seed for MinHash permutations
+        :param method_kwargs: additional keyword arguments for the comparator method
+        """
+        if num_perm % bands:
+            raise ValueError(
+                f"Number of permutations ({num_perm}) must be divisible by number of bands ({bands})"
+            )
+
+        self.cell_size = cell_size
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.method = method
+        self.threshold = threshold
+        self.method_kwargs = method_kwargs
+        self.hasher = MinHasher(num_perm=num_perm, seed=seed)
+        self.comparator = GeometryComparator()
+
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.geometries = dict()
+        self.signatures = dict()
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def __contains__(self, key):
+        return key in self.geometries
+
+    def signature(self, geometry):
+        return self.hasher.signature(geometry_cells(geometry, self.cell_size))
+
+    def insert(self, key, geometry, signature=None):
+        """
+        Inserts geometry into index
+
+        :param key: unique identifier for the geometry (e.g. route plan name + provider)
+        :param geometry: locintel.core.datamodel.geo.Geometry object
+        :param signature: precomputed MinHash signature (optional)
+        """
+        if key in self.geometries:
+            raise KeyError(f"{key} already in index")
+
+        signature = self.signature(geometry) if signature is None else signature
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self.buckets[band][band_key].append(key)
+
+        self.geometries[key] = geometry
+        self.signatures[key] = signature
+
+    def remove(self, key):
+        signature = self.signatures.pop(key)
+        del self.geometries[key]
+        for band, band_key in enumerate(self._band_keys(signature)):
+            bucket = self.buckets[band][band_key]
+            bucket.remove(key)
+            if not bucket:
+                del self.buckets[band][band_key]
+
+    def candidates(self, geometry, signature=None):
+        """
+        Retrieves unverified candidates for geometry, ordered by estimated Jaccard similarity (descending)
+        """
+        signature = self.signature(geometry) if signature is None else signature
+        keys = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            keys.update(self.buckets[band].get(band_key, []))
+
+        return sorted(
+            keys,
+            key=lambda k: MinHasher.jaccard(signature, self.signatures[k]),
+            reverse=True,
+        )
+
+    def query(self, geometry, signature=None, first=False):
+        """
+        Finds indexed geometries similar to the provided one
+
+        :param geometry: locintel.core.datamodel.geo.Geometry object
+        :param signature: precomputed MinHash signature (optional)
+        :param first: stop at first verified candidate
+        :return: list of (key, score) tuples, sorted by score
+        """
+        results = list()
+        for key in self.candidates(geometry, signature=signature):
+            score = self._verify(geometry, self.geometries[key])
+            if score is not None:
+                results.append((key, score))
+                if first:
+                    break
+
+        return sorted(results, key=lambda result: result[1])
+
+    def dedup(self, items):
+        """
+        Bulk deduplication: groups near-duplicate geometries under a representative, in input order
+
+        Only representatives are kept in the index, so memory grows with the number of distinct routes.
+
+        :param items: iterable of (key, geometry) tuples
+        :return: dict with representative keys as keys and list of duplicate keys as values
+        """
+        groups = dict()
+        for key, geometry in items:
+            signature = self.signature(geometry)
+            match = self.query(geometry, signature=signature, first=True)
+            if match:
+                groups.setdefault(match[0][0], []).append(key)
+            else:
+                self.insert(key, geometry, signature=signature)
+                groups.setdefault(key, [])
+
+        return groups
+
+    def _verify(self, geo1, geo2):
+        if self.threshold is None:
+            return math.nan
+
+        score = self.comparator.compare(geo1, geo2, self.method, **self.method_kwargs)
+        return score if score <= self.threshold else None
+
+    def _band_keys(self, signature):
+        # raw bytes rather than hash(), so that bucket keys are stable across processes
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
@@ -21,4 +21,5 @@ setup(
         "Operating System :: OS Independent",
     ],
     install_requires=["requests", "numpy", "polyline", "geojson", "shapely", "utm"],
+    extras_require={"fast": ["orjson"], "aio": ["aiohttp"]},
 )
@@ -1,7 +1,15 @@
 from math import isclose
 
+import numpy as np
+import polyline
+
 from locintel.core.datamodel.geo import GeoCoordinate
-from locintel.core.algorithms.geo import calculate_angle
+from locintel.core.algorithms.geo import (
+    calculate_angle,
+    decode_polyline,
+    densify,
+    haversine_distances,
+)
 
 import pytest
 
@@ -12,3 +20,36 @@ def test_get_angle():
     c = GeoCoordinate(1.0, 2.0)
     assert isclose(calculate_angle(a, b, c), 90.0, rel_tol=1e-6)
     assert isclose(calculate_angle(c, b, a), 45.0, rel_tol=1e-6)
+
+
+def test_haversine_distances():
+    result = haversine_distances([52.5, 0.0], [13.4, 0.0], [52.5, 1.0], [13.4, 0.0])
+
+    assert result[0] == 0
+    assert isclose(result[1], 111230, rel_tol=1e-3)
+
+
+def test_densify():
+    points = np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 2.0]])
+
+    dense, measures = densify(points, 4)
+
+    assert np.allclose(dense[:5], [[0, 0], [10 / 3, 0], [20 / 3, 0], [10, 0], [10, 2]])
+    assert np.allclose(measures, [0, 10 / 3, 20 / 3, 10, 12])
+    assert np.all(np.linalg.norm(np.diff(dense, axis=0), axis=1) <= 4)
+
+
+def test_densify_with_lengths():
+    dense, measures = densify(np.array([[0.0, 0.0], [1.0, 0.0]]), 2, lengths=np.array([4.0]))
+
+    assert np.allclose(dense, [[0, 0], [0.5, 0], [1, 0]])
+    assert np.allclose(measures, [0, 2, 4])
+
+
+def test_decode_polyline():
+    coords = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453), (0.00001, 0.0)]
+    encoded = polyline.encode(coords)
+
+    assert np.allclose(decode_polyline(encoded), polyline.decode(encoded))
+    assert np.allclose(decode_polyline(polyline.encode(coords, 6), precision=6), coords)
+    assert decode_polyline("").shape == (0, 2)
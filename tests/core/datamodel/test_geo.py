@@ -1,4 +1,5 @@
 import numpy as np
+import pickle
 import polyline
 import shapely.geometry as sg
 import utm
@@ -6,7 +7,7 @@ import utm
 from unittest.mock import mock_open, patch, call
 
 from locintel.core.datamodel.geo import *
-from tests.fixtures.geo import *
+from .fixtures.geo import *
 
 
 class TestGeoCoordinate(object):
@@ -843,3 +844,66 @@ class TestGeometry(object):
         assert isinstance(result, tuple)
         assert result[0] == (lng_1, lat_1)
         assert result[1] == (lng_2, lat_2)
+
+
+class TestLazyGeometry(object):
+    points = [[{"lat": 1, "lon": 2}, {"lat": 1.5, "lon": 2.5}], [{"lat": 2, "lon": 3}]]
+
+    def test_decodes_on_first_access(self):
+        decoder = Mock(wraps=lat_lng_array)
+        geometry = LazyGeometry(decoder, self.points)
+
+        assert not geometry.is_decoded
+        decoder.assert_not_called()
+
+        assert geometry.to_lat_lng_tuples() == ((1, 2), (1.5, 2.5), (2, 3))
+        assert geometry.is_decoded
+        assert len(geometry) == 3
+        decoder.assert_called_once_with(self.points)
+
+    def test_equals_eager_geometry(self):
+        geometry = LazyGeometry(lat_lng_array, self.points)
+        eager = Geometry.from_lat_lon_dicts([p for leg in self.points for p in leg])
+
+        assert geometry == eager
+        assert geometry.coords == eager.coords
+        assert geometry.to_lng_lat_tuples() == eager.to_lng_lat_tuples()
+        assert geometry.to_linestring().equals(eager.to_linestring())
+        assert geometry.length() == eager.length()
+
+    def test_coords_assignment_replaces_array(self):
+        geometry = LazyGeometry(lat_lng_array, self.points)
+
+        geometry.coords = [GeoCoordinate(0, 0), GeoCoordinate(1, 1)]
+
+        assert geometry.array.tolist() == [[0, 0], [1, 1]]
+
+    def test_array_follows_coords_mutations(self):
+        geometry = LazyGeometry(lat_lng_array, self.points)
+        other = Geometry([GeoCoordinate(4, 5), GeoCoordinate(6, 7)])
+        assert len(geometry.array) == 3
+
+        geometry.coords += [GeoCoordinate(3, 4)]
+        assert geometry.array.tolist()[-1] == [3, 4]
+        geometry + other
+        assert geometry.array.tolist()[-2:] == [[4, 5], [6, 7]]
+        geometry.coords.append(GeoCoordinate(8, 9))
+        assert geometry.array.tolist()[-1] == [8, 9]
+        assert len(geometry) == 7
+        assert pickle.loads(pickle.dumps(geometry)).array.tolist() == (
+            geometry.array.tolist()
+        )
+
+    def test_pickles_undecoded(self):
+        geometry = LazyGeometry(lat_lng_array, self.points)
+
+        restored = pickle.loads(pickle.dumps(geometry))
+
+        assert not restored.is_decoded
+        assert restored == geometry
+
+    def test_less_than_two_points_raises_value_error_on_access(self):
+        geometry = LazyGeometry(lat_lng_array, [[{"lat": 1, "lon": 2}]])
+
+        with pytest.raises(ValueError):
+            geometry.array
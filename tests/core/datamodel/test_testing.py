@@ -1,5 +1,5 @@
 from locintel.core.datamodel.testing import *
-from tests.fixtures.testing import *
+from .fixtures.testing import *
 
 import pytest
 from unittest.mock import Mock, mock_open, patch, call
@@ -37,7 +37,7 @@ class TestTestResult(object):
 
         result = tests.get_providers()
 
-        assert sorted(result) == [provider_1, provider_2]
+        assert result == [provider_1, provider_2]
 
     def test_from_database_documents(self, mocker, mock_routes):
         expected_routes = mock_routes
@@ -255,6 +255,17 @@ class TestExperimentResult(object):
         row_test_2 = call(["test_2", 20, 15, 30, 35, "zxy", "zxv", 7000, 0.1, 0.8])
         writer_mock.writerow.assert_has_calls([header, row_test_1, row_test_2])
 
+    def test_rows_have_empty_cells_for_timed_out_providers(self):
+        route = Mock(distance=10, duration=20, geometry=Mock(to_polyline=lambda: "abc"))
+        test_1 = TestResult("test_1", Mock(), {"a": route, "b": route})
+        test_2 = TestResult("test_2", Mock(), {"a": route}, timed_out=["b"])
+
+        columns, rows = ExperimentResult([test_1, test_2]).to_dataframe_consumable()
+
+        assert test_2.get_providers() == ["a", "b"]
+        assert len(rows[1]) == len(columns)
+        assert rows[1] == ["test_2", 10, None, 20, None, "abc", None]
+
     def test_write_to_dataframe_consumable(self, mocker):
         cols_mock = Mock()
         rows_mock = Mock()
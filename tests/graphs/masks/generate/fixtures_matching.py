@@ -4,7 +4,7 @@ from locintel.core.datamodel.geo import GeoCoordinate, Geometry
 from locintel.graphs.datamodel.jurbey import Path
 from locintel.graphs.masks.generate.matching import RouteMatchingMaskGenerator
 from locintel.graphs.processing.paths import PathsGenerator
-from locintel.services.matching import MapboxMatcher
+from locintel.harvest.matches import MapboxMatcher
 
 import pytest
 from unittest.mock import Mock
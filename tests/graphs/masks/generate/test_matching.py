@@ -1,7 +1,20 @@
+from locintel.core.datamodel.geo import GeoCoordinate, Geometry
+from locintel.core.datamodel.routing import Route
+from locintel.graphs.datamodel.jurbey import Jurbey, Node, Path
 from locintel.graphs.masks.generate.matching import RouteMatchingMaskGenerator
+from locintel.graphs.masks.generate.store import MatchStore
+from locintel.graphs.processing.paths import PathsGenerator
+from locintel.harvest.matches import LocalMatcher
 
+import asyncio
+import random
+import threading
+import time
+
+import pytest
 from unittest.mock import Mock
 
+from ...processing.fixtures_matching import grid, trace
 from .fixtures_matching import (
     mock_mapbox_route_matching,
     mock_decompose_mock,
@@ -13,6 +26,86 @@ from .fixtures_matching import (
 )
 
 
+def match_route(geometry, legs_nodes):
+    return Route(
+        geometry,
+        1,
+        1,
+        metadata={
+            "raw": {"matchings": [{"legs": [{"nodes": n} for n in legs_nodes]}]},
+            "confidence": 0.9,
+            "max_snap_distance": 1,
+            "failed_points": 0,
+        },
+    )
+
+
+def straight_paths(n):
+    """
+    Paths of n - 1 edges each along lat i, matched onto nodes [10 * i, ..., 10 * i + 2] by path_matcher
+    """
+    return [
+        Path(
+            geometry=Geometry([GeoCoordinate(i, lng) for lng in range(3)]),
+            edges=[(i, i + 1)] * (i % 3 + 1),
+        )
+        for i in range(n)
+    ]
+
+
+def path_match(plan, **options):
+    i = int(plan.points[0].lat)
+    if i % 7 == 3:
+        raise ValueError("No matching found")
+    return match_route(
+        Geometry.dummy(), [[10 * i, 10 * i + 1], [10 * i + 1, 10 * i + 2]]
+    )
+
+
+class ConcurrentMatcher(object):
+    """
+    Matcher answering after random delays, recording the maximum number of requests in flight
+    """
+
+    def __init__(self):
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def calculate(self, plan, **options):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(random.uniform(0, 0.005))
+            return path_match(plan)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class AsyncConcurrentMatcher(ConcurrentMatcher):
+    def __init__(self):
+        super().__init__()
+        self.sessions = list()
+
+    def create_session(self, concurrency):
+        session = Mock()
+        session.__aenter__ = lambda s: asyncio.sleep(0, s)
+        session.__aexit__ = lambda s, *args: asyncio.sleep(0)
+        self.sessions.append((session, concurrency))
+        return session
+
+    async def calculate(self, plan, session=None, **options):
+        assert session is self.sessions[0][0]
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(random.uniform(0, 0.005))
+            return path_match(plan)
+        finally:
+            self.in_flight -= 1
+
+
 class TestGraphMatchingMaskGenerator:
     def test_generate(
         self, mock_mapbox_route_matching, mock_path_generator, mock_decompose_mock
@@ -25,3 +118,126 @@ class TestGraphMatchingMaskGenerator:
         assert mask.nodes == expected_nodes
         assert mask.edges == expected_edges
         assert mask.relations == expected_relations
+
+    def test_hausdorff_filter_single_request_with_geometry(self, mock_path_generator):
+        paths, _ = mock_path_generator
+        matcher = Mock()
+        matcher.calculate.side_effect = [
+            match_route(path.geometry, [[i, i + 1]]) for i, path in enumerate(paths)
+        ]
+        mask_generator = RouteMatchingMaskGenerator(
+            odd_graph=Mock(), matcher=matcher, filter_hausdorff_distance=True
+        )
+
+        mask = mask_generator.generate()
+
+        assert matcher.calculate.call_count == 2
+        for call in matcher.calculate.call_args_list:
+            assert call.kwargs["report_geometry"] is True
+        assert mask.edges == {(0, 1), (1, 2)}
+
+    def test_hausdorff_filter_geometry_rebuilt_from_base_graph(
+        self, mock_path_generator
+    ):
+        paths, _ = mock_path_generator
+        base_graph = Jurbey()
+        for lat in (0, 1, 2, 3):
+            base_graph.add_node(Node(coord=GeoCoordinate(lat, 0)))
+        base_graph.add_node(Node(coord=GeoCoordinate(1, 1)))
+        matcher = Mock()
+        matcher.calculate.side_effect = [
+            match_route(Geometry.dummy(), [[0, 1], [1, 2]]),
+            match_route(Geometry.dummy(), [[1, 4]]),  # far away from path
+        ]
+        mask_generator = RouteMatchingMaskGenerator(
+            odd_graph=Mock(),
+            matcher=matcher,
+            filter_hausdorff_distance=True,
+            base_graph=base_graph,
+        )
+
+        mask = mask_generator.generate()
+
+        assert matcher.calculate.call_count == 2
+        for call in matcher.calculate.call_args_list:
+            assert call.kwargs["report_geometry"] is False
+        assert mask.edges == {(0, 1), (1, 2)}
+
+    @pytest.mark.parametrize(
+        "matcher_class", [ConcurrentMatcher, AsyncConcurrentMatcher]
+    )
+    def test_generate_concurrently(self, mocker, matcher_class):
+        mocker.patch.object(PathsGenerator, "generate", return_value=straight_paths(40))
+        serial = RouteMatchingMaskGenerator(
+            odd_graph=Mock(), matcher=matcher_class(), lanes_threshold=2
+        ).generate()
+        matcher = matcher_class()
+        progress = list()
+        mask_generator = RouteMatchingMaskGenerator(
+            odd_graph=Mock(), matcher=matcher, lanes_threshold=2
+        )
+
+        mask = mask_generator.generate(
+            jobs=4, progress=lambda stats: progress.append(stats["processed"])
+        )
+
+        assert mask == serial
+        assert (10, 11) in mask.edges and (30, 31) not in mask.edges
+        assert 1 < matcher.max_in_flight <= 4
+        assert progress == list(range(1, 41))
+        stats = mask_generator.stats
+        assert (stats["paths"], stats["processed"]) == (40, 40)
+        assert (stats["ignored"], stats["failed"], stats["matched"]) == (14, 4, 22)
+        assert stats["edges"] == len(mask.edges) == 44
+        assert stats["throughput"] > 0
+
+    def test_generate_incrementally(self, mocker, tmp_path):
+        paths = straight_paths(20)
+        generate_mock = mocker.patch.object(PathsGenerator, "generate")
+        store = MatchStore(str(tmp_path / "matches.sqlite"))
+
+        def generate(paths):
+            generate_mock.return_value = paths
+            matcher = Mock()
+            matcher.calculate.side_effect = path_match
+            mask_generator = RouteMatchingMaskGenerator(
+                odd_graph=Mock(), matcher=matcher, lanes_threshold=2, store=store
+            )
+            return mask_generator.generate(jobs=4), mask_generator, matcher
+
+        generate(paths)
+        # path 1 changed, path 2 removed, path 22 added
+        changed = straight_paths(23)
+        changed[1].geometry = Geometry([GeoCoordinate(1, lng) for lng in (0, 1, 5)])
+        changed = changed[:2] + changed[3:20] + changed[22:]
+
+        mask, mask_generator, matcher = generate(changed)
+
+        matched_lats = {
+            call.args[0].points[0].lat for call in matcher.calculate.call_args_list
+        }
+        assert matched_lats == {1, 10, 17, 22}  # changed, new and failed paths
+        assert mask_generator.stats["reused"] == 9
+        assert mask_generator.stats["pruned"] == 2
+        assert (20, 21) not in mask.edges
+        assert (
+            mask
+            == RouteMatchingMaskGenerator(
+                odd_graph=Mock(), matcher=ConcurrentMatcher(), lanes_threshold=2
+            ).generate()
+        )
+
+    def test_generate_with_local_matcher(self, mocker, grid):
+        lats, lngs = trace((0, 0.1), (0, 0.9), (0.5, 1), (1, 1.5), (1, 1.9))
+        path = Path(Geometry([GeoCoordinate(*coord) for coord in zip(lats, lngs)]))
+        mocker.patch.object(PathsGenerator, "generate", return_value=[path])
+
+        mask = RouteMatchingMaskGenerator(
+            odd_graph=Mock(),
+            matcher=LocalMatcher(grid),
+            filter_hausdorff_distance=True,
+            base_graph=grid,
+        ).generate()
+
+        assert mask.nodes == {0, 1, 4, 5}
+        assert mask.edges == {(0, 1), (1, 4), (4, 5)}
@@ -0,0 +1,46 @@
+from locintel.core.datamodel.geo import GeoCoordinate, Geometry
+from locintel.graphs.datamodel.jurbey import Path
+from locintel.graphs.masks.generate.store import MatchStore, path_fingerprint
+
+
+def path(*lats):
+    return Path(geometry=Geometry([GeoCoordinate(lat, 13.4) for lat in lats]))
+
+
+class TestPathFingerprint(object):
+    def test_fingerprint(self):
+        options = {"radius": 10, "timestamps": 5}
+
+        fingerprint = path_fingerprint(path(52.1, 52.2), options)
+
+        assert fingerprint == path_fingerprint(
+            path(52.1, 52.2 + 1e-9), {"timestamps": 5, "radius": 10}
+        )
+        assert fingerprint != path_fingerprint(path(52.1, 52.3), options)
+        assert fingerprint != path_fingerprint(path(52.2, 52.1), options)
+        assert fingerprint != path_fingerprint(path(52.1, 52.2), {"radius": 20})
+
+
+class TestMatchStore(object):
+    def test_set_get(self, tmp_path):
+        store = MatchStore(str(tmp_path / "matches.sqlite"))
+        decomposition = ({1, 2, 3}, {(1, 2), (2, 3)}, {(1, 2, 3)})
+
+        store.set("a", "matched", decomposition)
+        store.set("b", "filtered")
+
+        reopened = MatchStore(str(tmp_path / "matches.sqlite"))
+        assert reopened.get("a") == ("matched", decomposition)
+        assert reopened.get("b") == ("filtered", None)
+        assert reopened.get("c") is None
+        assert len(reopened) == 2
+
+    def test_prune(self, tmp_path):
+        store = MatchStore(str(tmp_path / "matches.sqlite"))
+        for fingerprint in "abc":
+            store.set(fingerprint, "filtered")
+
+        assert store.prune(["a", "c", "d"]) == 1
+
+        assert "b" not in store
+        assert "a" in store and "c" in store
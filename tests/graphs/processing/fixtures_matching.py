@@ -0,0 +1,76 @@
+from locintel.core.datamodel.geo import GeoCoordinate, Geometry
+from locintel.graphs.datamodel.jurbey import Edge, Jurbey, Node
+from locintel.graphs.datamodel.types import EdgeType
+
+import pytest
+
+LAT, LNG = 52.5, 13.4
+STEP_LAT, STEP_LNG = 0.001, 0.0015  # about 111m and 101m
+
+"""
+ 0 ---- 1 ---- 2
+ |      |      |
+ 3 ---- 4 ---> 5
+ |      |      |
+ 6 ---- 7 ---- 8
+
+All edges go both ways, but 4 -> 5 (at 36 km/h). Edges between 1 and 2 bend north, through a point 0.0003 degrees
+north of their middle.
+"""
+grid_edges = [
+    (0, 1),
+    (1, 2),
+    (3, 6),
+    (6, 7),
+    (7, 8),
+    (0, 3),
+    (1, 4),
+    (2, 5),
+    (3, 4),
+    (4, 7),
+    (5, 8),
+]
+
+
+def grid_coord(node, lat_offset=0, lng_offset=0):
+    row, column = divmod(node, 3)
+    return GeoCoordinate(
+        LAT - row * STEP_LAT + lat_offset, LNG + column * STEP_LNG + lng_offset
+    )
+
+
+def add_edge(graph, u, v, speed=50):
+    geometry = []
+    if {u, v} == {1, 2}:
+        middle = grid_coord(1, lat_offset=0.0003, lng_offset=STEP_LNG / 2)
+        geometry = Geometry(
+            [graph.nodes[u]["data"].coord, middle, graph.nodes[v]["data"].coord]
+        )
+    graph.add_edge(
+        u,
+        v,
+        speed=speed,
+        data=Edge(EdgeType.LANE_STRAIGHT, u, v, geometry=geometry),
+    )
+
+
+@pytest.fixture
+def grid():
+    graph = Jurbey()
+    for node in range(9):
+        graph.add_node(Node(coord=grid_coord(node), id=node))
+    for u, v in grid_edges:
+        add_edge(graph, u, v)
+        add_edge(graph, v, u)
+    add_edge(graph, 4, 5, speed=36)
+    return graph
+
+
+def trace(*positions):
+    """
+    Trace points at (row, column) fractional grid positions
+    """
+    return (
+        [LAT - row * STEP_LAT for row, _ in positions],
+        [LNG + column * STEP_LNG for _, column in positions],
+    )
@@ -0,0 +1,113 @@
+from locintel.core.datamodel.geo import GeoCoordinate
+from locintel.core.datamodel.matching import MatchPlan, MatchWaypoint
+from locintel.graphs.datamodel.jurbey import Node
+from locintel.graphs.processing.matching import HMMMatcher
+from locintel.harvest.matches import MATCHERS, LocalMatcher
+from locintel.routes.metrics.edges import matching_nodes
+
+import pytest
+
+from .fixtures_matching import LAT, add_edge, grid, trace
+
+
+class TestHMMMatcher:
+    def test_match(self, grid):
+        lats, lngs = trace(
+            (0.02, 0.1),
+            (0.01, 0.5),
+            (-0.02, 0.9),
+            (0.3, 1.02),
+            (0.7, 0.98),
+            (1.01, 1.3),
+            (0.98, 1.8),
+        )
+
+        response = HMMMatcher(grid).match(lats, lngs)
+
+        (matching,) = response["matchings"]
+        assert matching_nodes(matching) == [0, 1, 4, 5]
+        assert matching["distance"] == pytest.approx(0.9 * 101 + 111 + 0.8 * 101, abs=5)
+        assert matching["confidence"] > 0.5
+        assert [leg["traceFromIndex"] for leg in matching["legs"]] == list(range(6))
+        last = matching["legs"][-1]
+        assert last["nodes"] == [4, 5]
+        assert last["duration"] == pytest.approx(last["distance"] / 10)  # 36 km/h
+        assert [tp["waypoint_index"] for tp in response["tracepoints"]] == list(
+            range(7)
+        )
+        assert max(tp["snapDistance"] for tp in response["tracepoints"]) < 3
+
+    def test_match_direction(self, grid):
+        lats, lngs = trace((0.01, 1.6), (0, 1.2), (-0.01, 0.8), (0, 0.4))
+
+        response = HMMMatcher(grid).match(lats, lngs)
+
+        assert matching_nodes(response["matchings"][0]) == [2, 1, 0]
+
+    def test_match_geometry(self, grid):
+        lats, lngs = trace((0, 0.8), (-0.3, 1.5), (0, 1.9))
+
+        response = HMMMatcher(grid).match(lats, lngs, report_geometry=True)
+
+        geometry = [
+            point
+            for leg in response["matchings"][0]["legs"]
+            for point in leg["geometry"]
+        ]
+        assert {"lat": LAT + 0.0003, "lon": pytest.approx(13.40225)} in geometry
+        assert (
+            "geometry"
+            not in HMMMatcher(grid).match(lats, lngs)["matchings"][0]["legs"][0]
+        )
+
+    def test_unmatched_points_and_breaks(self, grid):
+        # disconnected road, 1km east
+        east = [
+            grid.add_node(Node(coord=GeoCoordinate(LAT - 0.001, 13.4 + lng)))
+            for lng in (0.015, 0.017)
+        ]
+        add_edge(grid, *east)
+        lats, lngs = trace((0, 0.2), (0.5, 0.5), (0, 0.6), (1, 10.5), (1, 11.5))
+
+        response = HMMMatcher(grid, radius=20).match(lats, lngs)
+
+        assert [matching_nodes(m) for m in response["matchings"]] == [[0, 1], east]
+        assert response["tracepoints"][1] is None
+        assert [tp["matchings_index"] for tp in response["tracepoints"] if tp] == [
+            0,
+            0,
+            1,
+            1,
+        ]
+
+    def test_no_match(self, grid):
+        response = HMMMatcher(grid).match(*trace((5, 5), (6, 6)))
+
+        assert response["code"] == "NoMatch"
+        assert response["matchings"] == []
+        assert response["tracepoints"] == [None, None]
+
+
+def match_plan(*positions):
+    return MatchPlan([MatchWaypoint(lat, lng) for lat, lng in zip(*trace(*positions))])
+
+
+class TestLocalMatcher:
+    def test_calculate(self, grid):
+        matcher = MATCHERS["local"](grid)
+
+        route = matcher.calculate(
+            match_plan((0, 0.1), (0, 0.9), (10, 10), (0.5, 1), (1, 1)),
+            report_geometry=True,
+        )
+
+        assert route.distance == pytest.approx(0.9 * 101 + 111, abs=5)
+        assert route.duration == pytest.approx(route.distance / (50 / 3.6))
+        assert len(route.geometry) == 7  # concatenated geometries of 3 legs
+        assert route.metadata["failed_points"] == 1
+        assert route.metadata["max_snap_distance"] < 1
+        assert route.metadata["raw"]["matchings"][0]["legs"][0]["nodes"] == [0, 1]
+
+    def test_calculate_no_match(self, grid):
+        with pytest.raises(ValueError):
+            LocalMatcher(grid).calculate(match_plan((5, 5), (6, 6)))
@@ -0,0 +1,125 @@
+from itertools import product
+from unittest.mock import Mock
+
+from locintel.core.datamodel.routing import RoutePlan, Waypoint
+from locintel.graphs.processing.routing import RoutingGraph
+from locintel.harvest import routes
+from locintel.harvest.routes import ROUTERS, calculate_competitive, set_local_graph
+
+import networkx as nx
+import pytest
+
+from .fixtures_matching import grid, grid_coord, trace
+
+
+def node_waypoint(node):
+    coord = grid_coord(node)
+    return coord.lat, coord.lng
+
+
+class TestRoutingGraph:
+    def test_route_between_nodes_is_fastest(self, grid):
+        routing_graph = RoutingGraph(grid)
+        durations = dict(zip(routing_graph.index.edges, routing_graph.durations))
+
+        for origin, destination in product(grid.nodes, repeat=2):
+            if origin == destination:
+                continue
+            route = routing_graph.route(
+                [node_waypoint(origin), node_waypoint(destination)]
+            )
+            expected = nx.dijkstra_path_length(
+                grid, origin, destination, weight=lambda u, v, d: durations[(u, v)]
+            )
+            assert route["duration"] == pytest.approx(expected)
+            assert route["nodes"][1] == origin or route["nodes"][0] == origin
+            assert destination in route["nodes"][-2:]
+
+    def test_route_one_way(self, grid):
+        routing_graph = RoutingGraph(grid)
+        lats, lngs = trace((1, 1.2), (1, 1.8))
+
+        forward = routing_graph.route(list(zip(lats, lngs)))
+        backward = routing_graph.route(list(zip(lats, lngs))[::-1])
+
+        assert forward["nodes"] == [4, 5]
+        assert forward["distance"] == pytest.approx(0.6 * 101, abs=1)
+        assert forward["duration"] == pytest.approx(forward["distance"] / 10)
+        # around the block, back onto one-way edge
+        assert backward["nodes"] == [4, 5, 8, 7, 4, 5]
+        assert backward["duration"] > forward["duration"]
+
+    def test_route_intermediate_waypoints(self, grid):
+        routing_graph = RoutingGraph(grid)
+        lats, lngs = trace((0, 0.4), (2, 0.4), (2, 1.5))
+
+        route = routing_graph.route(list(zip(lats, lngs)))
+
+        assert route["nodes"] == [1, 0, 3, 6, 7, 8]
+        assert route["distance"] == pytest.approx(
+            0.8 * 101 + 2 * 111 + 1.1 * 101, abs=2
+        )
+
+    def test_route_shortest(self, grid):
+        for edge in grid.edges:
+            grid.edges[edge]["speed"] = 100 if 4 not in edge else 10
+        routing_graph = RoutingGraph(grid)
+        waypoints = [node_waypoint(3), node_waypoint(5)]
+
+        fastest = routing_graph.route(waypoints)
+        shortest = routing_graph.route(waypoints, shortest=True)
+
+        assert 4 not in fastest["nodes"]
+        assert shortest["nodes"] == [3, 4, 5]
+        assert shortest["distance"] < fastest["distance"]
+        assert shortest["duration"] > fastest["duration"]
+
+    def test_route_errors(self, grid):
+        routing_graph = RoutingGraph(grid)
+
+        with pytest.raises(ValueError):
+            routing_graph.route([node_waypoint(0), (0, 0)])
+
+
+class TestLocalRouter:
+    def test_calculate(self, grid):
+        plan = RoutePlan(
+            Waypoint(*node_waypoint(0)),
+            Waypoint(*node_waypoint(8)),
+            [Waypoint(*node_waypoint(2))],
+        )
+
+        route = ROUTERS["local"](grid).calculate(plan)
+
+        assert route.metadata["nodes"] == [0, 1, 2, 5, 8]
+        assert route.distance == pytest.approx(
+            routes.LocalRouter(grid).calculate(plan).distance
+        )
+        assert route.geometry.to_lat_lng_tuples()[-1] == pytest.approx(node_waypoint(8))
+        assert route.duration == pytest.approx(route.distance / (50 / 3.6))
+
+    def test_calculate_competitive(self, grid):
+        set_local_graph(grid)
+        plan = RoutePlan(Waypoint(*node_waypoint(0)), Waypoint(*node_waypoint(4)))
+        try:
+            result = calculate_competitive(plan, ["local"])
+        finally:
+            set_local_graph(None)
+
+        assert result.routes["local"].metadata["nodes"] in ([0, 1, 4], [0, 3, 4])
+        with pytest.raises(ValueError):
+            ROUTERS["local"]()
+
+    def test_calculate_competitive_with_cache(self, grid):
+        set_local_graph(grid)
+        plan = RoutePlan(Waypoint(*node_waypoint(0)), Waypoint(*node_waypoint(4)))
+        cache = Mock()
+        try:
+            result = calculate_competitive(plan, ["local"], cache=cache)
+        finally:
+            set_local_graph(None)
+
+        assert result.routes["local"].metadata["nodes"] in ([0, 1, 4], [0, 3, 4])
+        assert not cache.mock_calls
+        with pytest.raises(TypeError):
+            routes.LocalRouter(grid, cache=cache)
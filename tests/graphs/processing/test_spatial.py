@@ -0,0 +1,43 @@
+from locintel.graphs.processing.spatial import EdgeIndex
+
+import numpy as np
+import pytest
+
+from .fixtures_matching import LAT, LNG, STEP_LNG, grid
+
+
+class TestEdgeIndex:
+    def test_nearest(self, grid):
+        index = EdgeIndex(grid, cell_size=30)
+
+        edges, offsets, distances = index.nearest(LAT - 0.0001, LNG + STEP_LNG / 4, 20)
+
+        assert {index.edges[e] for e in edges} == {(0, 1), (1, 0)}
+        assert distances == pytest.approx([11.1, 11.1], abs=0.1)
+        forward = offsets[[index.edges[e] for e in edges].index((0, 1))]
+        assert forward == pytest.approx(index.lengths[index.ids[(0, 1)]] / 4)
+
+    def test_nearest_closest_first(self, grid):
+        index = EdgeIndex(grid)
+
+        edges, _, distances = index.nearest(LAT - 0.0002, LNG + 0.0002, 50, 3)
+
+        assert len(edges) == 3
+        assert np.all(np.diff(distances) >= 0)
+        assert {index.edges[e] for e in edges[:2]} == {(0, 3), (3, 0)}
+
+    def test_nothing_within_radius(self, grid):
+        edges, offsets, distances = EdgeIndex(grid).nearest(LAT + 0.01, LNG, 50)
+
+        assert len(edges) == len(offsets) == len(distances) == 0
+
+    def test_curved_edge(self, grid):
+        index = EdgeIndex(grid)
+        edge = index.ids[(1, 2)]
+
+        lat, lng = index.locate(edge, index.lengths[edge] / 2)
+
+        assert (lat, lng) == pytest.approx((LAT + 0.0003, LNG + 1.5 * STEP_LNG))
+        assert index.lengths[edge] > 101
+        assert len(index.sub_geometry(edge)) == 3
+        assert len(index.sub_geometry(edge, 10, 20)) == 2
@@ -3,7 +3,7 @@ from itertools import chain, product
 from locintel.core.datamodel.geo import GeoCoordinate
 from locintel.graphs.datamodel.jurbey import Jurbey, Node
 
-from tests.synthetic.utils import (
+from .utils import (
     create_edge,
     no_geometry,
     simple_node_geometry,
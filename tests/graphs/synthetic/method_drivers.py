@@ -17,12 +17,16 @@ from locintel.graphs.datamodel.jurbey import Jurbey
 from locintel.graphs.adapters.osm import OsmAdapter
 from locintel.graphs.masks.apply.osm import ApplyMaskOsmMixin
 from locintel.graphs.masks.generate.matching import RouteMatchingMaskGenerator
-from locintel.services.matching import MapboxMatcher
+from locintel.graphs.processing.paths import PathsGenerator
+from locintel.harvest.matches import MATCHERS, MapboxMatcher
 
 from .setup_utils import start_routing_server, stop_container
 
 
 class BaseODDMethodDriver(object):
+    # whether the method relies on node ids shared by base and ODD graphs (so fails on transformed ODD graphs)
+    matches_by_id = False
+
     def __init__(self, name):
         self.name = name
 
@@ -50,6 +54,8 @@ class BaseODDMethodDriver(object):
 
 
 class SimpleGraphMatchingDriver(BaseODDMethodDriver):
+    matches_by_id = True
+
     def __init__(self):
         super().__init__("simple_graph_matching")
 
@@ -80,7 +86,7 @@ class SimpleGraphMatchingDriver(BaseODDMethodDriver):
 
 class RouteMatchingMethodDriver(BaseODDMethodDriver):
     """
-    Matches ODD graph geometries to matching service running on osm.pbf base map
+    Matches ODD graph geometries to matching service running on osm.pbf base map (needs Docker, see run_server.sh)
     """
 
     def __init__(
@@ -111,7 +117,9 @@ class RouteMatchingMethodDriver(BaseODDMethodDriver):
         """
         odd_graph = Jurbey.from_pickle(odd_artifact)
         graph_matcher = RouteMatchingMaskGenerator(
-            odd_graph, MapboxMatcher(endpoint=base_artifact), hd_mapping=False
+            odd_graph,
+            MapboxMatcher(endpoint=base_artifact),
+            paths_generator=EdgePathsGenerator,
         )
         mask = graph_matcher.generate()
         adapter = OsmAdapter(self.base_map_filename, processors=ApplyMaskOsmMixin)
@@ -129,3 +137,46 @@ class RouteMatchingMethodDriver(BaseODDMethodDriver):
             os.remove(self.odd_filename)
 
         stop_container()
+
+
+class EdgePathsGenerator(PathsGenerator):
+    """
+    Paths of graphs without HD lanes (such as the synthetic graphs), edges standing in for HD lane ids
+    """
+
+    @staticmethod
+    def _collect_hd_lanes(graph, path):
+        return list(path), []
+
+
+class LocalRouteMatchingMethodDriver(BaseODDMethodDriver):
+    """
+    Matches ODD graph geometries onto base graph with the local (HMM) matcher, no routing server needed
+    """
+
+    def __init__(self):
+        super().__init__("local_route_matching")
+
+    @staticmethod
+    def setup(base_graph, odd_graph):
+        return base_graph, odd_graph
+
+    @staticmethod
+    def apply(base_artifact, odd_artifact):
+        mask = RouteMatchingMaskGenerator(
+            odd_artifact,
+            MATCHERS["local"](base_artifact),
+            paths_generator=EdgePathsGenerator,
+        ).generate()
+        result = deepcopy(base_artifact)
+        result.remove_edges_from(
+            [edge for edge in base_artifact.edges if edge not in mask.edges]
+        )
+        result.remove_nodes_from(
+            [node for node in base_artifact.nodes if node not in mask.nodes]
+        )
+        return result
+
+    @staticmethod
+    def teardown(*arg, **kwargs):
+        return
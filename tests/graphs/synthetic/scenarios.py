@@ -25,12 +25,12 @@ from locintel.graphs.datamodel.jurbey import Node
 
 from allpairspy import AllPairs
 
-from tests.synthetic.graphs import (
+from .graphs import (
     urban_grid_no_geometry,
     urban_grid_node_geometry,
     urban_grid_node_and_edge_geometry,
 )
-from tests.synthetic.utils import (
+from .utils import (
     interpolated_geometry,
     create_edge,
     requires,
@@ -116,17 +116,21 @@ def split_edges(odd_graph):
 
 
 class GraphTestScenario(object):
-    def __init__(self, name, base_graph, expected_graph, input_graph):
+    def __init__(
+        self, name, base_graph, expected_graph, input_graph, transformation=None
+    ):
         """
         :param name: scenario name, as string
         :param base_graph: base graph to restrict and transform (acts as OSM reference graph)
         :param expected_graph: final graph correctly restricted to ODD
         :param input_graph: graph with restriction information which serves as input to the method
+        :param transformation: transformation applied to the ODD graph into input graph
         """
         self.name = name
         self.base_graph = base_graph
         self.expected_graph = expected_graph
         self.input_graph = input_graph
+        self.transformation = transformation
 
     def __repr__(self):
         return self.name
@@ -164,7 +168,9 @@ def generate_scenarios(
         odd_graph = restriction(base_graph)
         transformed_graph = transformation(odd_graph)
         name = f"{base_graph.metadata['version']}_{restriction.__name__}_{transformation.__name__}"
-        yield GraphTestScenario(name, base_graph, odd_graph, transformed_graph)
+        yield GraphTestScenario(
+            name, base_graph, odd_graph, transformed_graph, transformation
+        )
 
 
 odd_restrictions = [no_restrictions, remove_node, remove_edge]
@@ -14,18 +14,34 @@ of a base graph and an ODD graph. All scenarios are defined in `scenarios.py` -
 Methods are the odd generation methods to test against the scenarios. A function which applies the method is expected
 as well as a setup function, which prepares required artifacts and resources from the graphs generated in "scenarios".
 Methods to test and respective setups are enumerated defined in `method_drivers.py` - see module for instructions.
+
+Methods needing Docker (a local routing server) are marked `docker`, and only run with LOCINTEL_DOCKER_TESTS=1.
 """
 from itertools import product
+import os
 
 import pytest
 
-from tests.synthetic.method_drivers import (
+from .method_drivers import (
+    LocalRouteMatchingMethodDriver,
     SimpleGraphMatchingDriver,
     RouteMatchingMethodDriver,
 )
-from tests.synthetic.scenarios import scenarios
+from .scenarios import no_transformations, scenarios
+
+docker = [
+    pytest.mark.docker,
+    pytest.mark.skipif(
+        not os.environ.get("LOCINTEL_DOCKER_TESTS"),
+        reason="needs Docker, set LOCINTEL_DOCKER_TESTS=1 to run",
+    ),
+]
 
-methods = [RouteMatchingMethodDriver(), SimpleGraphMatchingDriver()]
+methods = [
+    (RouteMatchingMethodDriver(), docker),
+    (LocalRouteMatchingMethodDriver(), []),
+    (SimpleGraphMatchingDriver(), []),
+]
 
 
 @pytest.fixture
@@ -37,8 +53,25 @@ def run_test(method, scenario):
     method.teardown()
 
 
+def marks(method, method_marks, scenario):
+    if method.matches_by_id and scenario.transformation is not no_transformations:
+        return method_marks + [
+            pytest.mark.xfail(reason="method matches by node id", strict=True)
+        ]
+    return method_marks
+
+
 @pytest.mark.parametrize(
-    "method, scenario", list(product(methods, scenarios)), ids=lambda x: x.name
+    "method, scenario",
+    [
+        pytest.param(
+            method,
+            scenario,
+            marks=marks(method, method_marks, scenario),
+            id=f"{method.name}-{scenario.name}",
+        )
+        for (method, method_marks), scenario in product(methods, scenarios)
+    ],
 )
 def test_odd_generation(method, scenario, run_test):
     resulting_graph = run_test
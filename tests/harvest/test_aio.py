@@ -0,0 +1,295 @@
+import asyncio
+from contextlib import asynccontextmanager
+import threading
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+from locintel.core.datamodel.matching import MatchPlan, MatchWaypoint
+from locintel.core.datamodel.routing import Route, RoutePlan, Waypoint
+from locintel.harvest.aio import (
+    AsyncGoogleRouter,
+    AsyncMapboxMatcher,
+    AsyncMapboxRouter,
+    ASYNC_ROUTERS,
+)
+from locintel.harvest.cache import ResponseCache
+
+mapbox_response = {
+    "routes": [
+        {
+            "legs": [{"geometry": [{"lat": 10, "lon": 20}, {"lat": 15, "lon": 25}]}],
+            "totalDistance": 100,
+            "totalDuration": 50,
+        }
+    ]
+}
+
+match_response = {
+    "matchings": [
+        {
+            "confidence": 0.9,
+            "legs": [
+                {
+                    "duration": 7.3,
+                    "distance": 91.1,
+                    "geometry": [{"lat": 0, "lon": 1}, {"lat": 2, "lon": 3}],
+                }
+            ],
+        }
+    ],
+    "tracepoints": [{"snapDistance": 1}, {}],
+}
+
+route_plans = [RoutePlan(Waypoint(10, i), Waypoint(15, 25)) for i in range(20)]
+
+
+@asynccontextmanager
+async def serve(handler, path="/{tail:.*}"):
+    app = web.Application()
+    app.router.add_route("*", path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+class TestAsyncMapboxRouter(object):
+    def test_calculate_many(self):
+        state = {"in_flight": 0, "max_in_flight": 0, "requests": []}
+
+        async def handler(request):
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            state["requests"].append(await request.json())
+            await asyncio.sleep(0.01)
+            state["in_flight"] -= 1
+            response = dict(mapbox_response)
+            response["routes"] = [
+                dict(
+                    mapbox_response["routes"][0],
+                    totalDistance=float(request.query["i"]),
+                )
+            ]
+            return web.json_response(response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter(endpoint=host + "/{vehicle_type}")
+                router._generate_url = lambda plan: f"{host}/car?i={plan.start.lng}"
+                return await router.calculate_many(route_plans, concurrency=5)
+
+        result = asyncio.run(run())
+
+        assert all(isinstance(route, Route) for route in result)
+        assert [route.distance for route in result] == list(range(20))
+        assert state["max_in_flight"] == 5
+        assert state["requests"][0] == AsyncMapboxRouter._generate_payload(
+            route_plans[0]
+        )
+        assert result[0].metadata["calc_time"] > 0
+
+    def test_calculate_without_session(self):
+        async def handler(request):
+            assert request.path == "/car-traffic"
+            return web.json_response(mapbox_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = ASYNC_ROUTERS["mapbox-traffic"](
+                    endpoint=host + "/{vehicle_type}"
+                )
+                return await router.calculate(route_plans[0])
+
+        result = asyncio.run(run())
+
+        assert result.distance == 100
+        assert result.duration == 50
+
+    def test_retries_on_throttling(self):
+        attempts = []
+
+        async def handler(request):
+            attempts.append(request)
+            if len(attempts) < 3:
+                return web.Response(status=429, headers={"Retry-After": "0"})
+            return web.json_response(mapbox_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter(endpoint=host + "/{vehicle_type}")
+                return await router.calculate(route_plans[0])
+
+        result = asyncio.run(run())
+
+        assert len(attempts) == 3
+        assert result.distance == 100
+
+    def test_limiter_is_reserved_off_event_loop(self):
+        threads = []
+
+        class ThreadRecordingLimiter(object):
+            def reserve(self):
+                threads.append(threading.current_thread())
+                return 0
+
+        async def handler(request):
+            return web.json_response(mapbox_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter(
+                    endpoint=host + "/{vehicle_type}", limiter=ThreadRecordingLimiter()
+                )
+                return await router.calculate(route_plans[0])
+
+        asyncio.run(run())
+
+        assert len(threads) == 1
+        assert threading.main_thread() not in threads
+
+    def test_raises_when_retries_exhausted(self):
+        async def handler(request):
+            return web.Response(status=503)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter(
+                    endpoint=host + "/{vehicle_type}", retries=1, backoff_factor=0
+                )
+                return await router.calculate(route_plans[0])
+
+        with pytest.raises(aiohttp.ClientResponseError):
+            asyncio.run(run())
+
+    def test_calculate_many_return_exceptions(self):
+        async def handler(request):
+            if request.query["i"] == "1":
+                return web.Response(status=400)
+            return web.json_response(mapbox_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter()
+                router._generate_url = lambda plan: f"{host}/car?i={plan.start.lng}"
+                return await router.calculate_many(
+                    route_plans[:3], concurrency=2, return_exceptions=True
+                )
+
+        result = asyncio.run(run())
+
+        assert isinstance(result[0], Route)
+        assert isinstance(result[1], aiohttp.ClientResponseError)
+        assert isinstance(result[2], Route)
+
+
+class TestAsyncGoogleRouter(object):
+    def test_calculate(self):
+        google_response = {
+            "routes": [
+                {
+                    "overview_polyline": {"points": "_c`|@_gayB_qo]_qo]"},
+                    "legs": [{"distance": {"value": 100}, "duration": {"value": 50}}],
+                }
+            ]
+        }
+
+        async def handler(request):
+            assert request.method == "GET"
+            assert request.query["origin"] == "10,0"
+            assert request.query["key"] == "key"
+            return web.json_response(google_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncGoogleRouter(endpoint=host + "/?", key="key")
+                return await router.calculate_many(route_plans[:1])
+
+        result = asyncio.run(run())
+
+        assert result[0].distance == 100
+        assert not result[0].geometry.is_decoded
+        assert result[0].geometry.to_lat_lng_tuples() == ((10, 20), (15, 25))
+
+
+class TestAsyncMapboxMatcher(object):
+    def test_calculate_many(self):
+        async def handler(request):
+            assert request.headers["Content-Type"] == "application/json"
+            assert await request.json() == {
+                "locations": [{"lat": 1, "lng": 2}, {"lat": 3, "lng": 4}],
+                "timestamps": [1, 2],
+            }
+            return web.json_response(match_response)
+
+        plan = MatchPlan([MatchWaypoint(1, 2, time=1), MatchWaypoint(3, 4, time=2)])
+
+        async def run():
+            async with serve(handler) as host:
+                return await AsyncMapboxMatcher(endpoint=host).calculate_many(
+                    [plan, plan]
+                )
+
+        result = asyncio.run(run())
+
+        assert [route.distance for route in result] == [91.1, 91.1]
+        assert not result[0].geometry.is_decoded
+        assert result[0].geometry.to_lat_lng_tuples() == ((0, 1), (2, 3))
+        assert result[0].metadata["confidence"] == 0.9
+
+
+class TestAsyncCache(object):
+    def test_calculate_many_reuses_cached_responses(self, tmp_path):
+        requests = []
+
+        async def handler(request):
+            requests.append(request)
+            return web.json_response(mapbox_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter(
+                    endpoint=host + "/{vehicle_type}",
+                    cache=ResponseCache(str(tmp_path / "cache.sqlite")),
+                )
+                await router.calculate_many(route_plans[:3])
+                return await router.calculate_many(route_plans[:4])
+
+        result = asyncio.run(run())
+
+        assert len(requests) == 4
+        assert [route.distance for route in result] == [100] * 4
+
+    def test_cache_is_accessed_off_event_loop(self, tmp_path):
+        threads = []
+
+        class ThreadRecordingCache(ResponseCache):
+            def lookup(self, key):
+                threads.append(threading.current_thread())
+                return super().lookup(key)
+
+            def set(self, key, response, calc_time=None):
+                threads.append(threading.current_thread())
+                super().set(key, response, calc_time)
+
+        async def handler(request):
+            return web.json_response(mapbox_response)
+
+        async def run():
+            async with serve(handler) as host:
+                router = AsyncMapboxRouter(
+                    endpoint=host + "/{vehicle_type}",
+                    cache=ThreadRecordingCache(str(tmp_path / "cache.sqlite")),
+                )
+                return await router.calculate(route_plans[0])
+
+        asyncio.run(run())
+
+        assert len(threads) == 2
+        assert threading.main_thread() not in threads
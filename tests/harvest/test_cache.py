@@ -0,0 +1,320 @@
+from datetime import timedelta
+import json
+import pickle
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.routing import Route, RoutePlan, Waypoint
+from locintel.core.datamodel.geo import Geometry
+from locintel.harvest.cache import (
+    ApproximateRouter,
+    CacheMiss,
+    ResponseCache,
+    SpatialRouteCache,
+    fetch,
+)
+from locintel.harvest.routes import MapboxRouter, calculate_competitive
+
+mapbox_response = {
+    "routes": [
+        {
+            "legs": [{"geometry": [{"lat": 10, "lon": 20}, {"lat": 15, "lon": 25}]}],
+            "totalDistance": 100,
+            "totalDuration": 50,
+        }
+    ]
+}
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "cache.sqlite"))
+
+
+def mock_session(response=None):
+    session = Mock()
+    session.request.return_value.elapsed = timedelta(microseconds=500000)
+    session.request.return_value.request.body = b"{}"
+    session.request.return_value.content = json.dumps(response or {"a": 1}).encode()
+    return session
+
+
+class TestResponseCache(object):
+    def test_key_is_canonical(self):
+        assert ResponseCache.key("post", "url", {"a": 1, "b": 2}) == ResponseCache.key(
+            "POST", "url", {"b": 2, "a": 1}
+        )
+        assert ResponseCache.key("POST", "url", {"a": 1}) != ResponseCache.key(
+            "POST", "url", {"a": 2}
+        )
+        assert ResponseCache.key("POST", "url") != ResponseCache.key("GET", "url")
+
+    def test_set_and_get(self, cache):
+        cache.set("key", {"a": [1, 2]}, 0.5)
+
+        assert cache.get("key") == ({"a": [1, 2]}, 0.5)
+        assert "key" in cache
+        assert len(cache) == 1
+
+    def test_get_missing_key(self, cache):
+        assert cache.get("key") is None
+
+    def test_ttl(self, cache, mocker):
+        cache.ttl = 10
+        time = mocker.patch("locintel.harvest.cache.time.time", return_value=100)
+        cache.set("key", {})
+
+        time.return_value = 105
+        assert cache.get("key") == ({}, None)
+
+        time.return_value = 111
+        assert cache.get("key") is None
+        assert len(cache) == 0
+
+    def test_purge(self, cache, mocker):
+        cache.ttl = 10
+        time = mocker.patch("locintel.harvest.cache.time.time", return_value=100)
+        cache.set("old", {})
+        time.return_value = 105
+        cache.set("new", {})
+
+        time.return_value = 112
+        cache.purge()
+
+        assert "old" not in cache
+        assert "new" in cache
+
+    def test_lru_eviction(self, cache, mocker):
+        time = mocker.patch("locintel.harvest.cache.time.time", return_value=0)
+        for i, key in enumerate(["a", "b", "c"]):
+            time.return_value = i
+            cache.set(key, {"payload": "x" * 100})
+        time.return_value = 3
+        cache.get("a")  # a is now most recently used
+        cache.max_size = cache.size() - 1
+
+        time.return_value = 4
+        cache.set("d", {"payload": "x" * 100})
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" not in cache
+        assert "d" in cache
+        assert cache.size() <= cache.max_size
+
+    def test_lru_eviction_in_batches(self, cache):
+        cache.max_size = 10000
+        for i in range(100):
+            cache.set(str(i), {"payload": str(i) * 500})
+        size = cache.size()
+
+        assert size <= cache.max_size
+        cache.set("next", {"payload": "next"})
+        assert cache.size() > size  # below max_size again, nothing evicted
+
+    def test_size_is_kept_up_to_date(self, cache):
+        def total():
+            connection = cache._get_connection()
+            return connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+        cache.set("a", {"payload": "a"})
+        cache.set("b", {"payload": "b" * 100})
+        cache.set("a", {"payload": "a" * 1000})
+        assert cache.size() == total() > 0
+
+        cache.delete("b")
+        assert cache.size() == total()
+
+        cache.clear()
+        assert cache.size() == total() == 0
+
+    def test_size_of_database_without_stats(self, cache):
+        cache.set("a", {"payload": "a"})
+        size = cache.size()
+        with cache._get_connection() as connection:
+            connection.execute("DROP TABLE stats")
+
+        reopened = ResponseCache(cache.path)
+
+        assert reopened.size() == size
+
+    def test_replay_raises_cache_miss(self, cache):
+        cache.replay = True
+
+        with pytest.raises(CacheMiss):
+            cache.lookup("key")
+
+    def test_persistence_and_pickling(self, cache):
+        cache.set("key", {"a": 1})
+
+        assert ResponseCache(cache.path).get("key") == ({"a": 1}, None)
+        assert pickle.loads(pickle.dumps(cache)).get("key") == ({"a": 1}, None)
+
+
+class TestFetch(object):
+    def test_fetch_without_cache(self):
+        session = mock_session()
+
+        data, timing, response = fetch(session, "POST", "url", json={"b": 1})
+
+        assert data == {"a": 1}
+        assert response is session.request.return_value
+        assert timing["calc_time"] == 0.5
+        assert timing["ttfb"] is None  # mocked session, no timed connection
+        assert timing["request_size"] == 2
+        assert timing["response_size"] == len(json.dumps({"a": 1}))
+        assert timing["total"] >= 0
+        session.request.return_value.raise_for_status.assert_called_once()
+
+    def test_fetch_stores_and_reuses_response(self, cache):
+        session = mock_session()
+
+        fetch(session, "POST", "url", cache=cache, json={"b": 1}, auth=("u", "p"))
+        result = fetch(session, "POST", "url", cache=cache, json={"b": 1})
+
+        assert result == ({"a": 1}, {"calc_time": 0.5, "cached": True}, None)
+        session.request.assert_called_once()
+
+    def test_fetch_does_not_cache_failures(self, cache):
+        session = mock_session()
+        session.request.return_value.raise_for_status.side_effect = ValueError
+
+        with pytest.raises(ValueError):
+            fetch(session, "GET", "url", cache=cache)
+
+        assert len(cache) == 0
+
+
+class TestRouterCache(object):
+    def test_replay_rebuilds_route_offline(self, cache):
+        route_plan = RoutePlan(Waypoint(10, 20), Waypoint(15, 25))
+        session = mock_session(mapbox_response)
+        MapboxRouter(
+            endpoint="url/{vehicle_type}", session=session, cache=cache
+        ).calculate(route_plan)
+        offline = Mock()
+        cache.replay = True
+
+        route = MapboxRouter(
+            endpoint="url/{vehicle_type}", session=offline, cache=cache
+        ).calculate(route_plan)
+
+        assert isinstance(route, Route)
+        assert route.distance == 100
+        assert route.metadata["calc_time"] == 0.5
+        offline.request.assert_not_called()
+
+        with pytest.raises(CacheMiss):
+            MapboxRouter(
+                endpoint="url/{vehicle_type}", session=offline, cache=cache
+            ).calculate(RoutePlan(Waypoint(0, 0), Waypoint(1, 1)))
+
+
+def plan(lat1, lng1, lat2, lng2, **kwargs):
+    return RoutePlan(Waypoint(lat1, lng1), Waypoint(lat2, lng2), **kwargs)
+
+
+route = Route(Geometry.dummy(), 100, 50, metadata={"calc_time": 1})
+meters = 1 / 111320
+
+
+class TestSpatialRouteCache(object):
+    def test_hit_within_radius(self):
+        cache = SpatialRouteCache(radius=50)
+        cache.set(plan(52.5, 13.4, 52.6, 13.5), route)
+
+        result = cache.get(plan(52.5 + 30 * meters, 13.4, 52.6, 13.5 + 20 * meters))
+
+        assert result.distance == 100
+        assert result.metadata["approximate"]
+        assert 29 < result.metadata["approximate_offset"] < 31
+        assert "approximate" not in route.metadata
+
+    def test_miss_beyond_radius(self):
+        cache = SpatialRouteCache(radius=50)
+        cache.set(plan(52.5, 13.4, 52.6, 13.5), route)
+
+        assert cache.get(plan(52.5, 13.4, 52.6 + 60 * meters, 13.5)) is None
+
+    def test_hit_across_cell_border(self):
+        cache = SpatialRouteCache(radius=50)
+        lat = 2 * cache.cell_degrees  # exactly on a row border
+        cache.set(plan(lat - 10 * meters, 13.4, 52.6, 13.5), route)
+
+        assert cache.get(plan(lat + 10 * meters, 13.4, 52.6, 13.5)) is not None
+
+    def test_returns_closest_route(self):
+        cache = SpatialRouteCache(radius=50)
+        far = Route(Geometry.dummy(), 200, 50)
+        cache.set(plan(52.5 + 40 * meters, 13.4, 52.6, 13.5), far)
+        cache.set(plan(52.5 + 10 * meters, 13.4, 52.6, 13.5), route)
+
+        assert cache.get(plan(52.5, 13.4, 52.6, 13.5)).distance == 100
+
+    def test_vehicle_strategy_and_provider_must_match(self):
+        cache = SpatialRouteCache(radius=50)
+        cache.set(plan(52.5, 13.4, 52.6, 13.5), route, provider="mapbox")
+
+        assert cache.get(plan(52.5, 13.4, 52.6, 13.5, vehicle="BIKE"), "mapbox") is None
+        assert (
+            cache.get(plan(52.5, 13.4, 52.6, 13.5, strategy="SHORTEST"), "mapbox")
+            is None
+        )
+        assert cache.get(plan(52.5, 13.4, 52.6, 13.5), "google") is None
+        assert cache.get(plan(52.5, 13.4, 52.6, 13.5), "mapbox") is not None
+
+    def test_waypoint_count_must_match(self):
+        cache = SpatialRouteCache(radius=50)
+        cache.set(plan(52.5, 13.4, 52.6, 13.5), route)
+        with_via = RoutePlan(
+            Waypoint(52.5, 13.4),
+            Waypoint(52.6, 13.5),
+            intermediate_waypoints=[Waypoint(52.55, 13.45)],
+        )
+
+        assert cache.get(with_via) is None
+
+    def test_stats(self):
+        cache = SpatialRouteCache()
+        cache.set(plan(52.5, 13.4, 52.6, 13.5), route)
+        cache.get(plan(52.5, 13.4, 52.6, 13.5))
+        cache.get(plan(40, 13.4, 52.6, 13.5))
+        cache.get(plan(52.5, 13.4, 52.6, 13.5))
+
+        assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3, "size": 1}
+
+
+class TestApproximateRouter(object):
+    def test_calculate(self):
+        router = Mock()
+        router.name = "mapbox"
+        router.calculate.return_value = route
+        approximate = ApproximateRouter(router, SpatialRouteCache())
+
+        first = approximate.calculate(plan(52.5, 13.4, 52.6, 13.5))
+        second = approximate.calculate(plan(52.5 + 5 * meters, 13.4, 52.6, 13.5))
+
+        assert first is route
+        assert second.metadata["approximate"]
+        router.calculate.assert_called_once()
+
+    def test_calculate_competitive(self, mocker):
+        router = Mock()
+        router.return_value.name = "mapbox"
+        router.return_value.calculate.return_value = route
+        mocker.patch.dict("locintel.harvest.routes.ROUTERS", {"mapbox": router})
+        cache = SpatialRouteCache()
+
+        calculate_competitive(
+            plan(52.5, 13.4, 52.6, 13.5), ["mapbox"], spatial_cache=cache
+        )
+        result = calculate_competitive(
+            plan(52.5, 13.4 + 5 * meters, 52.6, 13.5), ["mapbox"], spatial_cache=cache
+        )
+
+        assert result.routes["mapbox"].metadata["approximate"]
+        assert cache.hits == 1
+        router.return_value.calculate.assert_called_once()
@@ -0,0 +1,239 @@
+import asyncio
+from datetime import timedelta
+import json
+import threading
+
+from aiohttp import web
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.matching import MatchPlan, MatchWaypoint
+from locintel.harvest.aio import AsyncMapboxMatcher
+from locintel.harvest.matches import (
+    MAX_POINTS,
+    MapboxMatcher,
+    chunk_windows,
+    merge_timings,
+    stitch_match_responses,
+)
+from locintel.routes.metrics.edges import match_to_edges
+
+from .test_aio import serve
+
+
+def match_response(indexes, confidence=0.9, failed=()):
+    """
+    Response matching trace points of given (global) indexes to nodes of same id, one meter apart, with trace indexes
+    relative to first point
+    """
+    tracepoints = [
+        {} if index in failed else {"snapDistance": index % 5} for index in indexes
+    ]
+    matchings, legs = list(), list()
+    for i, (a, b) in enumerate(zip(indexes, indexes[1:])):
+        if a in failed or b in failed:
+            if legs:
+                matchings.append({"confidence": confidence, "legs": legs})
+            legs = list()
+            continue
+        legs.append(
+            {
+                "traceFromIndex": i,
+                "traceToIndex": i + 1,
+                "distance": 1.0,
+                "duration": 0.5,
+                "nodes": [a, b],
+                "geometry": [{"lat": a / 1000, "lon": 0}, {"lat": b / 1000, "lon": 0}],
+            }
+        )
+    if legs:
+        matchings.append({"confidence": confidence, "legs": legs})
+    return {"code": "Ok", "matchings": matchings, "tracepoints": tracepoints}
+
+
+def window_responses(windows, **kwargs):
+    return [match_response(list(range(start, end)), **kwargs) for start, end in windows]
+
+
+def match_plan(n):
+    return MatchPlan(
+        [MatchWaypoint(i / 1000, 0, time=1600000000 + i) for i in range(n)]
+    )
+
+
+class TestChunkWindows(object):
+    def test_short_trace_single_window(self):
+        assert chunk_windows(100, 100, 10) == [(0, 100)]
+        assert chunk_windows(500, None, 10) == [(0, 500)]
+
+    def test_windows_overlap(self):
+        assert chunk_windows(250, 100, 10) == [(0, 100), (90, 190), (150, 250)]
+
+
+class TestStitchMatchResponses(object):
+    def test_stitched_as_single_response(self):
+        windows = chunk_windows(250, 100, 10)
+
+        stitched = stitch_match_responses(window_responses(windows), windows)
+
+        expected = dict(match_response(list(range(250))), matchNumber=1)
+        assert stitched["matchings"][0].pop("confidence") == pytest.approx(0.9)
+        expected["matchings"][0].pop("confidence")
+        assert stitched == expected
+
+    def test_edges_counted_once(self):
+        windows = chunk_windows(250, 100, 10)
+
+        stitched = stitch_match_responses(window_responses(windows), windows)
+
+        edges = match_to_edges(Mock(metadata={"raw": stitched}))
+        assert edges == list(zip(range(249), range(1, 250)))
+
+    def test_gap_starts_new_matching(self):
+        windows = chunk_windows(250, 100, 10)
+
+        stitched = stitch_match_responses(
+            window_responses(windows, failed={20, 120}), windows
+        )
+
+        assert [
+            (m["legs"][0]["traceFromIndex"], m["legs"][-1]["traceToIndex"])
+            for m in stitched["matchings"]
+        ] == [(0, 19), (21, 119), (121, 249)]
+        assert len(stitched["tracepoints"]) == 250
+        assert [i for i, t in enumerate(stitched["tracepoints"]) if not t] == [20, 120]
+
+    def test_window_without_match(self):
+        windows = chunk_windows(250, 100, 10)
+        responses = window_responses(windows)
+        responses[1] = {"code": "NoMatch", "message": "Could not match the trace."}
+
+        stitched = stitch_match_responses(responses, windows)
+
+        assert stitched["code"] == "Ok"
+        assert [
+            (m["legs"][0]["traceFromIndex"], m["legs"][-1]["traceToIndex"])
+            for m in stitched["matchings"]
+        ] == [(0, 95), (170, 249)]
+        assert len(stitched["tracepoints"]) == 250
+        assert stitched["tracepoints"][95:170] == [None] * 75
+
+    def test_confidence_weighted_by_distance(self):
+        windows = [(0, 10), (5, 25)]
+        responses = [
+            match_response(list(range(10)), confidence=0.2),
+            match_response(list(range(5, 25)), confidence=0.8),
+        ]
+
+        stitched = stitch_match_responses(responses, windows)
+
+        # 7 legs (0 -> 7) from first window, 17 legs (7 -> 24) from second one
+        assert stitched["matchings"][0]["confidence"] == pytest.approx(
+            (7 * 0.2 + 17 * 0.8) / 24
+        )
+
+
+class TestMergeTimings(object):
+    def test_merge(self):
+        merged = merge_timings(
+            [
+                {"calc_time": 1, "total": 1.5, "response_size": 10},
+                {"calc_time": 2, "total": 2.5, "response_size": 20},
+            ]
+        )
+
+        assert merged == {
+            "calc_time": 2,
+            "total": 2.5,
+            "response_size": 30,
+            "requests": 2,
+        }
+        assert merge_timings([{"calc_time": 1, "cached": True}] * 2)["cached"]
+
+
+class TestMapboxMatcher(object):
+    def test_invalid_overlap_raises_value_error(self):
+        with pytest.raises(ValueError):
+            MapboxMatcher(max_points=10, overlap=9)
+
+    def test_long_plan_requested_in_windows(self):
+        requests = list()
+        lock = threading.Lock()
+
+        def request(method, url, **kwargs):
+            locations = kwargs["json"]["locations"]
+            indexes = [round(location["lat"] * 1000) for location in locations]
+            with lock:
+                requests.append(indexes)
+            response = Mock(status_code=200, elapsed=timedelta(microseconds=1000))
+            response.request.body = b"{}"
+            response.content = json.dumps(
+                match_response(indexes, failed={130})
+            ).encode()
+            return response
+
+        session = Mock()
+        session.request.side_effect = request
+        matcher = MapboxMatcher(session=session, max_points=100, overlap=10)
+
+        route = matcher.calculate(match_plan(250))
+
+        assert sorted(r[0] for r in requests) == [0, 90, 150]
+        assert route.distance == 129
+        assert route.metadata["failed_points"] == 1
+        assert route.metadata["timing"]["requests"] == 3
+        assert len(route.geometry) == 2 * 129
+
+    def test_short_plan_single_request(self):
+        session = Mock()
+        response = session.request.return_value
+        response.status_code = 200
+        response.elapsed = timedelta(microseconds=1000)
+        response.request.body = b"{}"
+        response.content = json.dumps(match_response(list(range(5)))).encode()
+        matcher = MapboxMatcher(session=session)
+
+        route = matcher.calculate(match_plan(5))
+
+        session.request.assert_called_once()
+        assert route.distance == 4
+        assert "requests" not in route.metadata["timing"]
+
+    def test_long_plan_not_split_by_default(self):
+        session = Mock()
+        response = session.request.return_value
+        response.status_code = 200
+        response.elapsed = timedelta(microseconds=1000)
+        response.request.body = b"{}"
+        response.content = json.dumps(match_response(list(range(250)))).encode()
+
+        route = MapboxMatcher(session=session).calculate(match_plan(250))
+
+        session.request.assert_called_once()
+        assert route.distance == 249
+
+
+class TestAsyncMapboxMatcher(object):
+    def test_long_plan_requested_concurrently(self):
+        state = {"in_flight": 0, "max_in_flight": 0}
+
+        async def handler(request):
+            locations = (await request.json())["locations"]
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            await asyncio.sleep(0.05)
+            state["in_flight"] -= 1
+            indexes = [round(location["lat"] * 1000) for location in locations]
+            return web.json_response(match_response(indexes))
+
+        async def run():
+            async with serve(handler) as host:
+                return await AsyncMapboxMatcher(
+                    endpoint=host, max_points=MAX_POINTS
+                ).calculate(match_plan(250))
+
+        route = asyncio.run(run())
+
+        assert state["max_in_flight"] == 3
+        assert route.distance == 249
+        assert route.metadata["raw"]["matchNumber"] == 1
@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.geo import Geometry
+from locintel.core.datamodel.routing import Route, RoutePlan, Waypoint
+from locintel.harvest import routes
+from locintel.harvest.routes import LatencyTracker, calculate_competitive
+
+route_plan = RoutePlan(Waypoint(10, 20), Waypoint(15, 25))
+
+
+def fake_router(name, delays, calls=None):
+    """
+    Router class answering after given delays (one per call, last one repeated), or raising exceptions
+    """
+
+    class FakeRouter(object):
+        def __init__(self, **kwargs):
+            self.name = name
+
+        def calculate(self, route_plan):
+            with lock:
+                index = len(calls)
+                calls.append(time.monotonic())
+            delay = delays[min(index, len(delays) - 1)]
+            if isinstance(delay, Exception):
+                raise delay
+            time.sleep(delay)
+            return Route(Geometry.dummy(), index, 1, metadata={"provider": name})
+
+    lock = threading.Lock()
+    calls = calls if calls is not None else []
+    FakeRouter.calls = calls
+    return FakeRouter
+
+
+@pytest.fixture()
+def routers(mocker):
+    mocker.patch.dict(routes.ROUTERS, clear=True)
+    return routes.ROUTERS
+
+
+@pytest.fixture()
+def latencies(mocker):
+    return mocker.patch("locintel.harvest.routes.latencies", LatencyTracker())
+
+
+class TestCalculateCompetitive(object):
+    def test_providers_are_queried_concurrently(self, routers, latencies):
+        routers.update(
+            {p: fake_router(p, [0.2]) for p in ["a", "b", "c"]},
+        )
+        start = time.monotonic()
+
+        result = calculate_competitive(route_plan, ["a", "b", "c"])
+
+        assert time.monotonic() - start < 0.5
+        assert list(result.routes) == ["a", "b", "c"]
+        assert len(latencies.latencies["a"]) == 1
+
+    def test_metrics_order_and_names(self, routers, latencies):
+        routers.update({p: fake_router(p, [d]) for p, d in zip("abc", [0.1, 0, 0.05])})
+        comparator = Mock(return_value=1)
+        comparator.name = "score"
+
+        result = calculate_competitive(route_plan, ["a", "b", "c"], [comparator])
+
+        assert list(result.metrics) == ["score_a_vs_b", "score_a_vs_c", "score_b_vs_c"]
+        assert comparator.call_count == 3
+
+    def test_comparators_run_as_soon_as_pair_available(self, routers, latencies):
+        routers.update(
+            {
+                "a": fake_router("a", [0]),
+                "b": fake_router("b", [0]),
+                "c": fake_router("c", [0.3]),
+            }
+        )
+        compared_at = dict()
+
+        def comparator(geometry1, geometry2):
+            compared_at[len(compared_at)] = time.monotonic()
+            return 0
+
+        start = time.monotonic()
+        calculate_competitive(route_plan, ["a", "b", "c"], [comparator])
+
+        assert compared_at[0] - start < 0.2
+
+    def test_deadline_drops_late_provider(self, routers, latencies):
+        routers.update({"a": fake_router("a", [0]), "b": fake_router("b", [1])})
+        comparator = Mock(return_value=1)
+        comparator.name = "score"
+        start = time.monotonic()
+
+        result = calculate_competitive(
+            route_plan, ["a", "b"], [comparator], deadlines={"b": 0.1}
+        )
+
+        assert time.monotonic() - start < 0.5
+        assert list(result.routes) == ["a"]
+        assert result.timed_out == ["b"]
+        assert result.metrics == {}
+
+    def test_requests_share_executor(self, routers, latencies):
+        routers.update({"a": fake_router("a", [0]), "b": fake_router("b", [0.3])})
+        executor = routes._get_executor()
+
+        calculate_competitive(route_plan, ["a", "b"], deadlines=0.05)
+        calculate_competitive(route_plan, ["a", "b"], deadlines=0.05)
+
+        assert routes._get_executor() is executor
+        assert len(executor._threads) <= routes.COMPETITIVE_WORKERS
+
+    def test_errors_are_raised(self, routers, latencies):
+        routers.update(
+            {"a": fake_router("a", [0]), "b": fake_router("b", [ValueError()])}
+        )
+
+        with pytest.raises(ValueError):
+            calculate_competitive(route_plan, ["a", "b"])
+
+    def test_hedged_request_after_p95(self, routers, latencies):
+        routers["a"] = fake_router("a", [1, 0.01])
+        for _ in range(20):
+            latencies.record("a", 0.05)
+        start = time.monotonic()
+
+        result = calculate_competitive(route_plan, ["a"], hedge=True)
+
+        assert time.monotonic() - start < 0.5
+        assert result.routes["a"].distance == 1  # answer from hedged (second) request
+        assert len(routers["a"].calls) == 2
+        assert routers["a"].calls[1] - start >= 0.05
+
+    def test_no_hedge_without_latency_history(self, routers, latencies):
+        routers["a"] = fake_router("a", [0.1])
+
+        calculate_competitive(route_plan, ["a"], hedge=True)
+
+        assert len(routers["a"].calls) == 1
+
+
+class TestLatencyTracker(object):
+    def test_percentile(self):
+        tracker = LatencyTracker(window=100, min_samples=10)
+        for latency in range(200):
+            tracker.record("a", latency)
+
+        assert tracker.percentile("a", 50) == pytest.approx(149.5)
+        assert tracker.percentile("b") is None
+
+
+class TestRunExperiment(object):
+    def test_adaptive_enables_provider_controllers(self, routers, latencies, mocker):
+        mocker.patch.dict("locintel.harvest.concurrency.CONCURRENCY_LIMITS", clear=True)
+        mocker.patch.dict(routes.PROVIDER_NAMES, {"a": "provider-a"})
+        enable = mocker.spy(routes, "set_adaptive_concurrency")
+        routers.update({"a": fake_router("provider-a", [0.01])})
+
+        result = routes.run_experiment(["a"], [route_plan] * 5, jobs=4, adaptive=True)
+
+        assert len(result.tests) == 5
+        enable.assert_called_once_with("provider-a", maximum=4)
+        assert routes.CONCURRENCY_LIMITS == {}
+
+    def test_adaptive_does_not_create_routers(self, mocker):
+        mocker.patch.dict("locintel.harvest.concurrency.CONCURRENCY_LIMITS", clear=True)
+        mocker.patch.object(routes, "_local_graph", None)
+        enable = mocker.spy(routes, "set_adaptive_concurrency")
+
+        result = routes.run_experiment(["local"], [], jobs=2, adaptive=True)
+
+        assert result.tests == []
+        enable.assert_called_once_with("local", maximum=2)
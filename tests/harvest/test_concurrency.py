@@ -0,0 +1,182 @@
+from datetime import timedelta
+import threading
+
+import pytest
+import requests
+
+from locintel.harvest import concurrency
+from locintel.harvest.cache import fetch
+from locintel.harvest.concurrency import (
+    AdaptiveConcurrency,
+    disable_adaptive_concurrency,
+    get_controller,
+    set_adaptive_concurrency,
+)
+
+
+def complete(controller, latency=0.1):
+    start = controller.acquire()
+    controller.release(start - latency)
+
+
+def throttle(controller):
+    controller.release(controller.acquire(), throttled=True)
+
+
+class TestAdaptiveConcurrency(object):
+    def test_slow_start_doubles_limit_per_round(self):
+        controller = AdaptiveConcurrency(initial=2, maximum=100)
+
+        for _ in range(2 + 4 + 8):
+            complete(controller)
+
+        assert controller.limit == 16
+
+    def test_increases_additively_after_first_decrease(self):
+        controller = AdaptiveConcurrency(initial=4, maximum=10)
+        throttle(controller)
+
+        for _ in range(2 + 3 + 4):
+            complete(controller)
+
+        assert 4.5 < controller.limit <= 5
+        assert controller.decreases == 1
+
+    def test_limit_is_capped(self):
+        controller = AdaptiveConcurrency(initial=2, maximum=3)
+
+        for _ in range(100):
+            complete(controller)
+
+        assert controller.limit == 3
+
+    def test_throttling_decreases_multiplicatively(self):
+        controller = AdaptiveConcurrency(initial=8, minimum=1)
+
+        throttle(controller)
+        assert controller.limit == 4
+        throttle(controller)
+        assert controller.limit == 2
+        for _ in range(5):
+            throttle(controller)
+        assert controller.limit == 1
+
+    def test_latency_increase_decreases_limit(self):
+        controller = AdaptiveConcurrency(initial=8, tolerance=2, smoothing=1)
+        for _ in range(3):
+            complete(controller, latency=0.1)
+
+        complete(controller, latency=0.5)
+
+        assert controller.limit == 5.5
+        assert controller.stats()["baseline"] == pytest.approx(0.1, abs=0.01)
+
+    def test_backs_off_once_per_congestion_episode(self):
+        controller = AdaptiveConcurrency(initial=8)
+        starts = [controller.acquire() for _ in range(4)]
+
+        for start in starts:
+            controller.release(start, throttled=True)
+
+        assert controller.limit == 4
+        assert controller.decreases == 1
+
+    def test_acquire_blocks_at_limit(self):
+        controller = AdaptiveConcurrency(initial=1)
+        start = controller.acquire()
+        acquired = threading.Event()
+
+        def second():
+            controller.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=second)
+        thread.start()
+        assert not acquired.wait(0.1)
+
+        controller.release(start)
+        assert acquired.wait(1)
+        thread.join()
+
+
+class TestRegistry(object):
+    def test_get_controller(self):
+        assert get_controller("test-provider") is None
+
+        set_adaptive_concurrency("test-provider", initial=3)
+        try:
+            controller = get_controller("test-provider")
+            assert controller.limit == 3
+            assert get_controller("test-provider") is controller
+        finally:
+            disable_adaptive_concurrency("test-provider")
+
+        assert get_controller("test-provider") is None
+        assert "test-provider" not in concurrency._controllers
+
+
+class TestFetch(object):
+    def test_throttled_response_decreases_limit(self, mocker):
+        session = mocker.Mock()
+        session.retries = 0
+        session.request.return_value.status_code = 429
+        session.request.return_value.raise_for_status.side_effect = ValueError
+        controller = AdaptiveConcurrency(initial=4)
+
+        with pytest.raises(ValueError):
+            fetch(session, "GET", "http://test", controller=controller)
+
+        assert controller.limit == 2
+        assert controller.in_flight == 0
+
+    def test_successful_response_increases_limit(self, mocker):
+        session = mocker.Mock()
+        session.request.return_value.status_code = 200
+        session.request.return_value.elapsed = timedelta(microseconds=0)
+        session.request.return_value.request.body = b"{}"
+        session.request.return_value.content = b"{}"
+        controller = AdaptiveConcurrency(initial=4)
+
+        fetch(session, "GET", "http://test", controller=controller)
+
+        assert controller.limit == 5
+        assert controller.in_flight == 0
+
+    def test_timeout_decreases_limit(self, mocker):
+        session = mocker.Mock()
+        session.request.side_effect = requests.Timeout
+        controller = AdaptiveConcurrency(initial=4)
+
+        with pytest.raises(requests.Timeout):
+            fetch(session, "GET", "http://test", controller=controller)
+
+        assert controller.limit == 2
+        assert controller.in_flight == 0
+
+    def test_other_request_error_leaves_limit_unchanged(self, mocker):
+        session = mocker.Mock()
+        session.request.side_effect = requests.exceptions.InvalidURL
+        controller = AdaptiveConcurrency(initial=4)
+
+        with pytest.raises(requests.exceptions.InvalidURL):
+            fetch(session, "GET", "http://test", controller=controller)
+
+        assert controller.limit == 4
+        assert controller.in_flight == 0
+
+    def test_every_throttled_attempt_is_seen(self, mocker):
+        throttled, ok = mocker.Mock(status_code=429, headers={}), mocker.Mock(
+            status_code=200, elapsed=timedelta(0), content=b"{}"
+        )
+        ok.request.body = b"{}"
+        session = mocker.Mock(retries=3, backoff_factor=0)
+        session.request.side_effect = [throttled, ok]
+        session.get_backoff_time.return_value = 0
+        controller = AdaptiveConcurrency(initial=4)
+        release = mocker.spy(controller, "release")
+
+        fetch(session, "GET", "http://test", controller=controller)
+
+        assert [c.kwargs["throttled"] for c in release.call_args_list] == [True, False]
+        assert controller.decreases == 1
+        assert controller.in_flight == 0
@@ -0,0 +1,142 @@
+import json
+
+import pytest
+
+from locintel.core.datamodel.geo import Geometry, GeoCoordinate
+from locintel.core.datamodel.routing import Route, RoutePlan, Waypoint
+from locintel.core.datamodel.testing import ExperimentResult
+from locintel.harvest.experiments import (
+    ExperimentRunner,
+    default_plan_id,
+    load_experiment,
+    load_failures,
+    read_records,
+)
+
+
+class FakeRouter(object):
+    name = "fake"
+
+    def __init__(self, **kwargs):
+        pass
+
+    def calculate(self, route_plan):
+        if route_plan.metadata.get("fail"):
+            raise ValueError("unroutable")
+        return Route(
+            Geometry([route_plan.start, route_plan.end]),
+            100 * route_plan.start.lat,
+            50,
+            metadata={"calc_time": 0.1},
+        )
+
+
+def plans(n, fail=()):
+    return [
+        RoutePlan(
+            Waypoint(i, 1),
+            Waypoint(i, 2),
+            metadata={"name": f"plan-{i}", "fail": i in fail},
+        )
+        for i in range(n)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def routers(mocker):
+    mocker.patch.dict(
+        "locintel.harvest.routes.ROUTERS", {"a": FakeRouter, "b": FakeRouter}
+    )
+
+
+class TestExperimentRunner(object):
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_run_streams_results(self, tmp_path, jobs):
+        output = str(tmp_path / "results.jsonl")
+
+        with ExperimentRunner(["a", "b"], jobs=jobs) as runner:
+            summary = runner.run(plans(5, fail={3}), output)
+
+        records = list(read_records(output))
+        assert summary == {"completed": 4, "failed": 1, "skipped": 0}
+        assert sorted(record["id"] for record in records) == [
+            f"plan-{i}" for i in range(5)
+        ]
+        assert load_failures(output)["plan-3"]["error"] == "ValueError('unroutable')"
+        assert "unroutable" in load_failures(output)["plan-3"]["traceback"]
+
+    def test_run_resumes(self, tmp_path):
+        output = str(tmp_path / "results.jsonl")
+        runner = ExperimentRunner(["a"], jobs=1)
+        runner.run(plans(3, fail={1}), output)
+        with open(output, "a") as f:
+            f.write('{"id": "plan-9", "sta')  # crashed mid-write
+
+        summary = runner.run(plans(5), output)
+
+        assert summary == {"completed": 3, "failed": 0, "skipped": 2}
+        assert len(list(read_records(output))) == 6
+        assert load_failures(output) == {}
+        with open(output) as f:
+            assert all(json.loads(line) for line in f)
+
+    def test_run_without_retrying_failures(self, tmp_path):
+        output = str(tmp_path / "results.jsonl")
+        runner = ExperimentRunner(["a"], jobs=1)
+        runner.run(plans(2, fail={1}), output)
+
+        summary = runner.run(plans(2), output, retry_failed=False)
+
+        assert summary == {"completed": 0, "failed": 0, "skipped": 2}
+
+    def test_pool_is_reused_across_runs(self, tmp_path):
+        with ExperimentRunner(["a"], jobs=2) as runner:
+            runner.run(plans(2), str(tmp_path / "1.jsonl"))
+            pool = runner.pool
+            runner.run(plans(2), str(tmp_path / "2.jsonl"))
+
+            assert runner.pool is pool
+
+        assert runner._pool is None
+
+    def test_max_pending_bounds_in_flight_plans(self):
+        consumed, in_flight = [], []
+
+        def lazy_tasks():
+            for i, plan in enumerate(plans(20)):
+                consumed.append(plan)
+                yield i, plan
+
+        def write(result):
+            in_flight.append(len(consumed) - len(in_flight))
+
+        with ExperimentRunner(["a"], jobs=2, max_pending=3) as runner:
+            runner._run_pool(lazy_tasks(), write)
+
+        assert len(in_flight) == 20
+        assert max(in_flight) <= 3
+
+
+class TestLoadExperiment(object):
+    def test_round_trip(self, tmp_path):
+        output = str(tmp_path / "results.jsonl")
+        ExperimentRunner(["a", "b"], jobs=1).run(plans(3), output)
+
+        result = load_experiment(output)
+
+        assert isinstance(result, ExperimentResult)
+        assert len(result.tests) == 3
+        test = sorted(result, key=lambda t: t.plan.start.lat)[2]
+        assert test.plan.start == Waypoint(2, 1)
+        assert test.plan.metadata["name"] == "plan-2"
+        assert test.routes["b"].distance == 200
+        assert test.routes["b"].geometry.coords == [
+            GeoCoordinate(2, 1),
+            GeoCoordinate(2, 2),
+        ]
+
+
+class TestDefaultPlanId(object):
+    def test_default_plan_id(self):
+        assert default_plan_id(3, plans(1)[0]) == "plan-0"
+        assert default_plan_id(3, RoutePlan(Waypoint(0, 0), Waypoint(1, 1))) == 3
@@ -0,0 +1,193 @@
+from datetime import timedelta
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.routing import Waypoint
+from locintel.harvest.cache import ResponseCache
+from locintel.harvest.geocodes import (
+    GeoJSONGeocoderResponseAdapter,
+    GoogleGeocoder,
+    GoogleGeocoderResponseAdapter,
+    MapboxGeocoder,
+    geocode,
+    normalize_query,
+)
+
+
+def location(query):
+    """
+    Deterministic (lat, lng) of a query
+    """
+    value = sum(map(ord, query))
+    return value % 90, value % 180
+
+
+def mock_session(respond):
+    """
+    Session answering requests with respond(method, url, json payload)
+    """
+    requests = list()
+    lock = threading.Lock()
+
+    def request(method, url, **kwargs):
+        with lock:
+            requests.append((method, url, kwargs.get("json")))
+        response = Mock(status_code=200, elapsed=timedelta(microseconds=1000))
+        response.request.body = None
+        response.content = json.dumps(respond(method, url, kwargs.get("json"))).encode()
+        return response
+
+    session = Mock()
+    session.request.side_effect = request
+    session.requests = requests
+    return session
+
+
+def google_respond(method, url, payload):
+    address = parse_qs(urlparse(url).query)["address"][0]
+    if address.startswith("nowhere"):
+        return {"status": "ZERO_RESULTS", "results": []}
+    if address.startswith("denied"):
+        return {"status": "REQUEST_DENIED", "error_message": "Invalid key"}
+    lat, lng = location(address)
+    return {
+        "status": "OK",
+        "results": [
+            {
+                "formatted_address": address.title(),
+                "geometry": {
+                    "location": {"lat": lat, "lng": lng},
+                    "location_type": "ROOFTOP",
+                },
+            }
+        ],
+    }
+
+
+def mapbox_respond(method, url, payload):
+    return {
+        "batch": [
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "geometry": {"coordinates": location(query["q"])[::-1]},
+                        "properties": {"match_code": {"confidence": "high"}},
+                    }
+                ],
+            }
+            for query in payload
+        ]
+    }
+
+
+class TestNormalizeQuery(object):
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "Unter den Linden 1, Berlin",
+            "  unter den  linden 1 ,berlin. ",
+            "UNTER DEN LINDEN 1,, BERLIN",
+            "Unter den Linden 1, Berlin",
+        ],
+    )
+    def test_normalized(self, query):
+        assert normalize_query(query) == "unter den linden 1, berlin"
+
+
+class TestGeocodeMany(object):
+    def test_queries_deduplicated(self):
+        session = mock_session(google_respond)
+        geocoder = GoogleGeocoder(key="key", session=session)
+
+        results = geocoder.geocode_many(
+            ["Main St 1, Berlin", "main st 1 ,  berlin", "Other St 2", ""]
+        )
+
+        assert len(session.requests) == 2
+        assert results[0] is results[1]
+        assert (results[0].lat, results[0].lng) == location("main st 1, berlin")
+        assert results[0].confidence == 1.0
+        assert results[0].address == "Main St 1, Berlin"
+        assert results[2].query == "other st 2"
+        assert results[3] is None
+
+    def test_failed_queries_not_geocoded(self, tmp_path):
+        session = mock_session(google_respond)
+        cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+        geocoder = GoogleGeocoder(session=session, cache=cache)
+
+        results = geocoder.geocode_many(["nowhere", "denied", "somewhere"])
+
+        assert results[0] is None and results[1] is None
+        assert results[2] is not None
+        assert len(cache) == 2  # error responses are not cached
+
+    def test_batches(self):
+        session = mock_session(mapbox_respond)
+        geocoder = MapboxGeocoder(session=session, access_token="token")
+        geocoder.batch_size = 2
+        queries = [f"Street {i}" for i in range(5)]
+
+        results = geocoder.geocode_many(queries + queries[:2])
+
+        assert [len(payload) for _, _, payload in session.requests] == [2, 2, 1]
+        assert [(r.lat, r.lng) for r in results] == [
+            location(normalize_query(q)) for q in queries + queries[:2]
+        ]
+        assert results[0].confidence == 0.8
+
+    def test_cached_per_query(self, tmp_path):
+        cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+        session = mock_session(mapbox_respond)
+        queries = [f"Street {i}" for i in range(5)]
+        geocode(queries[:3], "mapbox", session=session, cache=cache)
+
+        results = geocode(queries, "mapbox", session=session, cache=cache)
+
+        assert [len(payload) for _, _, payload in session.requests] == [3, 2]
+        assert all(result is not None for result in results)
+
+
+class TestResponseAdapters(object):
+    def test_geojson_confidence(self):
+        def feature(properties):
+            return {
+                "features": [
+                    {
+                        "geometry": {"coordinates": [13.4, 52.5]},
+                        "properties": properties,
+                    }
+                ]
+            }
+
+        adapter = GeoJSONGeocoderResponseAdapter
+        assert adapter(feature({"confidence": 0.7})).get_geocode().confidence == 0.7
+        assert adapter(feature({"relevance": 0.9})).get_geocode().confidence == 0.9
+        assert adapter(feature({})).get_geocode().confidence is None
+        assert adapter({"features": []}).get_geocode() is None
+        with pytest.raises(ValueError):
+            adapter({"message": "Not Authorized"}).get_geocode()
+
+    def test_google_partial_match_confidence(self):
+        response = {
+            "status": "OK",
+            "results": [
+                {
+                    "geometry": {
+                        "location": {"lat": 52.5, "lng": 13.4},
+                        "location_type": "APPROXIMATE",
+                    },
+                    "partial_match": True,
+                }
+            ],
+        }
+
+        result = GoogleGeocoderResponseAdapter(response).get_geocode("query")
+
+        assert result.confidence == 0.2
+        assert result.to_waypoint() == Waypoint(52.5, 13.4)
@@ -0,0 +1,151 @@
+from datetime import timedelta
+import multiprocessing
+import pickle
+import time
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.routing import RoutePlan, Waypoint
+from locintel.harvest import limiters
+from locintel.harvest.limiters import TokenBucket, get_limiter, set_rate_limit
+from locintel.harvest.routes import MapboxRouter
+
+
+@pytest.fixture()
+def bucket(tmp_path):
+    return TokenBucket("test", rate=10, capacity=2, path=str(tmp_path / "bucket"))
+
+
+def acquire_many(bucket, n, queue):
+    for _ in range(n):
+        bucket.acquire()
+        queue.put(time.time())
+
+
+class TestTokenBucket(object):
+    def test_burst_then_rate(self, bucket):
+        waits = [bucket.reserve() for _ in range(4)]
+
+        assert waits[:2] == [0, 0]
+        assert waits[2] == pytest.approx(0.1, abs=0.01)
+        assert waits[3] == pytest.approx(0.2, abs=0.01)
+
+    def test_in_process_state_without_fcntl(self, bucket, mocker):
+        mocker.patch.object(limiters, "fcntl", None)
+
+        waits = [bucket.reserve() for _ in range(3)]
+        bucket.reset()
+
+        assert waits[:2] == [0, 0]
+        assert waits[2] == pytest.approx(0.1, abs=0.01)
+        assert bucket.reserve() == 0
+        assert bucket._fd is None
+
+    def test_refill(self, bucket, mocker):
+        now = time.time()
+        mocker.patch("locintel.harvest.limiters.time.time", return_value=now)
+        bucket.reserve(2)
+
+        limiters.time.time.return_value = now + 0.1
+
+        assert bucket.reserve() == pytest.approx(0, abs=1e-6)
+        assert bucket.reserve() == pytest.approx(0.1)
+
+    def test_refill_is_capped_at_capacity(self, bucket, mocker):
+        now = time.time()
+        mocker.patch("locintel.harvest.limiters.time.time", return_value=now)
+        bucket.reserve()
+
+        limiters.time.time.return_value = now + 100
+
+        assert [bucket.reserve() for _ in range(3)][-1] == pytest.approx(0.1)
+
+    def test_state_is_shared_between_buckets(self, bucket):
+        other = TokenBucket("test", rate=10, capacity=2, path=bucket.path)
+        bucket.reserve(2)
+
+        assert other.reserve() == pytest.approx(0.1, abs=0.01)
+
+    def test_stats(self, bucket):
+        for _ in range(3):
+            bucket.reserve()
+
+        stats = bucket.stats()
+
+        assert stats["acquisitions"] == 3
+        assert stats["waits"] == 1
+        assert stats["max_wait"] == pytest.approx(0.1, abs=0.01)
+        assert stats["mean_wait"] == pytest.approx(stats["total_wait"] / 3)
+
+    def test_reset(self, bucket):
+        bucket.reserve(5)
+
+        bucket.reset()
+
+        assert bucket.reserve() == 0
+        assert bucket.stats()["acquisitions"] == 1
+
+    def test_pickling(self, bucket):
+        bucket.reserve(2)
+
+        other = pickle.loads(pickle.dumps(bucket))
+
+        assert other.reserve() > 0
+
+    def test_rate_holds_across_processes(self, tmp_path):
+        bucket = TokenBucket("test", rate=50, capacity=1, path=str(tmp_path / "bucket"))
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=acquire_many, args=(bucket, 10, queue))
+            for _ in range(4)
+        ]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        times = sorted(queue.get() for _ in range(40))
+
+        # 1 burst token, then 39 tokens at 50/s
+        assert times[-1] - start >= 39 / 50 - 0.02
+
+
+class TestRateLimitConfiguration(object):
+    def test_get_limiter(self, tmp_path):
+        path = str(tmp_path / "bucket")
+        set_rate_limit("provider", rate=5, capacity=3, path=path)
+        try:
+            limiter = get_limiter("provider")
+
+            assert limiter is get_limiter("provider")
+            assert (limiter.rate, limiter.capacity, limiter.path) == (5, 3, path)
+            assert get_limiter("unknown") is None
+        finally:
+            set_rate_limit("provider", None)
+
+        assert get_limiter("provider") is None
+
+    def test_router_acquires_configured_limiter(self, tmp_path):
+        set_rate_limit("mapbox-routing", rate=5, path=str(tmp_path / "bucket"))
+        session = Mock()
+        session.request.return_value.elapsed = timedelta(microseconds=0)
+        session.request.return_value.request.body = b"{}"
+        session.request.return_value.content = b"{}"
+        router = MapboxRouter(
+            endpoint="url/{vehicle_type}", adapter=Mock(), session=session
+        )
+        try:
+            router.calculate(RoutePlan(Waypoint(10, 20), Waypoint(15, 25)))
+
+            assert get_limiter("mapbox-routing").stats()["acquisitions"] == 1
+        finally:
+            set_rate_limit("mapbox-routing", None)
+
+    def test_router_explicit_limiter(self):
+        limiter = Mock()
+        router = MapboxRouter(limiter=limiter)
+
+        assert router.get_limiter() is limiter
+        assert MapboxRouter().get_limiter() is None
@@ -0,0 +1,143 @@
+from datetime import timedelta
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.geo import Geometry
+from locintel.core.datamodel.routing import Route, Waypoint
+from locintel.harvest import routes
+from locintel.harvest.matrix import (
+    GoogleMatrixRouter,
+    PairwiseMatrixRouter,
+    calculate_matrix,
+    tiles,
+)
+
+origins = [Waypoint(i, 0) for i in range(30)]
+destinations = [Waypoint(0, j) for j in range(7)]
+
+
+def google_session(requests, no_route=(), errors=()):
+    """
+    Session answering distance matrix requests with duration 100 * origin lat + destination lng and distance ten
+    times that, no route between given (lat, lng) pairs, and server errors for requests of given origin lats
+    """
+    lock = threading.Lock()
+
+    def request(method, url, **kwargs):
+        query = parse_qs(urlparse(url).query)
+        lats = [float(o.split(",")[0]) for o in query["origins"][0].split("|")]
+        lngs = [float(d.split(",")[1]) for d in query["destinations"][0].split("|")]
+        with lock:
+            requests.append((lats, lngs))
+        response = Mock(status_code=200, elapsed=timedelta(microseconds=1000))
+        response.request.body = None
+        if lats[0] in errors:
+            response.raise_for_status.side_effect = ValueError("500 Server Error")
+        response.content = json.dumps(
+            {
+                "status": "OK",
+                "rows": [
+                    {
+                        "elements": [
+                            {"status": "ZERO_RESULTS"}
+                            if (lat, lng) in no_route
+                            else {
+                                "status": "OK",
+                                "duration": {"value": 100 * lat + lng},
+                                "distance": {"value": 1000 * lat + 10 * lng},
+                            }
+                            for lng in lngs
+                        ]
+                    }
+                    for lat in lats
+                ],
+            }
+        ).encode()
+        return response
+
+    session = Mock()
+    session.request.side_effect = request
+    return session
+
+
+def expected_durations(rows=origins, columns=destinations):
+    return 100 * np.array([o.lat for o in rows])[:, None] + np.array(
+        [d.lng for d in columns]
+    )
+
+
+class TestTiles(object):
+    def test_tiles_cover_matrix(self):
+        blocks = tiles(5, 3, 2, 2)
+
+        covered = np.zeros((5, 3), dtype=int)
+        for block in blocks:
+            covered[block] += 1
+        assert (covered == 1).all()
+        assert len(blocks) == 6
+
+    @pytest.mark.parametrize(
+        "size,shape", [((30, 7), (14, 7)), ((30, 60), (4, 25)), ((3, 1), (3, 1))]
+    )
+    def test_google_tile_shape_within_limits(self, size, shape):
+        assert GoogleMatrixRouter().tile_shape(*size) == shape
+
+    def test_pairwise_tile_shape(self):
+        assert PairwiseMatrixRouter(Mock()).tile_shape(30, 7) == (1, 1)
+
+
+class TestCalculateMatrix(object):
+    def test_google_matrix_assembled_from_tiles(self):
+        requests = list()
+        session = google_session(requests)
+
+        matrix = calculate_matrix(origins, destinations, "google", session=session)
+
+        assert len(requests) == 3
+        assert all(len(lats) * len(lngs) <= 100 for lats, lngs in requests)
+        assert matrix.shape == (30, 7)
+        assert np.array_equal(matrix.durations, expected_durations())
+        assert np.array_equal(matrix.distances, 10 * expected_durations())
+        assert not matrix.failed.any()
+
+    def test_failed_cells_masked(self):
+        session = google_session([], no_route={(1, 2)}, errors={14})
+
+        matrix = calculate_matrix(origins, destinations, "google", session=session)
+
+        expected = np.zeros((30, 7), dtype=bool)
+        expected[1, 2] = True
+        expected[14:28] = True
+        assert np.array_equal(matrix.failed, expected)
+        assert matrix.metadata["failed_tiles"] == 1
+        assert np.array_equal(
+            matrix.durations[~expected], expected_durations()[~expected]
+        )
+
+    def test_pairwise_fallback(self, mocker):
+        calls = list()
+
+        class FakeRouter(object):
+            name = "fake"
+
+            def calculate(self, route_plan):
+                calls.append(route_plan)
+                if route_plan.start.lat == route_plan.end.lng == 1:
+                    raise ValueError("No route")
+                duration = 100 * route_plan.start.lat + route_plan.end.lng
+                return Route(Geometry.dummy(), 10 * duration, duration)
+
+        mocker.patch.dict(routes.ROUTERS, {"fake": FakeRouter})
+
+        matrix = calculate_matrix(origins[:3], destinations[:4], "fake", jobs=4)
+
+        assert len(calls) == 12
+        assert [plan.vehicle for plan in calls] == ["CAR"] * 12
+        assert np.array_equal(matrix.failed, np.arange(12).reshape(3, 4) == 1 * 4 + 1)
+        assert matrix.durations[2, 3] == 203
+        assert matrix.distances[2, 3] == 2030
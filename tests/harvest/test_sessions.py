@@ -0,0 +1,213 @@
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import pickle
+import threading
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.routing import RoutePlan, Waypoint
+from locintel.harvest.cache import fetch
+from locintel.harvest.limiters import TokenBucket
+from locintel.harvest.matches import MapboxMatcher
+from locintel.harvest.routes import GoogleRouter, MapboxRouter
+from locintel.harvest.sessions import (
+    HarvestSession,
+    JitteredRetry,
+    default_session,
+    get_backoff_time,
+)
+
+
+@pytest.fixture()
+def flaky_server():
+    """
+    Local server answering 429 to the first request of each path, then 200
+    """
+    seen = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self):
+            if self.path not in seen:
+                seen.add(self.path)
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            body = json.dumps({"ok": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+class TestHarvestSession(object):
+    def test_request_applies_default_timeout(self):
+        session = HarvestSession(timeout=(1, 2))
+        session._create_session = Mock()
+
+        session.post("url", json={})
+
+        session._create_session.return_value.request.assert_called_with(
+            "POST", "url", json={}, timeout=(1, 2)
+        )
+
+    def test_request_timeout_can_be_overridden(self):
+        session = HarvestSession(timeout=(1, 2))
+        session._create_session = Mock()
+
+        session.get("url", timeout=5)
+
+        session._create_session.return_value.request.assert_called_with(
+            "GET", "url", timeout=5
+        )
+
+    def test_session_is_reused(self):
+        session = HarvestSession()
+
+        assert session.session is session.session
+
+    def test_session_is_recreated_in_new_process(self, mocker):
+        session = HarvestSession()
+        first = session.session
+        mocker.patch("os.getpid", return_value=-1)
+
+        assert session.session is not first
+
+    def test_pickling_drops_underlying_session(self):
+        session = HarvestSession(pool_maxsize=3)
+        session.session
+
+        result = pickle.loads(pickle.dumps(session))
+
+        assert result._session is None
+        assert result.pool_maxsize == 3
+        assert result.session is not session.session
+
+    def test_adapter_configuration(self):
+        session = HarvestSession(pool_maxsize=7, retries=5, status_forcelist=(429,))
+
+        adapter = session.session.get_adapter("https://host")
+
+        assert adapter._pool_maxsize == 7
+        assert isinstance(adapter.max_retries, JitteredRetry)
+        assert adapter.max_retries.total == 5
+        assert adapter.max_retries.status_forcelist == (429,)
+        assert adapter.max_retries.allowed_methods is None
+
+    def test_throttling_is_retried_by_fetch_with_a_token_per_attempt(
+        self, flaky_server, tmp_path
+    ):
+        session = HarvestSession(backoff_factor=0)
+        limiter = TokenBucket("test", rate=1000, path=str(tmp_path / "bucket"))
+
+        get_response = session.get(f"{flaky_server}/get")
+        data, _, post_response = fetch(
+            session, "POST", f"{flaky_server}/post", limiter=limiter, json={}
+        )
+
+        assert get_response.status_code == 429
+        assert post_response.status_code == 200
+        assert data == {"ok": True}
+        assert limiter.acquisitions == 2
+
+    def test_backoff_respects_retry_after(self):
+        session = HarvestSession(backoff_factor=1)
+
+        assert session.get_backoff_time(0, "2") == 2
+        assert 0.5 <= session.get_backoff_time(0) <= 1
+        assert 2 <= session.get_backoff_time(2) <= 4
+        assert get_backoff_time(0, 1, "2") == 2
+        assert 2 <= get_backoff_time(2, 1) <= 4
+
+    def test_no_retries_returns_throttled_response(self, flaky_server):
+        session = HarvestSession(retries=0)
+
+        response = session.get(f"{flaky_server}/get")
+
+        assert response.status_code == 429
+
+
+class TestJitteredRetry(object):
+    def test_backoff_is_jittered_within_bounds(self):
+        retry = JitteredRetry(total=10, backoff_factor=1)
+        for _ in range(3):
+            retry = retry.increment(method="GET", url="url")
+        base = 1 * 2 ** 2
+
+        times = [retry.get_backoff_time() for _ in range(50)]
+
+        assert all(base / 2 <= t <= base for t in times)
+        assert len(set(times)) > 1
+
+
+def mock_session():
+    session = Mock()
+    session.request.return_value.elapsed = timedelta(microseconds=0)
+    session.request.return_value.request.body = b"{}"
+    session.request.return_value.content = b"{}"
+    return session
+
+
+class TestRoutersUseSession(object):
+    route_plan = RoutePlan(Waypoint(10, 20), Waypoint(30, 40))
+
+    def test_default_session(self):
+        assert MapboxRouter().session is default_session
+        assert GoogleRouter().session is default_session
+        assert MapboxMatcher().session is default_session
+
+    def test_mapbox_router(self):
+        session = mock_session()
+        adapter = Mock()
+
+        result = MapboxRouter(
+            endpoint="url/{vehicle_type}", adapter=adapter, session=session
+        ).calculate(self.route_plan)
+
+        assert result == adapter.return_value.get_route.return_value
+        session.request.assert_called_with(
+            "POST",
+            "url/car",
+            json=MapboxRouter._generate_payload(self.route_plan),
+            auth=(None, None),
+        )
+
+    def test_google_router(self):
+        session = mock_session()
+        adapter = Mock()
+
+        GoogleRouter(endpoint="url?", adapter=adapter, session=session).calculate(
+            self.route_plan
+        )
+
+        session.request.assert_called_with(
+            "GET", "url?origin=10,20&destination=30,40&key=&units=metric"
+        )
+
+    def test_mapbox_matcher(self):
+        session = mock_session()
+        adapter = Mock()
+        plan = Mock(points=[])
+
+        MapboxMatcher(endpoint="url", adapter=adapter, session=session).calculate(plan)
+
+        session.request.assert_called_with(
+            "POST",
+            "url",
+            json={"locations": []},
+            auth=(None, None),
+            headers={"Content-Type": "application/json"},
+        )
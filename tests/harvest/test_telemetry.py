@@ -0,0 +1,194 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import socket
+import threading
+
+from aiohttp import web
+import numpy as np
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.geo import Geometry
+from locintel.core.datamodel.routing import Route, RoutePlan, Waypoint
+from locintel.core.datamodel.testing import TestResult
+from locintel.harvest.aio import AsyncMapboxRouter
+from locintel.harvest.cache import fetch
+from locintel.harvest.routes import MapboxRouter
+from locintel.harvest.sessions import HarvestSession
+from locintel.harvest.telemetry import Histogram, Telemetry
+
+from .test_aio import mapbox_response, serve
+
+route_plan = RoutePlan(Waypoint(10, 20), Waypoint(15, 25))
+
+
+@pytest.fixture()
+def keep_alive_server():
+    """
+    Local HTTP/1.1 server answering mapbox_response to any request
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _respond(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = json.dumps(mapbox_response).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+class TestHistogram(object):
+    def test_percentiles_within_precision(self):
+        values = np.random.default_rng(0).lognormal(-2, 1, 10000)
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+
+        for q in (50, 95, 99):
+            assert histogram.percentile(q) == pytest.approx(
+                np.percentile(values, q), rel=0.03
+            )
+        assert histogram.summary()["count"] == 10000
+        assert histogram.summary()["max"] == values.max()
+
+    def test_zero_values(self):
+        histogram = Histogram()
+        for value in (0, 0, 0.5):
+            histogram.record(value)
+
+        assert histogram.percentile(50) == 0
+        assert histogram.percentile(99) == 0.5
+
+    def test_merge(self):
+        first, second, both = Histogram(), Histogram(), Histogram()
+        for value in range(1, 100):
+            (first if value % 2 else second).record(value)
+            both.record(value)
+
+        first.merge(second)
+
+        assert first.summary() == both.summary()
+
+    def test_empty(self):
+        assert Histogram().summary() == {
+            "count": 0,
+            "mean": None,
+            "p50": None,
+            "p95": None,
+            "p99": None,
+            "max": None,
+        }
+
+
+class TestTelemetry(object):
+    def test_summary_per_provider(self):
+        telemetry = Telemetry()
+        for i in range(1, 101):
+            telemetry.record("a", {"total": i / 100, "response_size": 1000})
+        telemetry.record("b", {"total": 1, "dns": None})
+
+        summary = telemetry.summary()
+
+        assert summary["a"]["total"]["p95"] == pytest.approx(0.95, rel=0.02)
+        assert summary["a"]["response_size"]["p50"] == 1000
+        assert list(summary["b"]) == ["total"]
+
+    def test_listeners(self):
+        telemetry = Telemetry()
+        listener = Mock()
+        telemetry.add_listener(Mock(side_effect=ValueError))
+        telemetry.add_listener(listener)
+
+        telemetry.record("a", {"total": 1})
+
+        listener.assert_called_once_with("a", {"total": 1})
+
+    def test_from_experiment(self):
+        def route(timing):
+            return Route(Geometry.dummy(), 1, 1, metadata={"timing": timing})
+
+        tests = [
+            TestResult(
+                "test",
+                route_plan,
+                {
+                    "a": route({"total": 0.5}),
+                    "b": route({"calc_time": 0.1, "cached": True}),
+                },
+            )
+        ]
+
+        summary = Telemetry.from_experiment(tests).summary()
+
+        assert list(summary) == ["a"]
+        assert summary["a"]["total"]["p50"] == 0.5
+
+
+class TestRequestTiming(object):
+    def test_fetch_times_connections(self, keep_alive_server):
+        session = HarvestSession()
+
+        _, first, _ = fetch(session, "POST", keep_alive_server, json={"a": 1})
+        _, second, _ = fetch(session, "POST", keep_alive_server, json={"a": 1})
+
+        assert first["connect"] > 0
+        assert second["dns"] == second["connect"] == 0
+        for timing in (first, second):
+            assert 0 < timing["ttfb"] <= timing["total"]
+            assert timing["request_size"] == len(json.dumps({"a": 1}))
+            assert timing["response_size"] == len(json.dumps(mapbox_response))
+
+    def test_fetch_resolves_hosts_once(self, keep_alive_server, mocker):
+        getaddrinfo = mocker.spy(socket, "getaddrinfo")
+        url = keep_alive_server.replace("127.0.0.1", "localhost")
+
+        _, timing, _ = fetch(HarvestSession(), "POST", url, json={"a": 1})
+
+        hosts = [call.args[0] for call in getaddrinfo.call_args_list]
+        assert hosts.count("localhost") == 1
+        assert timing["dns"] > 0 and timing["connect"] > 0
+
+    def test_router_records_telemetry(self, keep_alive_server, mocker):
+        telemetry = mocker.patch("locintel.harvest.cache.telemetry", Telemetry())
+        router = MapboxRouter(endpoint=keep_alive_server, session=HarvestSession())
+
+        route = router.calculate(route_plan)
+
+        assert 0 < route.metadata["timing"]["ttfb"] <= route.metadata["calc_time"]
+        assert telemetry.summary()["mapbox-routing"]["total"]["count"] == 1
+
+    def test_async_router_records_telemetry(self, mocker):
+        telemetry = mocker.patch("locintel.harvest.aio.telemetry", Telemetry())
+
+        async def handler(request):
+            return web.json_response(mapbox_response)
+
+        async def main():
+            async with serve(handler) as url:
+                router = AsyncMapboxRouter(endpoint=url)
+                return await router.calculate_many([route_plan] * 3, concurrency=1)
+
+        routes = asyncio.run(main())
+
+        first, last = routes[0].metadata["timing"], routes[-1].metadata["timing"]
+        assert first["connect"] > 0
+        assert last["dns"] == last["connect"] == 0
+        assert 0 < last["ttfb"] <= last["total"]
+        assert last["response_size"] == len(json.dumps(mapbox_response))
+        assert last["request_size"] > 0
+        assert telemetry.summary()["mapbox-routing"]["total"]["count"] == 3
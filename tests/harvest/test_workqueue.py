@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+
+import pytest
+
+from locintel.core.datamodel.routing import RoutePlan
+from locintel.harvest.experiments import ExperimentRunner
+from locintel.harvest.workqueue import LeaseLost, WorkQueue, work
+
+from .test_experiments import FakeRouter, plans
+
+
+@pytest.fixture(autouse=True)
+def routers(mocker):
+    mocker.patch.dict("locintel.harvest.routes.ROUTERS", {"a": FakeRouter})
+
+
+def run_worker(path):
+    work(WorkQueue(path), ExperimentRunner(["a"], jobs=1))
+
+
+class TestWorkQueue(object):
+    def test_submit_shards_plans(self, tmp_path):
+        queue = WorkQueue(str(tmp_path))
+
+        assert queue.submit(plans(25), chunk_size=10) == 3
+        assert queue.status() == {"pending": 3, "leased": 0, "done": 0}
+
+    def test_claim_is_exclusive(self, tmp_path):
+        queue = WorkQueue(str(tmp_path))
+        queue.submit(plans(2), chunk_size=1)
+
+        first, second = queue.claim(), WorkQueue(str(tmp_path)).claim()
+
+        assert first[0] != second[0]
+        assert first[1][0][0] == "plan-0"
+        assert isinstance(first[1][0][1], RoutePlan)
+        assert queue.claim() is None
+        assert queue.status() == {"pending": 0, "leased": 2, "done": 0}
+
+    def test_expired_lease_is_reclaimed(self, tmp_path):
+        queue = WorkQueue(str(tmp_path), lease=60)
+        queue.submit(plans(1))
+        lease, _ = queue.claim()
+        leased = os.path.join(str(tmp_path), "leased", lease)
+        os.utime(leased, (0, 0))
+
+        result = queue.claim()
+
+        assert result[0] != lease
+        assert result[0].split(".")[0] == lease.split(".")[0]
+
+    def test_reclaimed_lease_cannot_be_renewed_or_completed(self, tmp_path):
+        queue = WorkQueue(str(tmp_path), lease=60)
+        queue.submit(plans(1))
+        stale, _ = queue.claim()
+        os.utime(os.path.join(str(tmp_path), "leased", stale), (0, 0))
+        lease, _ = queue.claim()
+
+        with pytest.raises(LeaseLost):
+            queue.renew(stale)
+        with pytest.raises(LeaseLost):
+            queue.complete(stale)
+        queue.release(stale)
+
+        assert queue.partial_file(stale) != queue.partial_file(lease)
+        assert queue.status() == {"pending": 0, "leased": 1, "done": 0}
+        queue.complete(lease)
+        assert queue.status() == {"pending": 0, "leased": 0, "done": 1}
+        assert os.listdir(os.path.join(str(tmp_path), "partial")) == []
+
+    def test_long_pending_item_is_not_expired_once_claimed(self, tmp_path, mocker):
+        queue = WorkQueue(str(tmp_path), lease=60)
+        queue.submit(plans(1))
+        (item,) = os.listdir(os.path.join(str(tmp_path), "pending"))
+        os.utime(os.path.join(str(tmp_path), "pending", item), (0, 0))
+        renew = queue.renew
+
+        def requeue_then_renew(lease):
+            WorkQueue(str(tmp_path), lease=60).requeue_expired()  # other worker
+            renew(lease)
+
+        mocker.patch.object(queue, "renew", side_effect=requeue_then_renew)
+
+        lease, _ = queue.claim()
+
+        assert queue.status() == {"pending": 0, "leased": 1, "done": 0}
+        assert lease.split(".")[0] == item
+
+    def test_claim_skips_lease_lost_while_claiming(self, tmp_path, mocker):
+        queue = WorkQueue(str(tmp_path), lease=60)
+        queue.submit(plans(1))
+        mocker.patch.object(queue, "renew", side_effect=LeaseLost("lease"))
+
+        assert queue.claim() is None
+
+    def test_release(self, tmp_path):
+        queue = WorkQueue(str(tmp_path))
+        queue.submit(plans(1))
+        lease, _ = queue.claim()
+
+        queue.release(lease)
+
+        assert queue.status() == {"pending": 1, "leased": 0, "done": 0}
+
+
+class TestWork(object):
+    def test_work_and_merge(self, tmp_path):
+        queue = WorkQueue(str(tmp_path))
+        queue.submit(plans(10, fail={4}), chunk_size=3)
+
+        processed = work(queue, ExperimentRunner(["a"], jobs=1))
+        result = queue.merge()
+
+        assert processed == 4
+        assert queue.is_finished()
+        assert sorted(test.plan.metadata["name"] for test in result) == [
+            f"plan-{i}" for i in range(10) if i != 4
+        ]
+        assert list(queue.failures()) == ["plan-4"]
+
+    def test_max_items(self, tmp_path):
+        queue = WorkQueue(str(tmp_path))
+        queue.submit(plans(10), chunk_size=3)
+
+        assert work(queue, ExperimentRunner(["a"], jobs=1), max_items=2) == 2
+        assert queue.status() == {"pending": 2, "leased": 0, "done": 2}
+
+    def test_reclaimed_item_resumes_partial_results(self, tmp_path):
+        queue = WorkQueue(str(tmp_path), lease=60)
+        queue.submit(plans(3))
+        lease, tasks = queue.claim()
+        ExperimentRunner(["a"], jobs=1).run(
+            [tasks[0][1]], queue.partial_file(lease), plan_id=lambda i, p: tasks[0][0]
+        )
+        with open(queue.partial_file(lease), "a") as f:
+            f.write('{"id": "plan-1", "sta')  # worker died mid-record
+        os.utime(os.path.join(str(tmp_path), "leased", lease), (0, 0))
+
+        runner = ExperimentRunner(["a"], jobs=1)
+        work(queue, runner)
+
+        assert len(queue.merge().tests) == 3
+        with open(queue.results_files()[0]) as f:
+            assert len(f.readlines()) == 3
+
+    def test_worker_which_lost_lease_does_not_publish(self, tmp_path, mocker):
+        queue = WorkQueue(str(tmp_path), lease=60)
+        queue.submit(plans(1))
+        runner = ExperimentRunner(["a"], jobs=1)
+
+        def reclaimed(route_plans, output, plan_id):
+            for lease in os.listdir(os.path.join(str(tmp_path), "leased")):
+                os.utime(os.path.join(str(tmp_path), "leased", lease), (0, 0))
+            assert queue.claim() is not None
+
+        mocker.patch.object(runner, "run", side_effect=reclaimed)
+
+        assert work(queue, runner, max_items=1) == 0
+        assert queue.status() == {"pending": 0, "leased": 1, "done": 0}
+
+    def test_failing_worker_releases_item(self, tmp_path, mocker):
+        queue = WorkQueue(str(tmp_path))
+        queue.submit(plans(1))
+        runner = ExperimentRunner(["a"], jobs=1)
+        mocker.patch.object(runner, "run", side_effect=KeyboardInterrupt)
+
+        with pytest.raises(KeyboardInterrupt):
+            work(queue, runner)
+
+        assert queue.status() == {"pending": 1, "leased": 0, "done": 0}
+
+    def test_concurrent_workers(self, tmp_path):
+        queue = WorkQueue(str(tmp_path))
+        queue.submit(plans(40), chunk_size=2)
+
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(str(tmp_path),))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert queue.status() == {"pending": 0, "leased": 0, "done": 20}
+        assert len(queue.merge().tests) == 40
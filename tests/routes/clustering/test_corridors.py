@@ -0,0 +1,106 @@
+import numpy as np
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.geo import Geometry, GeoCoordinate
+from locintel.routes.clustering import corridors as corridors_module
+from locintel.routes.clustering.corridors import (
+    CorridorClusterer,
+    Corridors,
+    NOISE,
+    items_from_experiment,
+)
+
+corridor_a = Geometry([GeoCoordinate(52.50, 13.30), GeoCoordinate(52.50, 13.31)])
+corridor_b = Geometry([GeoCoordinate(52.52, 13.30), GeoCoordinate(52.53, 13.30)])
+outlier = Geometry([GeoCoordinate(48.10, 11.50), GeoCoordinate(48.11, 11.51)])
+
+items = [
+    ("a1", corridor_a),
+    ("b1", corridor_b),
+    ("a2", corridor_a.shift(5, 0)),
+    ("b2", corridor_b.shift(0, 5)),
+    ("a3", corridor_a.shift(-5, 0)),
+    ("outlier", outlier),
+]
+
+
+class TestCorridorClusterer(object):
+    @pytest.mark.parametrize("jobs", [1, 2])
+    def test_fit(self, jobs):
+        result = CorridorClusterer(eps=20, min_samples=2, jobs=jobs).fit(items)
+
+        assert isinstance(result, Corridors)
+        assert len(result) == 2
+        assert result.members(0) == ["a1", "a2", "a3"]
+        assert result.members(1) == ["b1", "b2"]
+        assert result.labels[-1] == NOISE
+        assert result.get_representative_keys()[0] in ["a1", "a2", "a3"]
+        assert result.get_representative_geometries()[1] in [
+            items[1][1],
+            items[3][1],
+        ]
+
+    def test_fit_min_samples(self):
+        result = CorridorClusterer(eps=20, min_samples=3, jobs=1).fit(items)
+
+        assert len(result) == 1
+        assert result.members(0) == ["a1", "a2", "a3"]
+        assert result.members(NOISE) == ["b1", "b2", "outlier"]
+
+    def test_fit_in_process_leaves_worker_state(self):
+        CorridorClusterer(eps=20, jobs=1).fit(items)
+
+        assert corridors_module._worker_state == {}
+
+    def test_fit_streams_pairs_in_chunks(self):
+        duplicates = [(i, corridor_a) for i in range(7)]
+
+        result = CorridorClusterer(eps=20, jobs=1, chunksize=2).fit(duplicates)
+
+        assert result.members(0) == list(range(7))
+
+    def test_fit_max_bucket_candidates(self, monkeypatch):
+        duplicates = [(i, corridor_a) for i in range(5)]
+        clusterer = CorridorClusterer(eps=20, jobs=1, max_bucket_candidates=1)
+        scored = []
+        score = corridors_module._score
+        monkeypatch.setattr(
+            corridors_module,
+            "_score",
+            lambda pairs, state: scored.extend(pairs) or score(pairs, state=state),
+        )
+
+        result = clusterer.fit(duplicates)
+
+        assert sorted(scored) == [(0, 1), (1, 2), (2, 3), (3, 4)]
+        assert result.members(0) == list(range(5))
+
+    def test_fit_empty(self):
+        result = CorridorClusterer(jobs=1).fit([])
+
+        assert len(result) == 0
+        assert len(result.labels) == 0
+
+    def test_fit_distances(self):
+        distances = np.array([[0, 1, 9, 9], [1, 0, 9, 9], [9, 9, 0, 9], [9, 9, 9, 0]])
+
+        result = CorridorClusterer(eps=2).fit_distances(
+            distances, keys=["w", "x", "y", "z"]
+        )
+
+        assert result.labels.tolist() == [0, 0, NOISE, NOISE]
+        assert result.get_representative_keys() == {0: "w"}
+        with pytest.raises(ValueError):
+            result.get_representative_geometries()
+
+
+def test_items_from_experiment():
+    route1, route2 = Mock(geometry=corridor_a), Mock(geometry=corridor_b)
+    experiment = [Mock(routes={"mapbox": route1, "google": route2})]
+    experiment[0].name = "test"
+
+    result = items_from_experiment(experiment, providers=["mapbox"])
+
+    assert result == [(("test", "mapbox"), corridor_a)]
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from locintel.core.datamodel.geo import Geometry, GeoCoordinate
+from locintel.routes.metrics.divergence import (
+    Divergence,
+    DivergenceFinder,
+    SegmentHash,
+)
+
+# ~0.0009 degrees latitude = ~100m
+straight = Geometry([GeoCoordinate(52.5 + 0.0009 * i, 13.4) for i in range(11)])
+detour = Geometry(
+    [GeoCoordinate(52.5 + 0.0009 * i, 13.4) for i in range(4)]
+    + [
+        GeoCoordinate(52.5 + 0.0009 * 4, 13.403),  # ~200m east
+        GeoCoordinate(52.5 + 0.0009 * 6, 13.403),
+    ]
+    + [GeoCoordinate(52.5 + 0.0009 * i, 13.4) for i in range(7, 11)]
+)
+
+
+class TestDivergenceFinder(object):
+    def test_identical_geometries_have_no_divergences(self):
+        assert DivergenceFinder().find(straight, straight) == []
+
+    def test_detour(self):
+        result = DivergenceFinder(tolerance=20).find(straight, detour)
+
+        assert len(result) == 1
+        divergence = result[0]
+        assert isinstance(divergence, Divergence)
+        assert 250 < divergence.start1 < 350
+        assert 650 < divergence.end1 < 750
+        assert divergence.start1 == pytest.approx(divergence.start2, abs=20)
+        assert divergence.detour2 > divergence.detour1
+        assert divergence.max_separation == pytest.approx(203, abs=5)
+        assert divergence.split.lat == pytest.approx(52.5 + 0.0009 * 3, abs=3e-4)
+        assert divergence.rejoin.lat == pytest.approx(52.5 + 0.0009 * 7, abs=3e-4)
+
+    def test_detour_is_symmetric(self):
+        result = DivergenceFinder().find(detour, straight)
+
+        assert len(result) == 1
+        assert result[0].detour1 > result[0].detour2
+
+    def test_min_length_filters_out_short_divergences(self):
+        assert DivergenceFinder(min_length=1000).find(straight, detour) == []
+
+    def test_large_tolerance_absorbs_detour(self):
+        assert DivergenceFinder(tolerance=250).find(straight, detour) == []
+
+    def test_disjoint_geometries_diverge_end_to_end(self):
+        far_away = straight.shift(0, 1000)
+
+        result = DivergenceFinder().find(straight, far_away)
+
+        assert len(result) == 1
+        assert result[0].start1 == 0
+        assert result[0].end1 == pytest.approx(straight.length(), rel=1e-2)
+        assert result[0].max_separation == pytest.approx(1000, rel=1e-2)
+
+    def test_can_be_used_as_comparator(self):
+        finder = DivergenceFinder()
+
+        assert finder.name == "divergence"
+        assert finder(straight, detour) == finder.find(straight, detour)
+
+
+class TestSegmentHash(object):
+    points = np.array([[0.0, 0.0], [10.0, 0.0], [20.0, 0.0], [20.0, 10.0]])
+    measures = np.array([0.0, 10.0, 20.0, 30.0])
+
+    def test_nearest_within_neighbouring_cells(self):
+        distances, projections = SegmentHash(self.points, self.measures, 15).nearest(
+            np.array([[5.0, 3.0], [500.0, 500.0]])
+        )
+
+        assert distances.tolist() == [3.0, np.inf]
+        assert projections[0] == 5.0
+
+    def test_nearest_exhaustive(self):
+        index = SegmentHash(self.points, self.measures, 15)
+
+        distances, projections = index.nearest(
+            np.array([[5.0, 3.0], [-300.0, 0.0], [20.0, 410.0]]), exhaustive=True
+        )
+
+        assert distances.tolist() == pytest.approx([3.0, 300.0, 400.0])
+        assert projections.tolist() == pytest.approx([5.0, 0.0, 30.0])
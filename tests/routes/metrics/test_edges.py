@@ -0,0 +1,142 @@
+import networkx as nx
+import numpy as np
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.geo import GeoCoordinate, Geometry
+from locintel.routes.metrics.edges import (
+    EdgeTable,
+    EdgeSequenceComparator,
+    match_to_edges,
+)
+
+
+@pytest.fixture()
+def graph():
+    """
+    Line graph 0 -> 1 -> 2 -> 3, ~111m per edge, plus detour 1 -> 4 -> 2
+    """
+    g = nx.DiGraph()
+    coords = {
+        0: (0.0, 0.0),
+        1: (0.001, 0.0),
+        2: (0.002, 0.0),
+        3: (0.003, 0.0),
+        4: (0.0015, 0.001),
+    }
+    for node, coord in coords.items():
+        g.add_node(node, data=Mock(coord=GeoCoordinate(*coord)))
+    for u, v in [(0, 1), (1, 2), (2, 3), (1, 4), (4, 2)]:
+        g.add_edge(u, v, data=Mock(geometry=[]))
+    return g
+
+
+straight = [(0, 1), (1, 2), (2, 3)]
+detour = [(0, 1), (1, 4), (4, 2), (2, 3)]
+
+
+class TestEdgeTable(object):
+    def test_lengths(self, graph):
+        table = EdgeTable(graph)
+
+        assert len(table) == 5
+        assert table.length([(0, 1)]) == pytest.approx(111.2, abs=0.5)
+        assert table.length(straight) == pytest.approx(333.6, abs=1)
+
+    def test_lengths_from_edge_geometry(self, graph):
+        graph.edges[0, 1]["data"].geometry = Geometry(
+            [
+                GeoCoordinate(0.0, 0.0),
+                GeoCoordinate(0.0, 0.001),
+                GeoCoordinate(0.001, 0.0),
+            ]
+        )
+
+        table = EdgeTable(graph)
+
+        assert table.length([(0, 1)]) == pytest.approx(111.2 + 157.3, abs=1)
+
+    def test_encode_raises_value_error_on_unknown_edge(self, graph):
+        with pytest.raises(ValueError):
+            EdgeTable(graph).encode([(0, 3)])
+
+
+class TestMatchToEdges(object):
+    def test_match_to_edges_deduplicates_leg_overlaps(self):
+        match = Mock(
+            metadata={
+                "raw": {
+                    "matchings": [
+                        {"legs": [{"nodes": [0, 1, 2]}, {"nodes": [1, 2, 3]}]},
+                        {"legs": [{"nodes": [5, 6]}]},
+                    ]
+                }
+            }
+        )
+
+        assert match_to_edges(match) == [(0, 1), (1, 2), (2, 3), (5, 6)]
+
+
+class TestEdgeSequenceComparator(object):
+    def test_methods(self, graph):
+        comparator = EdgeSequenceComparator(EdgeTable(graph))
+
+        assert sorted(comparator.methods) == [
+            "edit_distance",
+            "jaccard",
+            "lcs",
+            "shared_distance",
+        ]
+
+    def test_invalid_method_raises_attribute_error(self, graph):
+        with pytest.raises(AttributeError):
+            EdgeSequenceComparator(EdgeTable(graph)).compare(straight, detour, "foo")
+
+    def test_jaccard(self, graph):
+        table = EdgeTable(graph)
+        comparator = EdgeSequenceComparator(table)
+        shared = table.length([(0, 1), (2, 3)])
+        union = table.length(straight) + table.length([(1, 4), (4, 2)])
+
+        assert comparator.compare(straight, straight, "jaccard") == 1
+        assert comparator.compare(straight, detour, "jaccard") == pytest.approx(
+            shared / union
+        )
+
+    def test_shared_distance(self, graph):
+        table = EdgeTable(graph)
+        comparator = EdgeSequenceComparator(table)
+
+        result = comparator.compare(straight, detour, "shared_distance")
+
+        assert result == pytest.approx(2 / 3)
+
+    def test_lcs(self, graph):
+        table = EdgeTable(graph)
+        comparator = EdgeSequenceComparator(table)
+
+        assert comparator.compare(straight, detour, "lcs") == pytest.approx(
+            table.length([(0, 1), (2, 3)])
+        )
+        assert comparator.compare(straight, straight, "lcs", normalized=True) == 1
+
+    def test_edit_distance(self, graph):
+        comparator = EdgeSequenceComparator(EdgeTable(graph))
+
+        assert comparator.compare(straight, straight, "edit_distance") == 0
+        assert comparator.compare(straight, detour, "edit_distance") == 2
+        assert comparator.compare(
+            straight, detour, "edit_distance", normalized=True
+        ) == pytest.approx(0.5)
+
+    def test_batch_compare(self, graph):
+        comparator = EdgeSequenceComparator(EdgeTable(graph))
+        pairs = [(straight, straight), (straight, detour), (detour, [(0, 1)])]
+
+        for method in comparator.methods:
+            result = comparator.batch_compare(pairs, method)
+            expected = [comparator.compare(*pair, method) for pair in pairs]
+
+            assert isinstance(result, np.ndarray)
+            assert np.allclose(result, expected)
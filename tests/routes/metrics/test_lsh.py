@@ -0,0 +1,116 @@
+import numpy as np
+
+import pytest
+from unittest.mock import Mock
+
+from locintel.core.datamodel.geo import Geometry, GeoCoordinate
+from locintel.routes.metrics.lsh import geometry_cells, MinHasher, RouteLSHIndex
+
+geometry = Geometry.dummy()
+long_geometry = Geometry(
+    [GeoCoordinate(52.50, 13.30), GeoCoordinate(52.50, 13.33)]
+)  # ~2km, single segment
+
+
+class TestGeometryCells(object):
+    def test_geometry_cells_densifies_long_segments(self):
+        cells = geometry_cells(long_geometry, cell_size=100)
+
+        assert len(cells) >= 20
+
+    def test_geometry_cells_margin_touches_neighbouring_cells(self):
+        along_grid_line = Geometry(
+            [GeoCoordinate(52.50, 13.30), GeoCoordinate(52.50, 13.31)]
+        )
+        north, south = along_grid_line.shift(5, 0), along_grid_line.shift(-5, 0)
+
+        assert not geometry_cells(north, margin=0) & geometry_cells(south, margin=0)
+        assert geometry_cells(north) & geometry_cells(south)
+
+    def test_geometry_cells_is_deterministic(self):
+        assert geometry_cells(geometry) == geometry_cells(Geometry.dummy())
+
+
+class TestMinHasher(object):
+    def test_signature_identical_sets(self):
+        hasher = MinHasher(num_perm=32)
+        cells = {(1, 2), (3, 4), (5, 6)}
+
+        assert MinHasher.jaccard(hasher.signature(cells), hasher.signature(cells)) == 1
+
+    def test_signature_disjoint_sets(self):
+        hasher = MinHasher(num_perm=32)
+
+        result = MinHasher.jaccard(
+            hasher.signature({(1, 2), (3, 4)}), hasher.signature({(7, 8), (9, 10)})
+        )
+
+        assert result < 0.2
+
+    def test_signature_raises_value_error_on_empty_set(self):
+        with pytest.raises(ValueError):
+            MinHasher().signature(set())
+
+
+class TestRouteLSHIndex(object):
+    def test_num_perm_must_be_divisible_by_bands(self):
+        with pytest.raises(ValueError):
+            RouteLSHIndex(num_perm=10, bands=3)
+
+    def test_insert_and_query(self):
+        index = RouteLSHIndex()
+        index.insert("route", geometry)
+
+        result = index.query(Geometry.dummy())
+
+        assert len(index) == 1
+        assert [key for key, _ in result] == ["route"]
+
+    def test_insert_raises_key_error_on_duplicate_key(self):
+        index = RouteLSHIndex()
+        index.insert("route", geometry)
+
+        with pytest.raises(KeyError):
+            index.insert("route", geometry)
+
+    def test_query_far_away_geometry_finds_nothing(self):
+        index = RouteLSHIndex()
+        index.insert("route", geometry)
+        far_away = Geometry([GeoCoordinate(40.0, -3.0), GeoCoordinate(40.01, -3.01)])
+
+        assert index.query(far_away) == []
+
+    def test_query_verifies_candidates_with_comparator(self):
+        index = RouteLSHIndex(threshold=1)
+        index.comparator = Mock(compare=Mock(return_value=5))
+        index.insert("route", geometry)
+
+        result = index.query(geometry)
+
+        assert result == []
+        index.comparator.compare.assert_called_with(geometry, geometry, "hausdorff")
+
+    def test_remove(self):
+        index = RouteLSHIndex()
+        index.insert("route", geometry)
+
+        index.remove("route")
+
+        assert "route" not in index
+        assert index.candidates(geometry) == []
+        assert all(not bucket for bucket in index.buckets)
+
+    def test_dedup(self):
+        index = RouteLSHIndex()
+        items = [
+            ("a", geometry),
+            ("b", Geometry.dummy()),
+            ("c", long_geometry),
+            ("d", Geometry(list(long_geometry.coords))),
+        ]
+
+        result = index.dedup(items)
+
+        assert result == {"a": ["b"], "c": ["d"]}
+        assert len(index) == 2
+        assert np.array_equal(index.signatures["a"], index.signature(geometry))